@@ -7,15 +7,23 @@ transcripts associated with that gene ID.
 Alignment is only performed on protein coding transcripts. For CGP, the in-frame CDS will be aligned using BLAT to the
 in-frame CDS of each protein coding transcript of the assigned parental gene. For transMap and AugustusTM(R)
 transcripts, two alignments we be performed - full mRNA and in-frame CDS.
+
+Pairs whose sequences are identical are not aligned at all; their single block PSL is built directly.
+
+Alignment results are kept in a persistent cache (tools.alignmentCache) shared by all genomes, keyed by the BLAT
+settings and the sequences of each pair. Pairs found in the cache are not aligned again. The cache is only used by the
+leader, which sends the uncached pairs to toil and stores the new alignments once toil is done; toil jobs do not need
+access to the work directory.
 """
-import argparse
 import collections
-import itertools
+import gzip
 import logging
+import os
 
 from toil.common import Toil
 from toil.job import Job
 
+import tools.alignmentCache
 import tools.bio
 import tools.dataOps
 import tools.fileOps
@@ -27,106 +35,147 @@ import tools.sqlInterface
 import tools.toilInterface
 import tools.transcripts
 
+logger = logging.getLogger(__name__)
+
 
 def align_transcripts(args, toil_options):
     """
-    Main entry function for transcript alignment toil pipeline
+    Main entry function for transcript alignment toil pipeline. The pairs to align are found, and looked up in the
+    alignment cache, here on the leader; only the pairs that are not in the cache are sent to toil. The alignments
+    made by toil are written to the cache after they are exported.
     :param args: dictionary of arguments from CAT
     :param toil_options: toil options Namespace object
     """
+    cache = tools.alignmentCache.AlignmentCache(args.alignment_cache)
     with Toil(toil_options) as toil:
         if not toil.options.restart:
-            input_file_ids = argparse.Namespace()
-            input_file_ids.ref_genome_fasta = tools.toilInterface.write_fasta_to_filestore(toil, args.ref_genome_fasta)
-            input_file_ids.genome_fasta = tools.toilInterface.write_fasta_to_filestore(toil, args.genome_fasta)
-            input_file_ids.annotation_gp = toil.importFile('file://' + args.annotation_gp)
-            input_file_ids.ref_db = toil.importFile('file://' + args.ref_db_path)
-            input_file_ids.modes = {}
-            for mode in args.transcript_modes:
-                input_file_ids.modes[mode] = toil.importFile('file://' + args.transcript_modes[mode]['gp'])
-            job = Job.wrapJobFn(setup, args, input_file_ids, memory='16G')
-            results_file_ids = toil.start(job)
+            num_evicted = cache.evict()
+            if num_evicted > 0:
+                logger.info('Evicted {} entries from the alignment cache'.format(num_evicted))
+            input_file_ids = {}
+            for out_path, aln_mode, pairs, skipped in find_alignment_pairs(args, cache):
+                pairs_path = tools.fileOps.get_tmp_file()
+                with open(pairs_path, 'w') as outf:
+                    for pair in pairs:
+                        tools.fileOps.print_row(outf, pair)
+                skipped_path = tools.fileOps.get_tmp_file(suffix='gz')
+                with gzip.open(skipped_path, 'wb') as outf:
+                    for line in skipped:
+                        outf.write(line + '\n')
+                input_file_ids[out_path] = (aln_mode, toil.importFile('file://' + pairs_path),
+                                            toil.importFile('file://' + skipped_path))
+                os.remove(pairs_path)
+                os.remove(skipped_path)
+            if len(input_file_ids) == 0:
+                err_msg = 'Align Transcripts pipeline did not detect any input genePreds for {}'.format(args.genome)
+                raise RuntimeError(err_msg)
+            job = Job.wrapJobFn(setup, args, input_file_ids, memory='8G')
+            results_file_ids, cache_entries_file_id = toil.start(job)
         else:
-            results_file_ids = toil.restart()
+            results_file_ids, cache_entries_file_id = toil.restart()
         for file_path, file_id in results_file_ids.iteritems():
             tools.fileOps.ensure_file_dir(file_path)
             toil.exportFile(file_id, 'file://' + file_path)
+        cache_entries_path = tools.fileOps.get_tmp_file()
+        toil.exportFile(cache_entries_file_id, 'file://' + cache_entries_path)
+    with open(cache_entries_path) as inf:
+        cache.put_many(parse_cache_entry(line) for line in inf)
+    os.remove(cache_entries_path)
 
 
-def setup(job, args, input_file_ids):
+def find_alignment_pairs(args, cache):
     """
-    First function for align_transcripts pipeline. Splits up the genePred entries into chunks that will be aligned
-    with BLAT.
+    Generator that finds the pairs of transcript sequences to align for each output PSL. Pairs with identical
+    sequences, and pairs whose alignment is in the cache, are not aligned; their PSL lines are returned separately.
     :param args: dictionary of arguments from CAT
-    :param input_file_ids: dictionary of fileStore file IDs for the inputs to this pipeline
+    :param cache: AlignmentCache
+    :return: tuples of (output PSL path, alignment mode, list of (tx_id, tx_seq, ref_tx_id, ref_tx_seq) tuples to
+             align, list of PSL lines of the other pairs)
     """
-    job.fileStore.logToMaster('Beginning Align Transcripts run on {}'.format(args.genome), level=logging.INFO)
-    # load all fileStore files necessary
-    annotation_gp = job.fileStore.readGlobalFile(input_file_ids.annotation_gp)
-    ref_genome_db = job.fileStore.readGlobalFile(input_file_ids.ref_db)
-    genome_fasta = tools.toilInterface.load_fasta_from_filestore(job, input_file_ids.genome_fasta,
-                                                                 prefix='genome', upper=False)
-    ref_genome_fasta = tools.toilInterface.load_fasta_from_filestore(job, input_file_ids.ref_genome_fasta,
-                                                                     prefix='ref_genome', upper=False)
+    genome_fasta = tools.bio.get_sequence_dict(args.genome_two_bit, upper=False)
+    ref_genome_fasta = tools.bio.get_sequence_dict(args.ref_genome_two_bit, upper=False)
+    # reference transcripts are aligned once for each alignment to them, so their sequences are cached
+    ref_seq_cache = tools.transcripts.TranscriptSequenceCache(ref_genome_fasta)
     # load required reference data into memory
-    tx_biotype_map = tools.sqlInterface.get_transcript_biotype_map(ref_genome_db)
-    ref_transcript_dict = tools.transcripts.get_gene_pred_dict(annotation_gp)
-    # will hold a mapping of output file paths to lists of Promise objects containing output
-    results = collections.defaultdict(list)
-    # start generating chunks of the transMap/Augustus genePreds which we know the 1-1 alignment for
+    tx_biotype_map = tools.sqlInterface.get_transcript_biotype_map(args.ref_db_path)
+    ref_transcript_dict = tools.transcripts.get_gene_pred_dict(args.annotation_gp, args.parse_cache_dir)
+    # start generating the transMap/Augustus pairs, which we know the 1-1 alignment for
     for tx_mode in ['transMap', 'augTM', 'augTMR']:
         if tx_mode not in args.transcript_modes:
             continue
-        # output file paths
-        mrna_path = args.transcript_modes[tx_mode]['mRNA']
-        cds_path = args.transcript_modes[tx_mode]['CDS']
-        # begin loading transcripts and sequences
-        gp_path = job.fileStore.readGlobalFile(input_file_ids.modes[tx_mode])
-        transcript_dict = tools.transcripts.get_gene_pred_dict(gp_path)
+        transcript_dict = tools.transcripts.get_gene_pred_dict(args.transcript_modes[tx_mode]['gp'])
         transcript_dict = {aln_id: tx for aln_id, tx in transcript_dict.iteritems() if
                            tx_biotype_map[tools.nameConversions.strip_alignment_numbers(aln_id)] == 'protein_coding'}
-        for aln_mode, out_path in zip(*[['mRNA', 'CDS'], [mrna_path, cds_path]]):
+        for aln_mode in ['mRNA', 'CDS']:
+            identical = []
+            cached = []
             seq_iter = get_alignment_sequences(transcript_dict, ref_transcript_dict, genome_fasta,
-                                               ref_genome_fasta, aln_mode)
-            for chunk in group_transcripts(seq_iter):
-                j = job.addChildJobFn(run_blat_chunk, chunk, aln_mode)
-                results[out_path].append(j.rv())
+                                               ref_seq_cache, aln_mode, identical)
+            pairs = list(get_uncached_sequences(seq_iter, cache, aln_mode, cached))
+            log_skipped(identical, cached, tx_mode, aln_mode, args.genome)
+            yield args.transcript_modes[tx_mode][aln_mode], aln_mode, pairs, identical + cached
 
     # if we ran AugustusCGP, align those CDS sequences
     if 'augCGP' in args.transcript_modes:
-        cgp_cds_path = args.transcript_modes['augCGP']['CDS']
         # CGP transcripts have multiple assignments based on the name2 identifier, which contains a gene ID
-        gene_tx_map = tools.sqlInterface.get_gene_transcript_map(ref_genome_db)
-        tx_biotype_map = tools.sqlInterface.get_transcript_biotype_map(ref_genome_db)
-        augustus_cgp_gp = job.fileStore.readGlobalFile(input_file_ids.modes['augCGP'])
-        cgp_transcript_dict = tools.transcripts.get_gene_pred_dict(augustus_cgp_gp)
+        gene_tx_map = tools.sqlInterface.get_gene_transcript_map(args.ref_db_path)
+        cgp_transcript_dict = tools.transcripts.get_gene_pred_dict(args.transcript_modes['augCGP']['gp'])
+        identical = []
+        cached = []
         cgp_transcript_seq_iter = get_cgp_sequences(cgp_transcript_dict, ref_transcript_dict, genome_fasta,
-                                                    ref_genome_fasta, gene_tx_map, tx_biotype_map)
-        for chunk in group_transcripts(cgp_transcript_seq_iter):
-            j = job.addChildJobFn(run_blat_chunk, chunk, 'CDS')
-            results[cgp_cds_path].append(j.rv())
-    if len(results) == 0:
-        err_msg = 'Align Transcripts pipeline did not detect any input genePreds for {}'.format(args.genome)
-        raise RuntimeError(err_msg)
+                                                    ref_seq_cache, gene_tx_map, tx_biotype_map, identical)
+        pairs = list(get_uncached_sequences(cgp_transcript_seq_iter, cache, 'CDS', cached))
+        log_skipped(identical, cached, 'augCGP', 'CDS', args.genome)
+        yield args.transcript_modes['augCGP']['CDS'], 'CDS', pairs, identical + cached
+    logger.info('Reference sequence cache for {} had {} hits and {} misses'.format(
+        args.genome, ref_seq_cache.hits, ref_seq_cache.misses))
+
+
+def setup(job, args, input_file_ids):
+    """
+    First function for align_transcripts pipeline. Splits up the pairs to align into chunks that will be aligned
+    with BLAT.
+    :param args: dictionary of arguments from CAT
+    :param input_file_ids: dictionary of {output PSL path: (alignment mode, fileStore ID of the pairs to align,
+                           fileStore ID of the gzipped PSL lines of the pairs that were not aligned)}
+    """
+    job.fileStore.logToMaster('Beginning Align Transcripts run on {}'.format(args.genome), level=logging.INFO)
+    # will hold a mapping of output file paths to lists of fileStore IDs, or Promises of them, containing output
+    results = collections.defaultdict(list)
+    for out_path, (aln_mode, pairs_file_id, skipped_file_id) in input_file_ids.iteritems():
+        pairs = tools.fileOps.iter_lines(job.fileStore.readGlobalFile(pairs_file_id))
+        for chunk in group_transcripts(pairs, aln_mode, args.target_job_runtime):
+            j = job.addChildJobFn(run_aln_chunk, chunk, aln_mode)
+            results[out_path].append(j.rv())
+        results[out_path].append(skipped_file_id)
     # convert the results Promises into resolved values
     return job.addFollowOnJobFn(merge, results, args).rv()
 
 
-def get_alignment_sequences(transcript_dict, ref_transcript_dict, genome_fasta, ref_genome_fasta, mode):
-    """Generator that yields a tuple of (tx_id, tx_seq, ref_tx_id, ref_tx_seq)"""
+def get_alignment_sequences(transcript_dict, ref_transcript_dict, genome_fasta, ref_seq_cache, mode, identical):
+    """
+    Generator that yields a tuple of (tx_id, tx_seq, ref_tx_id, ref_tx_seq). Pairs with identical sequences are not
+    yielded; their PSL is appended to identical instead. Reference sequences are extracted through ref_seq_cache, a
+    TranscriptSequenceCache of the reference genome.
+    """
     assert mode in ['mRNA', 'CDS']
     for tx_id, tx in transcript_dict.iteritems():
         ref_tx_id = tools.nameConversions.strip_alignment_numbers(tx_id)
         ref_tx = ref_transcript_dict[ref_tx_id]
         tx_seq = tx.get_mrna(genome_fasta) if mode == 'mRNA' else tx.get_cds(genome_fasta, in_frame=True)
-        ref_tx_seq = ref_tx.get_mrna(ref_genome_fasta) if mode == 'mRNA' else ref_tx.get_cds(ref_genome_fasta,
-                                                                                             in_frame=True)
+        if mode == 'mRNA':
+            ref_tx_seq = ref_seq_cache.get_mrna(ref_tx)
+        else:
+            ref_tx_seq = ref_seq_cache.get_cds(ref_tx, in_frame=True)
         if len(ref_tx_seq) > 50 and len(tx_seq) > 50:
-            yield tx_id, tx_seq, ref_tx_id, ref_tx_seq
+            if is_identical(tx_seq, ref_tx_seq):
+                identical.append(identical_psl_string(tx_id, tx_seq, ref_tx_id, ref_tx_seq, mode))
+            else:
+                yield tx_id, tx_seq, ref_tx_id, ref_tx_seq
 
 
-def get_cgp_sequences(transcript_dict, ref_transcript_dict, genome_fasta, ref_genome_fasta, gene_tx_map,
-                      tx_biotype_map):
+def get_cgp_sequences(transcript_dict, ref_transcript_dict, genome_fasta, ref_seq_cache, gene_tx_map,
+                      tx_biotype_map, identical):
     """
     Generator for CGP transcripts. Same as get_alignment_sequences, but will resolve name2 field into all target
     transcripts
@@ -142,18 +191,61 @@ def get_cgp_sequences(transcript_dict, ref_transcript_dict, genome_fasta, ref_ge
             if biotype != 'protein_coding':
                 continue
             ref_tx = ref_transcript_dict[ref_tx_id]
-            ref_tx_seq = ref_tx.get_cds(ref_genome_fasta, in_frame=True)
+            ref_tx_seq = ref_seq_cache.get_cds(ref_tx, in_frame=True)
             assert len(ref_tx_seq) % 3 == 0, ref_tx_id
             if len(ref_tx_seq) > 50 and len(tx_seq) > 50:
-                yield cgp_id, tx_seq, ref_tx_id, ref_tx_seq
+                if is_identical(tx_seq, ref_tx_seq):
+                    identical.append(identical_psl_string(cgp_id, tx_seq, ref_tx_id, ref_tx_seq, 'CDS'))
+                else:
+                    yield cgp_id, tx_seq, ref_tx_id, ref_tx_seq
+
+
+def get_uncached_sequences(seq_iter, cache, mode, cached):
+    """
+    Generator that yields the (tx_id, tx_seq, ref_tx_id, ref_tx_seq) tuples from seq_iter whose alignment is not in
+    the cache. The cached PSL lines of the other pairs are appended to cached instead; pairs that are cached as having
+    failed to align have no PSL line, and are dropped.
+    """
+    pairs = list(seq_iter)
+    keys = [cache_key(tx_seq, ref_tx_seq, mode) for _, tx_seq, _, ref_tx_seq in pairs]
+    hits = cache.get_many(keys)
+    for key, (tx_id, tx_seq, ref_tx_id, ref_tx_seq) in zip(keys, pairs):
+        if key not in hits:
+            yield tx_id, tx_seq, ref_tx_id, ref_tx_seq
+        elif hits[key] is not None:
+            cached.append(tools.alignmentCache.fill_names(hits[key], tx_id, ref_tx_id))
+
+
+# BLAT options for each alignment mode
+BLAT_OPTIONS = {'mRNA': ['-noHead', '-minIdentity=0'],
+                'CDS': ['-t=dnax', '-q=rnax', '-noHead', '-minIdentity=0']}
+
 
+# seconds per base of a pair for each mode. UNCALIBRATED: these are placeholders, not measurements. They are chosen so
+# that a job holds the 10 ** 6 bases of the previous fixed chunks at the default target runtime of 600 seconds, and do
+# not model translated CDS alignment being slower than mRNA alignment. Measure them with calibrate_job_costs.py.
+ALIGNMENT_COST = {'mRNA': 6e-4, 'CDS': 6e-4}
 
-def run_blat_chunk(job, chunk, mode):
+
+def run_aln_chunk(job, chunk, mode):
+    """
+    Aligns a chunk of transcript pairs with BLAT.
+    :param chunk: List of (tx_id, tx_seq, ref_tx_id, ref_tx_seq) tuples
+    :param mode: One of ['mRNA', 'CDS']. Determines what mode of alignment we will perform.
+    :return: fileStore ID of the gzipped cache entries (see cache_entry) of the pairs
+    """
+    results = run_blat_chunk(chunk, mode)
+    return tools.toilInterface.write_lines_to_filestore(
+        job, (cache_entry(cache_key(tx_seq, ref_tx_seq, mode), r)
+              for (_, tx_seq, _, ref_tx_seq), r in zip(chunk, results)))
+
+
+def run_blat_chunk(chunk, mode):
     """
     Runs an alignment chunk through BLAT for either coding or non-coding transcripts
     :param chunk: List of (tx_id, tx_seq, ref_tx_id, ref_tx_seq) tuples
     :param mode: One of ['mRNA', 'CDS']. Determines what mode of alignment we will perform.
-    :return: List of PSL output
+    :return: List of PSL output, one per pair in chunk
     """
     def parse_blat(tmp_psl):
         # filter for only + alignments, as we are expecting to be on the same strand
@@ -170,42 +262,54 @@ def run_blat_chunk(job, chunk, mode):
     tmp_tgt = tools.fileOps.get_tmp_toil_file()
     tmp_psl = tools.fileOps.get_tmp_toil_file()
     tmp_filtered_psl = tools.fileOps.get_tmp_toil_file()
+    cmd = ['blat'] + BLAT_OPTIONS[mode] + [tmp_ref, tmp_tgt, tmp_psl]
     results = []
-    if mode == 'mRNA':
-        cmd = ['blat', '-noHead', '-minIdentity=0', tmp_ref, tmp_tgt, tmp_psl]
-    else:  # mode == CDS. Filter these for problematic alignments that happen in edge cases
-        cmd = ['blat', '-t=dnax', '-q=rnax', '-noHead', '-minIdentity=0', tmp_ref, tmp_tgt, tmp_psl]
     for tx_id, tx_seq, ref_tx_id, ref_tx_seq in chunk:
         with open(tmp_ref, 'w') as tmp_ref_h:
             tools.bio.write_fasta(tmp_ref_h, ref_tx_id, ref_tx_seq)
         with open(tmp_tgt, 'w') as tmp_tgt_h:
             tools.bio.write_fasta(tmp_tgt_h, tx_id, tx_seq)
         tools.procOps.run_proc(cmd)
+        # filter out the malformed alignments BLAT produces in some edge cases. pslCheck exits with an error if it
+        # finds any, but still writes the alignments that passed. The previous pair's output is removed first, so
+        # that a pslCheck failure can never leave it in place to be reported for this pair
+        if os.path.exists(tmp_filtered_psl):
+            os.remove(tmp_filtered_psl)
         try:
             tools.procOps.run_proc(['pslCheck', '-quiet', tmp_psl, '-pass={}'.format(tmp_filtered_psl)])
         except tools.pipeline.ProcException:
             pass
-        results.append(parse_blat(tmp_filtered_psl))
+        results.append(parse_blat(tmp_filtered_psl) if os.path.exists(tmp_filtered_psl) else None)
     return results
 
 
 def merge(job, results, args):
     """
-    Merge together chain files.
-    :param results: dict of list of promises from each alignment chunk for each category
+    Merge together the PSL output of each category. The cache entries of every chunk are collected into one file, which
+    the leader writes to the alignment cache.
+    :param results: dict of lists of fileStore IDs for each category. The last ID of each list holds the PSL lines of
+                    the pairs that were not aligned, the others the cache entries of an alignment chunk.
     :param args: arguments to the pipeline
-    :return:
+    :return: tuple of (dict of {output path: fileStore ID}, fileStore ID of the cache entries)
     """
     job.fileStore.logToMaster('Merging Alignment output for {}'.format(args.genome), level=logging.INFO)
     results_file_ids = {}
-    for gp_category, result_list in results.iteritems():
-        tmp_results_file = tools.fileOps.get_tmp_toil_file()
-        with tools.fileOps.opengz(tmp_results_file, 'w') as outf:
-            for line in itertools.chain.from_iterable(result_list):  # results is list of lists
-                if line is not None:
-                    outf.write(line + '\n')
-        results_file_ids[gp_category] = job.fileStore.writeGlobalFile(tmp_results_file)
-    return results_file_ids
+    tmp_cache_entries_file = tools.fileOps.get_tmp_toil_file()
+    with open(tmp_cache_entries_file, 'w') as cache_outf:
+        for gp_category, result_list in results.iteritems():
+            tmp_results_file = tools.fileOps.get_tmp_toil_file()
+            with open(tmp_results_file, 'w') as outf:
+                for file_id in result_list[:-1]:
+                    with gzip.open(job.fileStore.readGlobalFile(file_id)) as inf:
+                        for line in inf:
+                            cache_outf.write(line)
+                            key, psl = parse_cache_entry(line)
+                            if psl is not None:
+                                outf.write(psl + '\n')
+                    job.fileStore.deleteGlobalFile(file_id)
+                tools.toilInterface.concatenate_from_filestore(job, result_list[-1:], outf)
+            results_file_ids[gp_category] = job.fileStore.writeGlobalFile(tmp_results_file)
+    return results_file_ids, job.fileStore.writeGlobalFile(tmp_cache_entries_file)
 
 
 ###
@@ -213,23 +317,56 @@ def merge(job, results, args):
 ###
 
 
-def group_transcripts(tx_iter, num_bases=10 ** 6, max_seqs=1000):
+def is_identical(tx_seq, ref_tx_seq):
+    """Are these sequences identical? Soft-masking can differ between the genomes, so case is ignored"""
+    return len(tx_seq) == len(ref_tx_seq) and tx_seq.upper() == ref_tx_seq.upper()
+
+
+def identical_psl_string(tx_id, tx_seq, ref_tx_id, ref_tx_seq, mode):
+    """Builds the PSL string for a pair of identical sequences, matching the orientation used for BLAT"""
+    psl = tools.psl.identical_psl(tx_id, tx_seq, ref_tx_id, ref_tx_seq, translated=mode == 'CDS')
+    return '\t'.join(psl.psl_string())
+
+
+def cache_key(tx_seq, ref_tx_seq, mode):
     """
-    Group up transcripts by num_bases, unless that exceeds max_seqs. A greedy implementation of the bin packing problem.
-    Helps speed up the execution of BLAT when faced with very large genes
+    Alignment cache key for a pair, which includes the BLAT options used
     """
-    tx_id, tx_seq, ref_tx_id, ref_tx_seq = tx_iter.next()
-    this_bin = [(tx_id, tx_seq, ref_tx_id, ref_tx_seq)]
-    bin_base_count = len(tx_seq)
-    num_seqs = 1
-    for tx_id, tx_seq, ref_tx_id, ref_tx_seq in tx_iter:
-        bin_base_count += len(tx_seq)
-        num_seqs += 1
-        if bin_base_count >= num_bases or num_seqs >= max_seqs:
-            yield this_bin
-            this_bin = [(tx_id, tx_seq, ref_tx_id, ref_tx_seq)]
-            bin_base_count = len(tx_seq)
-            num_seqs = 1
-        else:
-            this_bin.append((tx_id, tx_seq, ref_tx_id, ref_tx_seq))
-    yield this_bin
+    settings = ' '.join(['blat', mode] + BLAT_OPTIONS[mode])
+    return tools.alignmentCache.AlignmentCache.make_key(settings, tx_seq, ref_tx_seq)
+
+
+def cache_entry(key, psl):
+    """Formats the alignment of a pair as a line holding its cache key and its PSL, if it aligned"""
+    return key if psl is None else '\t'.join([key, psl])
+
+
+def parse_cache_entry(line):
+    """
+    Parses a line written by cache_entry()
+    :return: tuple of (key, PSL string or None)
+    """
+    fields = line.rstrip('\n').split('\t', 1)
+    return fields[0], fields[1] if len(fields) == 2 else None
+
+
+def log_skipped(identical, cached, tx_mode, aln_mode, genome):
+    """Reports the number of pairs that were not aligned because they were identical or already in the cache"""
+    msg = '{} {} {} pairs for {} were identical and {} were found in the alignment cache'
+    logger.info(msg.format(len(identical), tx_mode, aln_mode, genome, len(cached)))
+
+
+def estimate_alignment_cost(tx_seq, ref_tx_seq, mode):
+    """
+    Estimates the time in seconds it takes to align a pair. Time grows linearly with the combined length of the pair.
+    """
+    return ALIGNMENT_COST[mode] * (len(tx_seq) + len(ref_tx_seq))
+
+
+def group_transcripts(tx_iter, mode, target_runtime, max_seqs=1000):
+    """
+    Group up transcripts into chunks that are expected to take target_runtime seconds to align, each with at most
+    max_seqs pairs. See tools.dataOps.cost_partition.
+    """
+    cost_fn = lambda (tx_id, tx_seq, ref_tx_id, ref_tx_seq): estimate_alignment_cost(tx_seq, ref_tx_seq, mode)
+    return tools.dataOps.cost_partition(tx_iter, cost_fn, target_runtime, max_size=max_seqs)
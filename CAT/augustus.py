@@ -8,7 +8,6 @@ If any new gaps are not within a wiggle distance (in transcript space) of origin
 hints to Augustus.
 """
 import argparse
-import itertools
 import logging
 
 from toil.common import Toil
@@ -37,7 +36,7 @@ def augustus(args, coding_gp, toil_options):
     with Toil(toil_options) as toil:
         if not toil.options.restart:
             input_file_ids = argparse.Namespace()
-            input_file_ids.genome_fasta = tools.toilInterface.write_fasta_to_filestore(toil, args.genome_fasta)
+            input_file_ids.genome_two_bit = tools.toilInterface.write_two_bit_to_filestore(toil, args.genome_two_bit)
             input_file_ids.tm_cfg = toil.importFile('file://' + args.tm_cfg)
             input_file_ids.coding_gp = toil.importFile('file://' + coding_gp)
             input_file_ids.ref_psl = toil.importFile('file://' + args.ref_psl)
@@ -65,10 +64,12 @@ def setup(job, args, input_file_ids):
     :param input_file_ids: file ID dictionary of imported files
     :return: completed GTF format results for all jobs
     """
-    def start_jobs(mode, chunk_size, cfg_file_id):
+    def start_jobs(mode, cfg_file_id):
         """loop wrapper that starts jobs for both TM and TMR modes"""
         results = []
-        for chunk in tools.dataOps.grouper(tx_dict.iteritems(), chunk_size):
+        cost_fn = lambda (tx_id, tx): estimate_augustus_cost(tx, mode)
+        for chunk in tools.dataOps.cost_partition(tx_dict.iteritems(), cost_fn, args.target_job_runtime,
+                                                  max_size=AUGUSTUS_CHUNK_SIZE[mode]):
             grouped_recs = {}
             for tx_id, tx in chunk:
                 grouped_recs[tx_id] = [tx,
@@ -89,16 +90,34 @@ def setup(job, args, input_file_ids):
     tm_psl_dict = tools.psl.get_alignment_dict(tm_psl)
     ref_tx_dict = tools.transcripts.get_gene_pred_dict(annotation_gp)
     tx_dict = tools.transcripts.get_gene_pred_dict(coding_gp)
-    tm_results = start_jobs('TM', 100, input_file_ids.tm_cfg)
+    tm_results = start_jobs('TM', input_file_ids.tm_cfg)
     if args.augustus_tmr:
         log_msg = 'Augustus run on {} has a hints database and will run both transMap and transMap-RNAseq modes.'
         job.fileStore.logToMaster(log_msg.format(args.genome), level=logging.INFO)
-        tmr_results = start_jobs('TMR', 50, input_file_ids.tmr_cfg)
+        tmr_results = start_jobs('TMR', input_file_ids.tmr_cfg)
     else:
         tmr_results = None
     return job.addFollowOnJobFn(merge, tm_results, tmr_results).rv()
 
 
+# estimated seconds per base of the region Augustus is run on, for each mode. UNCALIBRATED: these are placeholders, not
+# measurements. They are chosen so that the previous fixed chunks of 100 TM or 50 TMR transcripts spanning 20kb make
+# jobs of about 10 minutes, and chunks are never larger than those fixed chunks. Measure them with
+# calibrate_job_costs.py.
+AUGUSTUS_COST = {'TM': 1e-4, 'TMR': 2e-4}
+AUGUSTUS_CHUNK_SIZE = {'TM': 100, 'TMR': 50}
+
+
+def estimate_augustus_cost(tx, mode, padding=20000):
+    """
+    Estimates the time in seconds it takes to run Augustus on a transcript, which grows linearly with the length of
+    the padded region. Transcripts too large to run have no cost.
+    """
+    if len(tx) > 3 * 10 ** 6:
+        return 0
+    return AUGUSTUS_COST[mode] * (tx.stop - tx.start + 2 * padding)
+
+
 def run_augustus_chunk(job, args, grouped_recs, input_file_ids, mode, cfg_file_id, padding=20000):
     """
     Runs augustus on a chunk of genePred objects.
@@ -108,10 +127,10 @@ def run_augustus_chunk(job, args, grouped_recs, input_file_ids, mode, cfg_file_i
     :param mode: Are we running in TM (1) or TMR (2)?
     :param padding: Number of bases on both side to add to Augustus run
     :param cfg_file_id: File ID for the Augustus cfg file based on if we are in TM or TMR mode
-    :return: Augustus output for this chunk
+    :return: fileStore ID of the gzipped GTF output for this chunk
     """
-    genome_fasta = tools.toilInterface.load_fasta_from_filestore(job, input_file_ids.genome_fasta,
-                                                                 prefix='genome', upper=False)
+    genome_fasta = tools.toilInterface.load_two_bit_from_filestore(job, input_file_ids.genome_two_bit,
+                                                                   prefix='genome', upper=False)
     cfg_file = job.fileStore.readGlobalFile(cfg_file_id)
     if args.augustus_hints_db is not None:
         hints_db_file = job.fileStore.readGlobalFile(input_file_ids.augustus_hints_db)
@@ -135,14 +154,14 @@ def run_augustus_chunk(job, args, grouped_recs, input_file_ids, mode, cfg_file_i
         if transcript is not None:
             results.extend(transcript)
     session.close()
-    return results
+    return tools.toilInterface.write_lines_to_filestore(job, ('\t'.join(map(str, row)) for row in results))
 
 
 def run_augustus(hint, fasta, tm_tx, cfg_file, start, stop, species, mode):
     """
     Runs Augustus.
     :param hint: GFF formatted hint string
-    :param fasta: Pyfasta object
+    :param fasta: TwoBitFile sequence dictionary
     :param tm_tx: GenePredTranscript object
     :param cfg_file: config file
     :param species: species parameter to pass to Augustus
@@ -166,17 +185,18 @@ def run_augustus(hint, fasta, tm_tx, cfg_file, start, stop, species, mode):
 def merge(job, tm_results, tmr_results):
     """
     Merge together chain files.
-    :param tm_results: list of promises from each TM augustus chunk
-    :param tmr_results: list of promises from each TMR augustus chunk (if it exists)
+    :param tm_results: list of fileStore IDs from each TM augustus chunk
+    :param tmr_results: list of fileStore IDs from each TMR augustus chunk (if it exists)
     :return:
     """
     tmp_results_file = tools.fileOps.get_tmp_toil_file()
-    # I have no idea why I have to wrap this in a list() call. Some edge case bug with print_rows()?
-    tools.fileOps.print_rows(tmp_results_file, list(itertools.chain.from_iterable(tm_results)))
+    with open(tmp_results_file, 'w') as outf:
+        tools.toilInterface.concatenate_from_filestore(job, tm_results, outf)
     tm_results_file_id = job.fileStore.writeGlobalFile(tmp_results_file)
     if tmr_results is not None:
         tmp_results_file = tools.fileOps.get_tmp_toil_file()
-        tools.fileOps.print_rows(tmp_results_file, list(itertools.chain.from_iterable(tmr_results)))
+        with open(tmp_results_file, 'w') as outf:
+            tools.toilInterface.concatenate_from_filestore(job, tmr_results, outf)
         tmr_results_file_id = job.fileStore.writeGlobalFile(tmp_results_file)
     else:
         tmr_results_file_id = None
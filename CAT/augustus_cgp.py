@@ -16,7 +16,6 @@
 
 import argparse
 import collections
-import itertools
 import logging
 import os
 
@@ -28,6 +27,7 @@ import tools.fileOps
 import tools.intervals
 import tools.procOps
 import tools.sqlInterface
+import tools.toilInterface
 import tools.transcripts
 
 
@@ -165,12 +165,12 @@ def merge_results(job, args, input_file_ids, gffChunks):
     for genome in args.genomes:
         # merge all gffChunks of one genome
         genome_gffChunks = [d[genome] for d in gffChunks]
-        j = job.addChildJobFn(joinGenes, genome, input_file_ids, genome_gffChunks, memory='8G')
+        j = job.addChildJobFn(joinGenes, args, genome, input_file_ids, genome_gffChunks, memory='8G')
         mergedGffs[genome] = j.rv()
     return mergedGffs
 
 
-def joinGenes(job, genome, input_file_ids, gffChunks):
+def joinGenes(job, args, genome, input_file_ids, gffChunks):
     """
     uses the auxiliary tool 'joingenes' from the
     Augustus package to intelligently merge gene sets
@@ -193,7 +193,7 @@ def joinGenes(job, genome, input_file_ids, gffChunks):
            ['grep', '-P', '\tAUGUSTUS\t(exon|CDS|start_codon|stop_codon|tts|tss)\t']]
     tools.procOps.run_proc(cmd, stdout=jg)
     joined_file_id = job.fileStore.writeGlobalFile(jg)
-    j = job.addFollowOnJobFn(assign_parents, genome, input_file_ids, joined_file_id, memory='8G')
+    j = job.addFollowOnJobFn(assign_parents, args, genome, input_file_ids, joined_file_id, memory='8G')
     return j.rv()
 
 
@@ -233,7 +233,7 @@ def writeGenomeFofn(job, fasta_file_ids):
 ###
 
 
-def assign_parents(job, genome, input_file_ids, joined_gff_file_id):
+def assign_parents(job, args, genome, input_file_ids, joined_gff_file_id):
     """
     Main function for assigning parental genes. Parental gene assignment methodology:
     A) Each CGP transcript is evaluated for overlapping any transMap transcripts. Overlap is defined as having at least
@@ -263,47 +263,94 @@ def assign_parents(job, genome, input_file_ids, joined_gff_file_id):
 
     final_gps = []
     for chrom, tm_tx_by_chromosome in tm_chrom_dict.iteritems():
-        for cgp_chunk in tools.dataOps.grouper(cgp_chrom_dict[chrom].iteritems(), 70):
-            j = job.addChildJobFn(assign_parent_chunk, tm_tx_by_chromosome, cgp_chunk, gene_biotype_map)
+        tm_index = tools.intervals.IntervalIndex(tm_tx_by_chromosome.itervalues())
+        cost_fn = lambda (cgp_tx_id, cgp_tx): estimate_assignment_cost(cgp_tx, tm_index)
+        # every chunk is sent the transMap transcripts of the whole chromosome, so chunks are kept to a size that keeps
+        # this overhead small but still spreads the assignments of a chromosome over several jobs
+        for cgp_chunk in tools.dataOps.cost_partition(cgp_chrom_dict[chrom].iteritems(), cost_fn,
+                                                      args.target_job_runtime, max_size=1000):
+            j = job.addChildJobFn(assign_parent_chunk, tm_index, cgp_chunk, gene_biotype_map)
             final_gps.append(j.rv())
     return job.addFollowOnJobFn(merge_parent_assignment_chunks, final_gps).rv()
 
 
-def assign_parent_chunk(job, tm_tx_by_chromosome, cgp_chunk, gene_biotype_map):
+# seconds to assign a parental gene to a CGP transcript: a fixed cost for each transcript and each of its exons, and the
+# cost of each bedtools jaccard run needed to choose between genes. The transcript and exon costs were measured with
+# calibrate_job_costs.py; the jaccard cost is the measured cost of starting a process with tools.procOps
+ASSIGNMENT_COST = {'transcript': 2e-4, 'exon': 2e-5, 'jaccard': 0.04}
+
+
+def assignment_cost_terms(cgp_tx, tm_index):
+    """
+    Counts the exons of a CGP transcript, and the Jaccard comparisons that may be needed to assign it a parent. If the
+    transMap transcripts overlapping it belong to more than one gene, each of them is counted; resolve_multiple_genes()
+    compares the exon overlapping protein coding ones.
+    :param cgp_tx: GenePredTranscript object
+    :param tm_index: IntervalIndex of transMap transcripts on the same chromosome as cgp_tx
+    :return: tuple of (number of exons, number of Jaccard comparisons)
+    """
+    overlapping_tm_txs = tm_index.overlapping(cgp_tx.interval, stranded=True)
+    if len({tx.name2 for tx in overlapping_tm_txs}) > 1:
+        return cgp_tx.block_count, len(overlapping_tm_txs)
+    return cgp_tx.block_count, 0
+
+
+def estimate_assignment_cost(cgp_tx, tm_index):
     """
-    Runs a chunk of CGP transcripts on the same chromosome as all transMap transcripts in tm_tx_by_chromosome
-    :param tm_tx_by_chromosome: dictionary of GenePredTranscript objects all on the same chromosome
+    Estimates the time in seconds it takes to assign a parent to a CGP transcript. Overlaps are found exon by exon, so
+    the time grows with the number of exons, and every Jaccard comparison runs bedtools.
+    """
+    num_exons, num_jaccard = assignment_cost_terms(cgp_tx, tm_index)
+    return (ASSIGNMENT_COST['transcript'] + ASSIGNMENT_COST['exon'] * num_exons +
+            ASSIGNMENT_COST['jaccard'] * num_jaccard)
+
+
+def assign_parent_chunk(job, tm_index, cgp_chunk, gene_biotype_map):
+    """
+    Runs a chunk of CGP transcripts on the same chromosome as all transMap transcripts in tm_index
+    :param tm_index: IntervalIndex of GenePredTranscript objects all on the same chromosome
     :param cgp_chunk: Iterable of (cgp_tx_id, cgp_tx) tuples to be analyzed
     :param gene_biotype_map: dictionary mapping gene IDs to biotype
-    :return: list of GenePredTranscript objects which have been resolved
+    :return: fileStore ID of a gzipped genePred of the transcripts which have been resolved
     """
     resolved_txs = []
     for cgp_tx_id, cgp_tx in cgp_chunk:
-        overlapping_tm_txs = find_tm_overlaps(cgp_tx, tm_tx_by_chromosome)
-        gene_ids = {tx.name2 for tx in overlapping_tm_txs}
-        if len(gene_ids) == 0:
-            gene_name = cgp_tx.name.split('.')[0]
-        elif len(gene_ids) == 1:
-            gene_name = list(gene_ids)[0]
-        else:
-            gene_name = resolve_multiple_genes(cgp_tx, overlapping_tm_txs, gene_biotype_map)
+        gene_name = assign_parent(cgp_tx, tm_index, gene_biotype_map)
         if gene_name is not None:  # we can resolve this transcript
             cgp_tx.name2 = gene_name
             resolved_txs.append(cgp_tx)
-    return resolved_txs
+    return tools.toilInterface.write_lines_to_filestore(job, ('\t'.join(map(str, tx.get_gene_pred()))
+                                                              for tx in resolved_txs))
+
+
+def assign_parent(cgp_tx, tm_index, gene_biotype_map):
+    """
+    Assigns a parental gene to a CGP transcript. CGP transcripts that overlap no transMap transcripts keep their own
+    gene ID.
+    :param cgp_tx: GenePredTranscript object
+    :param tm_index: IntervalIndex of GenePredTranscript objects on the same chromosome as cgp_tx
+    :param gene_biotype_map: dictionary mapping gene IDs to biotype
+    :return: gene ID, or None if the assignment could not be resolved
+    """
+    overlapping_tm_txs = find_tm_overlaps(cgp_tx, tm_index)
+    gene_ids = {tx.name2 for tx in overlapping_tm_txs}
+    if len(gene_ids) == 0:
+        return cgp_tx.name.split('.')[0]
+    elif len(gene_ids) == 1:
+        return list(gene_ids)[0]
+    return resolve_multiple_genes(cgp_tx, overlapping_tm_txs, gene_biotype_map)
 
 
 def merge_parent_assignment_chunks(job, final_gps):
     """
     Merge the chunks of transcripts produced by assign_parent_chunk, converting back to GFF
-    :param final_gps: list of lists of GenePredTranscript objects
+    :param final_gps: list of fileStore IDs of genePreds from each chunk
     :return: fileStore ID to a output GFF
     """
     out_gp = tools.fileOps.get_tmp_toil_file()
     out_gff = tools.fileOps.get_tmp_toil_file()
     with open(out_gp, 'w') as outf:
-        for rec in itertools.chain.from_iterable(final_gps):
-            tools.fileOps.print_row(outf, rec.get_gene_pred())
+        tools.toilInterface.concatenate_from_filestore(job, final_gps, outf)
     cmd = ['genePredToGtf', '-utr', '-honorCdsStat', '-source=AugustusCGP', 'file', out_gp, out_gff]
     tools.procOps.run_proc(cmd)
     return job.fileStore.writeGlobalFile(out_gff)
@@ -324,23 +371,36 @@ def create_chrom_dict(tx_dict):
     return chrom_dict
 
 
-def find_tm_overlaps(cgp_tx, tm_tx_dict):
-    """Find overlap with transMap transcripts first on a genomic scale then an exonic scale"""
+def find_tm_overlaps(cgp_tx, tm_index):
+    """
+    Find overlap with transMap transcripts first on a genomic scale then an exonic scale
+    :param cgp_tx: GenePredTranscript object
+    :param tm_index: tools.intervals.IntervalIndex of transMap transcripts on the same chromosome as cgp_tx
+    :return: list of overlapping transMap transcripts
+    """
     r = []
-    for tx in tm_tx_dict.itervalues():
-        if tx.interval.intersection(cgp_tx.interval) is not None:
-            # make sure that we have exon overlap
-            if ensure_exon_overlap(tx, cgp_tx) is True:
-                r.append(tx)
+    for tx in tm_index.overlapping(cgp_tx.interval, stranded=True):
+        # make sure that we have exon overlap
+        if ensure_exon_overlap(tx, cgp_tx) is True:
+            r.append(tx)
     return r
 
 
 def ensure_exon_overlap(tx, cgp_tx):
-    """Do these two transcripts have at least 1 exonic base of overlap?"""
-    for tm_exon in tx.exon_intervals:
-        for cgp_exon in cgp_tx.exon_intervals:
-            if tm_exon.overlap(cgp_exon) is True:
-                return True
+    """
+    Do these two transcripts have at least 1 exonic base of overlap?
+    Walks both sorted exon lists together, always advancing whichever exon ends first.
+    """
+    tm_exons = tx.exon_intervals
+    cgp_exons = cgp_tx.exon_intervals
+    i = j = 0
+    while i < len(tm_exons) and j < len(cgp_exons):
+        if tm_exons[i].overlap(cgp_exons[j]) is True:
+            return True
+        if tm_exons[i].stop <= cgp_exons[j].stop:
+            i += 1
+        else:
+            j += 1
     return False
 
 
@@ -2,6 +2,7 @@
 Base tasks used by the pipeline. 
 """
 import argparse
+import copy
 import json
 import os
 import shutil
@@ -107,6 +108,8 @@ class PipelineTask(luigi.Task):
     resolve_split_genes = luigi.BoolParameter(default=False)
     cgp_splice_support = luigi.FloatParameter(default=0.8, significant=False)
     cgp_num_exons = luigi.IntParameter(default=3, significant=False)
+    # estimated runtime of each toil job, used to split up alignment and Augustus work
+    target_job_runtime = luigi.IntParameter(default=600, significant=False)
     # Toil options
     batchSystem = luigi.Parameter(default='singleMachine', significant=False)
     maxCores = luigi.IntParameter(default=32, significant=False)
@@ -127,20 +130,61 @@ class PipelineTask(luigi.Task):
         else:
             return 'Task: {}'.format(self.__class__.__name__)
 
+    # process-wide caches used by get_pipeline_args(). luigi calls get_pipeline_args() from nearly every output()
+    # and requires(), and resolving the arguments shells out to halStats and reflects the hints database.
+    _pipeline_args_cache = {}
+    _hal_genomes_cache = {}
+    _hints_db_rnaseq_cache = {}
+    pipeline_args_cache_hits = 0
+
     def get_pipeline_args(self):
-        """returns a namespace of all of the arguments to the pipeline. Resolves the target genomes variable"""
+        """
+        returns a namespace of all of the arguments to the pipeline. Resolves the target genomes variable.
+
+        The namespace is resolved once per process for each distinct set of PipelineTask parameters and cached.
+        Module-specific parameters (such as genome or mode) do not affect the result and so are not part of the key.
+        """
+        key = tuple((name, getattr(self, name)) for name, param in PipelineTask.get_params())
+        if key in PipelineTask._pipeline_args_cache:
+            PipelineTask.pipeline_args_cache_hits += 1
+            return copy.copy(PipelineTask._pipeline_args_cache[key])
+        args = self._resolve_pipeline_args()
+        PipelineTask._pipeline_args_cache[key] = args
+        return copy.copy(args)
+
+    @staticmethod
+    def get_hal_genomes(hal):
+        """Wrapper for tools.hal.extract_genomes() that only calls halStats once per HAL file"""
+        hal = os.path.abspath(hal)
+        if hal not in PipelineTask._hal_genomes_cache:
+            PipelineTask._hal_genomes_cache[hal] = tuple(tools.hal.extract_genomes(hal))
+        return PipelineTask._hal_genomes_cache[hal]
+
+    @staticmethod
+    def get_hints_db_has_rnaseq(hints_db):
+        """Wrapper for tools.hintsDatabaseInterface.hints_db_has_rnaseq() that only reflects a database once"""
+        hints_db = os.path.abspath(hints_db)
+        if hints_db not in PipelineTask._hints_db_rnaseq_cache:
+            r = tools.hintsDatabaseInterface.hints_db_has_rnaseq(hints_db)
+            PipelineTask._hints_db_rnaseq_cache[hints_db] = r
+        return PipelineTask._hints_db_rnaseq_cache[hints_db]
+
+    def _resolve_pipeline_args(self):
+        """constructs the namespace returned by get_pipeline_args()"""
         args = HashableNamespace()
         args.hal = os.path.abspath(self.hal)
         args.ref_genome = self.ref_genome
         args.annotation = os.path.abspath(self.annotation)
         args.out_dir = os.path.abspath(self.out_dir)
         args.work_dir = os.path.abspath(self.work_dir)
+        # parsed reference annotation files are cached here (see tools.fileOps.load_cached_parse)
+        args.parse_cache_dir = os.path.join(args.work_dir, 'parse_cache')
         args.augustus = self.augustus
         args.augustus_cgp = self.augustus_cgp
         args.augustus_species = self.augustus_species
         if self.augustus_hints_db is not None:
             args.augustus_hints_db = os.path.abspath(self.augustus_hints_db)
-            args.hints_db_has_rnaseq = tools.hintsDatabaseInterface.hints_db_has_rnaseq(self.augustus_hints_db)
+            args.hints_db_has_rnaseq = PipelineTask.get_hints_db_has_rnaseq(self.augustus_hints_db)
             if self.augustus is True and args.hints_db_has_rnaseq is True:
                 args.augustus_tmr = True
             else:
@@ -160,7 +204,7 @@ class PipelineTask(luigi.Task):
             args.cgp_param = os.path.abspath(self.cgp_param)
         else:
             args.cgp_param = None
-        args.hal_genomes = tuple(tools.hal.extract_genomes(self.hal))
+        args.hal_genomes = PipelineTask.get_hal_genomes(self.hal)
         if self.target_genomes is None:
             target_genomes = tuple(set(args.hal_genomes) - {self.ref_genome})
         else:
@@ -168,9 +212,10 @@ class PipelineTask(luigi.Task):
         args.target_genomes = target_genomes
         args.modes = PipelineTask.get_modes(args)
         args.dbs = PipelineTask.get_databases(args)
-        args.max_cores = self.maxCores  # used for HGM
+        args.max_cores = self.maxCores  # used for HGM, EvaluateTranscripts and Consensus
         args.cgp_splice_support = self.cgp_splice_support
         args.cgp_num_exons = self.cgp_num_exons
+        args.target_job_runtime = self.target_job_runtime
         return args
 
     def get_module_args(self, module, **args):
@@ -0,0 +1,226 @@
+"""
+Measures the runtime of the work that is split up into toil jobs by its estimated cost (see
+tools.dataOps.cost_partition), and fits the cost models used to estimate it:
+
+alignment:  align_transcripts.ALIGNMENT_COST, seconds per base of a transcript pair, for one mode.
+augustus:   augustus.AUGUSTUS_COST, seconds per base of the region Augustus is run on, for one mode.
+assignment: augustus_cgp.ASSIGNMENT_COST, seconds per CGP transcript and per CGP exon of parental gene assignment.
+
+Each subcommand runs the same functions as the toil jobs on a random sample of the inputs and outputs of a finished
+CAT run, and reports the fitted coefficients next to the ones currently in use. The per-job overhead of toil is not
+included. Run it on the same kind of machine as the jobs will run on.
+
+Examples, with paths from the work directory of a CAT run:
+
+python calibrate_job_costs.py alignment --mode CDS --ref-genome-two-bit genome_files/ref.2bit \
+    --genome-two-bit genome_files/genome1.2bit --annotation-gp reference/ref.gp --gp transMap/genome1.filtered.gp
+
+python calibrate_job_costs.py augustus --mode TM --genome-two-bit genome_files/genome1.2bit \
+    --gp transMap/genome1.filtered.gp --tm-psl transMap/genome1.psl --ref-psl reference/ref.psl
+
+python calibrate_job_costs.py assignment --ref-db-path database/ref.db --tm-gp transMap/genome1.filtered.gp \
+    --cgp-gp augustus_cgp/genome1.gp
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import align_transcripts
+import augustus
+import augustus_cgp
+import tools.bio
+import tools.intervals
+import tools.nameConversions
+import tools.psl
+import tools.sqlInterface
+import tools.tm2hints
+import tools.transcripts
+from tools.hintsDatabaseInterface import reflect_hints_db, get_rnaseq_hints
+
+
+def sample_dict(d, sample_size, seed):
+    """Returns a random sample of sample_size items of d in a reproducible order"""
+    keys = sorted(d.iterkeys())
+    if sample_size < len(keys):
+        keys = random.Random(seed).sample(keys, sample_size)
+    return [(k, d[k]) for k in keys]
+
+
+def fit_rate(units, seconds):
+    """Fits seconds = rate * units, weighting each measurement by its size so that the total time is preserved"""
+    return sum(seconds) / float(sum(units))
+
+
+def fit_assignment(measurements):
+    """
+    Fits seconds = transcript + exon * exons + jaccard * comparisons by least squares
+    :param measurements: list of (exon count, Jaccard comparison count, seconds) tuples
+    :return: dict of the fitted coefficients, keyed like augustus_cgp.ASSIGNMENT_COST
+    """
+    exons, jaccards, seconds = zip(*measurements)
+    design = np.column_stack([np.ones(len(exons)), exons, jaccards])
+    fit = np.linalg.lstsq(design, np.array(seconds), rcond=None)[0]
+    return dict(zip(['transcript', 'exon', 'jaccard'], fit))
+
+
+def measure_alignment(args):
+    """
+    Times the alignment of chunks of pairs, the same way align_transcripts.run_aln_chunk does
+    :return: list of (bases, seconds) tuples, one per chunk
+    """
+    genome_fasta = tools.bio.get_sequence_dict(args.genome_two_bit, upper=False)
+    ref_seq_cache = tools.transcripts.TranscriptSequenceCache(tools.bio.get_sequence_dict(args.ref_genome_two_bit,
+                                                                                          upper=False))
+    ref_transcript_dict = tools.transcripts.get_gene_pred_dict(args.annotation_gp)
+    transcript_dict = dict(sample_dict(tools.transcripts.get_gene_pred_dict(args.gp), args.sample_size, args.seed))
+    pairs = list(align_transcripts.get_alignment_sequences(transcript_dict, ref_transcript_dict, genome_fasta,
+                                                           ref_seq_cache, args.mode, []))
+    measurements = []
+    for i in xrange(0, len(pairs), args.chunk_size):
+        chunk = pairs[i:i + args.chunk_size]
+        start = time.time()
+        align_transcripts.run_blat_chunk(chunk, args.mode)
+        bases = sum(len(tx_seq) + len(ref_tx_seq) for _, tx_seq, _, ref_tx_seq in chunk)
+        measurements.append((bases, time.time() - start))
+    return measurements
+
+
+def measure_augustus(args, padding=20000):
+    """
+    Times Augustus on each transcript, the same way augustus.run_augustus_chunk does
+    :return: list of (region size, seconds) tuples, one per transcript
+    """
+    genome_fasta = tools.bio.get_sequence_dict(args.genome_two_bit, upper=False)
+    tm_psl_dict = tools.psl.get_alignment_dict(args.tm_psl)
+    ref_psl_dict = tools.psl.get_alignment_dict(args.ref_psl)
+    if args.hints_db is not None:
+        speciesnames, seqnames, hints, featuretypes, session = reflect_hints_db(args.hints_db)
+    measurements = []
+    for tx_id, tm_tx in sample_dict(tools.transcripts.get_gene_pred_dict(args.gp), args.sample_size, args.seed):
+        if len(tm_tx) > 3 * 10 ** 6:  # no huge transcripts
+            continue
+        start_time = time.time()
+        start = max(tm_tx.start - padding, 0)
+        stop = min(tm_tx.stop + padding, len(genome_fasta[tm_tx.chromosome]))
+        hint = tools.tm2hints.tm_to_hints(tm_tx, tm_psl_dict[tx_id],
+                                          ref_psl_dict[tools.nameConversions.remove_alignment_number(tx_id)])
+        if args.hints_db is not None:
+            hint += get_rnaseq_hints(args.genome, tm_tx.chromosome, start, stop, speciesnames, seqnames, hints,
+                                     featuretypes, session)
+        augustus.run_augustus(hint, genome_fasta, tm_tx, args.cfg, start, stop, args.augustus_species, args.mode)
+        measurements.append((stop - start, time.time() - start_time))
+    if args.hints_db is not None:
+        session.close()
+    return measurements
+
+
+def measure_assignment(args):
+    """
+    Times parental gene assignment of each CGP transcript, the same way augustus_cgp.assign_parent_chunk does
+    :return: list of (exon count, Jaccard comparison count, seconds) tuples, one per CGP transcript
+    """
+    gene_biotype_map = tools.sqlInterface.get_gene_biotype_map(args.ref_db_path)
+    tm_chrom_dict = augustus_cgp.create_chrom_dict(tools.transcripts.get_gene_pred_dict(args.tm_gp))
+    tm_indices = {chrom: tools.intervals.IntervalIndex(tm_txs.itervalues())
+                  for chrom, tm_txs in tm_chrom_dict.iteritems()}
+    measurements = []
+    for cgp_tx_id, cgp_tx in sample_dict(tools.transcripts.get_gene_pred_dict(args.cgp_gp), args.sample_size,
+                                         args.seed):
+        if cgp_tx.chromosome not in tm_indices:  # assign_parents only runs chromosomes with transMap transcripts
+            continue
+        tm_index = tm_indices[cgp_tx.chromosome]
+        num_exons, num_jaccard = augustus_cgp.assignment_cost_terms(cgp_tx, tm_index)
+        start = time.time()
+        gene_name = augustus_cgp.assign_parent(cgp_tx, tm_index, gene_biotype_map)
+        if gene_name is not None:
+            cgp_tx.name2 = gene_name
+            '\t'.join(map(str, cgp_tx.get_gene_pred()))
+        measurements.append((num_exons, num_jaccard, time.time() - start))
+    return measurements
+
+
+def report_alignment(args, measurements):
+    bases, seconds = zip(*measurements)
+    print 'Aligned {} chunks of up to {} pairs with {} bases in {:.1f} seconds'.format(
+        len(measurements), args.chunk_size, sum(bases), sum(seconds))
+    print "ALIGNMENT_COST['{}']: measured {:.3g}, in use {:.3g}".format(args.mode, fit_rate(bases, seconds),
+                                                                       align_transcripts.ALIGNMENT_COST[args.mode])
+
+
+def report_augustus(args, measurements):
+    bases, seconds = zip(*measurements)
+    print 'Ran Augustus on {} regions of {} bases in {:.1f} seconds'.format(len(measurements), sum(bases),
+                                                                          sum(seconds))
+    print "AUGUSTUS_COST['{}']: measured {:.3g}, in use {:.3g}".format(args.mode, fit_rate(bases, seconds),
+                                                                      augustus.AUGUSTUS_COST[args.mode])
+
+
+def report_assignment(args, measurements):
+    exons, jaccards, seconds = zip(*measurements)
+    fit = fit_assignment(measurements)
+    print 'Assigned {} CGP transcripts with {} exons and {} possible Jaccard comparisons in {:.1f} seconds'.format(
+        len(measurements), sum(exons), sum(jaccards), sum(seconds))
+    for name in ['transcript', 'exon', 'jaccard']:
+        print "ASSIGNMENT_COST['{}']: measured {:.3g}, in use {:.3g}".format(name, fit[name],
+                                                                            augustus_cgp.ASSIGNMENT_COST[name])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sample-size', default=1000, type=int, help='Number of transcripts to measure')
+    parser.add_argument('--seed', default=1, type=int)
+    subparsers = parser.add_subparsers(dest='command')
+    aln_parser = subparsers.add_parser('alignment')
+    aln_parser.add_argument('--mode', choices=['mRNA', 'CDS'], required=True)
+    aln_parser.add_argument('--chunk-size', default=50, type=int, help='Number of pairs aligned together')
+    aln_parser.add_argument('--ref-genome-two-bit', required=True)
+    aln_parser.add_argument('--genome-two-bit', required=True)
+    aln_parser.add_argument('--annotation-gp', required=True)
+    aln_parser.add_argument('--gp', required=True, help='transMap or AugustusTM(R) genePred')
+    aug_parser = subparsers.add_parser('augustus')
+    aug_parser.add_argument('--mode', choices=['TM', 'TMR'], required=True)
+    aug_parser.add_argument('--genome-two-bit', required=True)
+    aug_parser.add_argument('--gp', required=True, help='transMap genePred')
+    aug_parser.add_argument('--tm-psl', required=True)
+    aug_parser.add_argument('--ref-psl', required=True)
+    aug_parser.add_argument('--cfg', default=None, help='Defaults to the TM or TMR cfg in augustus_cfgs')
+    aug_parser.add_argument('--augustus-species', default='human')
+    aug_parser.add_argument('--hints-db', default=None, help='Required for TMR')
+    aug_parser.add_argument('--genome', default=None, help='Genome name in the hints database')
+    assignment_parser = subparsers.add_parser('assignment')
+    assignment_parser.add_argument('--ref-db-path', required=True)
+    assignment_parser.add_argument('--tm-gp', required=True, help='transMap genePred')
+    assignment_parser.add_argument('--cgp-gp', required=True, help='AugustusCGP genePred')
+    args = parser.parse_args(argv)
+    if args.command == 'augustus':
+        if args.mode == 'TMR' and (args.hints_db is None or args.genome is None):
+            parser.error('TMR mode requires --hints-db and --genome')
+        if args.cfg is None:
+            cfg = 'extrinsic.ETM1.cfg' if args.mode == 'TM' else 'extrinsic.ETM2.cfg'
+            args.cfg = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'augustus_cfgs', cfg)
+    # temporary files are written to the working directory, so paths are made absolute before moving to a temporary one
+    for key, val in vars(args).iteritems():
+        if isinstance(val, str) and os.path.exists(val):
+            setattr(args, key, os.path.abspath(val))
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    measure, report = {'alignment': [measure_alignment, report_alignment],
+                       'augustus': [measure_augustus, report_augustus],
+                       'assignment': [measure_assignment, report_assignment]}[args.command]
+    tmp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(tmp_dir)
+    try:
+        measurements = measure(args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+    report(args, measurements)
@@ -33,7 +33,7 @@ from augustus_cgp import augustus_cgp
 from base_tasks import PipelineTask, PipelineWrapperTask, ToilTask, AbstractAtomicFileTask
 from chaining import chaining
 from classify import classify
-from consensus import generate_consensus
+from consensus import consensus_genomes
 from filter_transmap import filter_transmap
 from hgm import hgm, parse_hgm_gtf
 from transmap_classify import transmap_classify
@@ -135,7 +135,7 @@ class GenomeFiles(PipelineWrapperTask):
     """
     WrapperTask for producing all genome files.
 
-    GenomeFiles -> GenomeFasta -> GenomeTwoBit -> GenomeFlatFasta -> GenomeFastaIndex
+    GenomeFiles -> GenomeFasta -> GenomeTwoBit
                 -> GenomeSizes
 
     """
@@ -147,7 +147,6 @@ class GenomeFiles(PipelineWrapperTask):
         args.fasta = os.path.join(base_dir, genome + '.fa')
         args.two_bit = os.path.join(base_dir, genome + '.2bit')
         args.sizes = os.path.join(base_dir, genome + '.chrom.sizes')
-        args.flat_fasta = os.path.join(base_dir, genome + '.fa.flat')
         return args
 
     def validate(self):
@@ -156,8 +155,6 @@ class GenomeFiles(PipelineWrapperTask):
                     raise ToolMissingException('{} from the HAL tools package not in global path'.format(haltool))
         if not tools.misc.is_exec('faToTwoBit'):
             raise ToolMissingException('faToTwoBit tool from the Kent tools package not in global path.')
-        if not tools.misc.is_exec('pyfasta'):
-            raise ToolMissingException('pyfasta wrapper not found in global path.')
 
     def requires(self):
         self.validate()
@@ -167,7 +164,6 @@ class GenomeFiles(PipelineWrapperTask):
             yield self.clone(GenomeFasta, **vars(args))
             yield self.clone(GenomeTwoBit, **vars(args))
             yield self.clone(GenomeSizes, **vars(args))
-            yield self.clone(GenomeFlatFasta, **vars(args))
 
 
 class GenomeFasta(AbstractAtomicFileTask):
@@ -190,7 +186,6 @@ class GenomeFasta(AbstractAtomicFileTask):
 class GenomeTwoBit(AbstractAtomicFileTask):
     """
     Produce a 2bit file from a fasta file. Requires kent tool faToTwoBit.
-    Needs to be done BEFORE we flatten.
     """
     two_bit = luigi.Parameter()
 
@@ -219,27 +214,11 @@ class GenomeSizes(AbstractAtomicFileTask):
         self.run_cmd(cmd)
 
 
-@requires(GenomeTwoBit)
-class GenomeFlatFasta(AbstractAtomicFileTask):
-    """
-    Flattens a genome fasta in-place using pyfasta. Requires the pyfasta package.
-    """
-    flat_fasta = luigi.Parameter()
-
-    def output(self):
-        return luigi.LocalTarget(self.flat_fasta)
-
-    def run(self):
-        logger.info('Flattening fasta for {}.'.format(self.genome))
-        cmd = ['pyfasta', 'flatten', self.fasta]
-        tools.procOps.run_proc(cmd)
-
-
 class ReferenceFiles(PipelineWrapperTask):
     """
     WrapperTask for producing annotation files.
 
-    ReferenceFiles -> Gff3ToGenePred -> TranscriptBed -> TranscriptFasta -> FlatTranscriptFasta
+    ReferenceFiles -> Gff3ToGenePred -> TranscriptBed -> TranscriptFasta
                             V
                          FakePsl
     """
@@ -250,7 +229,6 @@ class ReferenceFiles(PipelineWrapperTask):
         args = argparse.Namespace()
         args.annotation_gp = os.path.join(base_dir, annotation + '.gp')
         args.transcript_fasta = os.path.join(base_dir, annotation + '.fa')
-        args.transcript_flat_fasta = os.path.join(base_dir, annotation + '.fa.flat')
         args.transcript_bed = os.path.join(base_dir, annotation + '.bed')
         args.ref_psl = os.path.join(base_dir, annotation + '.psl')
         args.__dict__.update(**vars(GenomeFiles.get_args(pipeline_args, pipeline_args.ref_genome)))
@@ -269,7 +247,6 @@ class ReferenceFiles(PipelineWrapperTask):
         yield self.clone(Gff3ToAttrs, **vars(args))
         yield self.clone(TranscriptBed, **vars(args))
         yield self.clone(TranscriptFasta, **vars(args))
-        yield self.clone(FlatTranscriptFasta, **vars(args))
         yield self.clone(FakePsl, **vars(args))
 
 
@@ -344,7 +321,7 @@ class TranscriptBed(AbstractAtomicFileTask):
         self.run_cmd(cmd)
 
 
-@multiple_requires(GenomeFlatFasta, TranscriptBed)
+@multiple_requires(GenomeTwoBit, TranscriptBed)
 class TranscriptFasta(AbstractAtomicFileTask):
     """
     Produces a fasta for each transcript.
@@ -356,30 +333,13 @@ class TranscriptFasta(AbstractAtomicFileTask):
 
     def run(self):
         logger.info('Extracting reference annotation fasta.')
-        seq_dict = tools.bio.get_sequence_dict(self.fasta, upper=False)
+        seq_dict = tools.bio.get_sequence_dict(self.two_bit, upper=False)
         seqs = {tx.name: tx.get_mrna(seq_dict) for tx in tools.transcripts.transcript_iterator(self.transcript_bed)}
         with self.output().open('w') as outf:
             for name, seq in seqs.iteritems():
                 tools.bio.write_fasta(outf, name, seq)
 
 
-@requires(TranscriptFasta)
-class FlatTranscriptFasta(AbstractAtomicFileTask):
-    """
-    Flattens the transcript fasta for pyfasta.
-    """
-    transcript_fasta = luigi.Parameter()
-    transcript_flat_fasta = luigi.Parameter()
-
-    def output(self):
-        return luigi.LocalTarget(self.transcript_flat_fasta)
-
-    def run(self):
-        logger.info('Flattening reference annotation fasta.')
-        cmd = ['pyfasta', 'flatten', self.transcript_fasta]
-        tools.procOps.run_proc(cmd)
-
-
 @multiple_requires(Gff3ToGenePred, GenomeSizes)
 class FakePsl(AbstractAtomicFileTask):
     """
@@ -561,8 +521,9 @@ class EvaluateTransMap(PipelineWrapperTask):
         args.annotation_gp = tm_args.annotation_gp
         args.annotation_gp = ReferenceFiles.get_args(pipeline_args).annotation_gp
         args.genome = genome
-        args.fasta = GenomeFiles.get_args(pipeline_args, genome).fasta
+        args.two_bit = GenomeFiles.get_args(pipeline_args, genome).two_bit
         args.ref_genome = pipeline_args.ref_genome
+        args.parse_cache_dir = pipeline_args.parse_cache_dir
         return args
 
     def validate(self):
@@ -588,6 +549,7 @@ class EvaluateTransMapDriverTask(PipelineTask):
         """Load the results into the SQLite database"""
         with tools.sqlite.ExclusiveSqlConnection(self.tm_eval_args.db_path) as engine:
             df.to_sql(self.table, engine, if_exists='replace')
+            tools.sqlInterface.create_long_format_view(engine, tools.sqlInterface.TmEval)
             self.output().touch()
             logger.info('Loaded table: {}.{}'.format(self.genome, self.table))
 
@@ -696,7 +658,7 @@ class Augustus(PipelineWrapperTask):
         args = argparse.Namespace()
         args.ref_genome = pipeline_args.ref_genome
         args.genome = genome
-        args.genome_fasta = GenomeFiles.get_args(pipeline_args, genome).fasta
+        args.genome_two_bit = GenomeFiles.get_args(pipeline_args, genome).two_bit
         args.annotation_gp = ReferenceFiles.get_args(pipeline_args).annotation_gp
         args.ref_db_path = PipelineTask.get_database(pipeline_args, pipeline_args.ref_genome)
         args.filtered_tm_gp = FilterTransMap.get_args(pipeline_args, genome).filtered_tm_gp
@@ -709,6 +671,7 @@ class Augustus(PipelineWrapperTask):
         args.tm_cfg = pipeline_args.tm_cfg
         args.tmr_cfg = pipeline_args.tmr_cfg
         args.augustus_species = pipeline_args.augustus_species
+        args.target_job_runtime = pipeline_args.target_job_runtime
         if pipeline_args.augustus_tmr:
             args.augustus_tmr = True
             args.augustus_tmr_gp = os.path.join(base_dir, genome + '.augTMR.gp')
@@ -811,6 +774,7 @@ class AugustusCgp(ToilTask):
         args.hints_db = hints_db
         args.ref_db_path = PipelineTask.get_database(pipeline_args, pipeline_args.ref_genome)
         args.query_sizes = GenomeFiles.get_args(pipeline_args, pipeline_args.ref_genome).sizes
+        args.target_job_runtime = pipeline_args.target_job_runtime
         return args
 
     def output(self):
@@ -959,7 +923,7 @@ class Hgm(PipelineWrapperTask):
             raise ToolMissingException('bedtools is required for the homGeneMapping module.')
         if pipeline_args.augustus_hints_db is None:
             raise InvalidInputException('Cannot run homGeneMapping module without a hints database.')
-        if tools.hintsDatabaseInterface.hints_db_has_rnaseq(pipeline_args.augustus_hints_db) is False:
+        if PipelineTask.get_hints_db_has_rnaseq(pipeline_args.augustus_hints_db) is False:
             raise UserException('homGeneMapping should not be ran on a hints database without RNA-seq.')
 
     def requires(self):
@@ -1028,10 +992,14 @@ class AlignTranscripts(PipelineWrapperTask):
         args = argparse.Namespace()
         args.ref_genome = pipeline_args.ref_genome
         args.genome = genome
-        args.ref_genome_fasta = GenomeFiles.get_args(pipeline_args, pipeline_args.ref_genome).fasta
-        args.genome_fasta = GenomeFiles.get_args(pipeline_args, genome).fasta
+        args.ref_genome_two_bit = GenomeFiles.get_args(pipeline_args, pipeline_args.ref_genome).two_bit
+        args.genome_two_bit = GenomeFiles.get_args(pipeline_args, genome).two_bit
         args.annotation_gp = ReferenceFiles.get_args(pipeline_args).annotation_gp
         args.ref_db_path = PipelineTask.get_database(pipeline_args, pipeline_args.ref_genome)
+        args.target_job_runtime = pipeline_args.target_job_runtime
+        args.parse_cache_dir = pipeline_args.parse_cache_dir
+        # alignment results are cached across genomes and runs
+        args.alignment_cache = os.path.join(base_dir, 'alignment_cache.db')
         # the alignment_modes members hold the input genePreds and the mRNA/CDS alignment output paths
         args.transcript_modes = {'transMap': {'gp': FilterTransMap.get_args(pipeline_args, genome).filtered_tm_gp,
                                               'mRNA': os.path.join(base_dir, genome + '.transMap.mRNA.psl'),
@@ -1111,11 +1079,14 @@ class EvaluateTranscripts(PipelineWrapperTask):
         args.db_path = pipeline_args.dbs[genome]
         args.ref_db_path = PipelineTask.get_database(pipeline_args, pipeline_args.ref_genome)
         args.annotation_gp = ReferenceFiles.get_args(pipeline_args).annotation_gp
-        args.fasta = GenomeFiles.get_args(pipeline_args, genome).fasta
+        args.two_bit = GenomeFiles.get_args(pipeline_args, genome).two_bit
         args.genome = genome
         args.ref_genome = pipeline_args.ref_genome
         # pass along all of the paths from alignment
         args.transcript_modes = AlignTranscripts.get_args(pipeline_args, genome).transcript_modes 
+        # classification is parallelized with a local process pool
+        args.num_cpu = min(pipeline_args.max_cores, multiprocessing.cpu_count())
+        args.parse_cache_dir = pipeline_args.parse_cache_dir
         return args
 
     def validate(self):
@@ -1152,12 +1123,15 @@ class EvaluateDriverTask(PipelineTask):
 
     def write_to_sql(self, results, eval_args):
         """Load the results into the SQLite database"""
+        wide_tables = {x.__tablename__: x for x in tools.sqlInterface.wide_tables}
         with tools.sqlite.ExclusiveSqlConnection(eval_args.db_path) as engine:
             for table, target in self.pair_table_output(eval_args).iteritems():
                 if table not in results:
                     continue
                 df = results[table]
                 df.to_sql(table, engine, if_exists='replace')
+                if table in wide_tables:
+                    tools.sqlInterface.create_long_format_view(engine, wide_tables[table])
                 target.touch()
                 logger.info('Loaded table: {}.{}'.format(self.genome, table))
 
@@ -1220,20 +1194,20 @@ class Consensus(PipelineWrapperTask):
 
     def requires(self):
         self.validate()
-        pipeline_args = self.get_pipeline_args()
-        for target_genome in pipeline_args.target_genomes:
-            yield self.clone(ConsensusDriverTask, genome=target_genome)
+        yield self.clone(ConsensusDriverTask)
 
 
 class ConsensusDriverTask(PipelineTask):
     """
-    Driver task for performing consensus finding.
+    Driver task for performing consensus finding. All genomes are handled by one task so that the reference data is
+    only loaded once and is shared with the process running each genome.
     """
-    genome = luigi.Parameter()
-
     def output(self):
-        consensus_args = self.get_module_args(Consensus, genome=self.genome)
-        return luigi.LocalTarget(consensus_args.consensus_gp), luigi.LocalTarget(consensus_args.metrics_json)
+        pipeline_args = self.get_pipeline_args()
+        for genome in pipeline_args.target_genomes:
+            consensus_args = self.get_module_args(Consensus, genome=genome)
+            yield luigi.LocalTarget(consensus_args.consensus_gp)
+            yield luigi.LocalTarget(consensus_args.metrics_json)
 
     def requires(self):
         pipeline_args = self.get_pipeline_args()
@@ -1245,11 +1219,18 @@ class ConsensusDriverTask(PipelineTask):
             yield self.clone(Hgm)
 
     def run(self):
-        consensus_args = self.get_module_args(Consensus, genome=self.genome)
-        logger.info('Generating consensus gene set for {}.'.format(self.genome))
-        consensus_gp, metrics_json = self.output()
-        metrics_dict = generate_consensus(consensus_args, self.genome)
-        PipelineTask.write_metrics(metrics_dict, metrics_json)
+        pipeline_args = self.get_pipeline_args()
+        # genomes completed by a previous run are not repeated
+        consensus_args = OrderedDict()
+        for genome in pipeline_args.target_genomes:
+            args = self.get_module_args(Consensus, genome=genome)
+            if not (os.path.exists(args.consensus_gp) and os.path.exists(args.metrics_json)):
+                consensus_args[genome] = args
+        logger.info('Generating consensus gene sets for {}.'.format(', '.join(consensus_args)))
+        ref_db_path = PipelineTask.get_database(pipeline_args, pipeline_args.ref_genome)
+        num_cpu = min(pipeline_args.max_cores, multiprocessing.cpu_count())
+        for genome, metrics_dict in consensus_genomes(consensus_args, ref_db_path, num_cpu).iteritems():
+            PipelineTask.write_metrics(metrics_dict, luigi.LocalTarget(consensus_args[genome].metrics_json))
 
 
 class Plots(PipelineTask):
@@ -1346,6 +1327,8 @@ def parse_args():
     parser.add_argument('--resolve-split-genes', action='store_true')
     parser.add_argument('--cgp-splice-support', default=0.8, type=float)
     parser.add_argument('--cgp-num-exons', default=3, type=int)
+    # estimated runtime of each toil job
+    parser.add_argument('--target-job-runtime', default=600, type=int)
     # toil options
     parser.add_argument('--batchSystem', default='singleMachine')
     parser.add_argument('--maxCores', default=16, type=int)
@@ -1362,3 +1345,5 @@ if __name__ == '__main__':
     workers = args.workers
     del args.workers  # hack because workers is actually a argument to luigi, not RunCat
     luigi.build([RunCat(**vars(args))], logging_conf_file='logging.cfg', workers=workers)
+    logger.info('Pipeline argument resolution was served from cache {} times.'.format(
+        PipelineTask.pipeline_args_cache_hits))
@@ -6,13 +6,14 @@ These classifiers are broken down into 2 groups, which will each end up as a tab
 <alnMode>_<txMode>_Metrics:
 
 These classifiers are per-transcript evaluations based on both the transcript alignment and the genome context.
+This table has one row per alignment and one column per classifier.
 1. PercentUnknownBases: % of mRNA bases that are Ns.
 2. AlnCoverage: Alignment coverage in transcript space.
 3. AlnIdentity: Alignment identity in transcript space.
 4. PercentMissingIntrons: Number of original introns not within a wiggle distance of any introns in the target.
 5. PercentMissingExons: Do we lose any exons? Defined based on parent sequence, with wiggle room.
-6. CdsStartStat: Is the CDS likely to be a complete start? Simply extracted from the genePred
-7. CdsEndStat: Is the CDS likely to be a complete stop? Simply extracted from the genePred
+6. StartCodon: Is the CDS likely to be a complete start? Simply extracted from the genePred. Null if non-coding.
+7. StopCodon: Is the CDS likely to be a complete stop? Simply extracted from the genePred. Null if non-coding.
 
 <alnMode>_<txMode>_Evaluation:
 
@@ -40,8 +41,12 @@ alnMode:
 2) mRNA
 
 """
+import collections
 import itertools
+import logging
+import multiprocessing
 
+import numpy as np
 import pandas as pd
 
 import tools.bio
@@ -54,79 +59,166 @@ import tools.psl
 import tools.sqlInterface
 import tools.transcripts
 
+logger = logging.getLogger(__name__)
+
 # hard coded variables
 # fuzz distance is the distance between introns allowed in intron coordinates before triggering NumMissingIntrons
 # fuzz distance is counted from both sides of the intron
 fuzz_distance = 7
 # the amount of exon-exon coverage required to consider a exon as present
 missing_exons_coverage_cutoff = 0.8
+# number of target transcripts classified by each worker task
+chunk_size = 250
+
+# inputs shared with the worker processes. classify() sets these before the pool is created so that the workers
+# inherit them through fork instead of having them pickled for every chunk.
+_shared = {}
 
 
 def classify(eval_args):
     """
-    Runs alignment classification for all alignment modes
+    Runs alignment classification for all alignment modes.
+
+    The target transcripts of each transcript mode are split into chunks, which are classified in a pool of
+    eval_args.num_cpu processes. All alignments of a target transcript are in the same chunk, so its sequence is
+    only extracted once.
+
     :param eval_args: argparse Namespace produced by EvaluateTranscripts.get_args()
-    :return: list of (tablename, dataframe) tuples
+    :return: dictionary of {tablename: dataframe}
     """
     # load shared inputs
-    ref_tx_dict = tools.transcripts.get_gene_pred_dict(eval_args.annotation_gp)
-    tx_biotype_map = tools.sqlInterface.get_transcript_biotype_map(eval_args.ref_db_path)
-    seq_dict = tools.bio.get_sequence_dict(eval_args.fasta)
-    # results stores the final dataframes
+    _shared['ref_tx_dict'] = tools.transcripts.get_gene_pred_dict(eval_args.annotation_gp, eval_args.parse_cache_dir)
+    _shared['tx_biotype_map'] = tools.sqlInterface.get_transcript_biotype_map(eval_args.ref_db_path)
+    _shared['seq_dict'] = tools.bio.get_sequence_dict(eval_args.two_bit)
+    _shared['tx_dicts'] = {}
+    # psl_dicts is {tx_mode: {aln_mode: {target transcript name: [PslRow, ...]}}}
+    _shared['psl_dicts'] = {}
+    chunks = []
+    for tx_mode, path_dict in eval_args.transcript_modes.iteritems():
+        _shared['tx_dicts'][tx_mode] = tools.transcripts.get_gene_pred_dict(path_dict['gp'])
+        aln_modes = ['CDS', 'mRNA'] if tx_mode != 'augCGP' else ['CDS']
+        psl_dicts = _shared['psl_dicts'][tx_mode] = {}
+        for aln_mode in aln_modes:
+            psl_dicts[aln_mode] = collections.defaultdict(list)
+            for psl in tools.psl.psl_iterator(path_dict[aln_mode]):
+                psl_dicts[aln_mode][psl.q_name].append(psl)
+        tx_names = sorted(set(itertools.chain.from_iterable(psl_dicts.itervalues())))
+        chunks.extend((tx_mode, chunk) for chunk in tools.dataOps.grouper(tx_names, chunk_size))
+
+    try:
+        # daemonic processes, such as luigi workers in some configurations, cannot have children
+        if eval_args.num_cpu > 1 and len(chunks) > 1 and not multiprocessing.current_process().daemon:
+            pool = multiprocessing.Pool(min(eval_args.num_cpu, len(chunks)))
+            try:
+                chunk_results = pool.map(classify_chunk, chunks, chunksize=1)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            chunk_results = map(classify_chunk, chunks)
+    finally:
+        _shared.clear()
+
+    # combine the chunks for each table
+    rows = collections.defaultdict(lambda: ([], []))
+    cache_stats = collections.defaultdict(lambda: [0, 0])
+    for tx_mode, chunk_rows, hits, misses in chunk_results:
+        for aln_mode, (mc_rows, ec_rows) in chunk_rows.iteritems():
+            rows[tx_mode, aln_mode][0].extend(mc_rows)
+            rows[tx_mode, aln_mode][1].extend(ec_rows)
+        cache_stats[tx_mode][0] += hits
+        cache_stats[tx_mode][1] += misses
     results = {}
     for tx_mode, path_dict in eval_args.transcript_modes.iteritems():
-        tx_dict = tools.transcripts.get_gene_pred_dict(path_dict['gp'])
         aln_modes = ['CDS', 'mRNA'] if tx_mode != 'augCGP' else ['CDS']
         for aln_mode in aln_modes:
-            psl_iter = list(tools.psl.psl_iterator(path_dict[aln_mode]))
-            mc_df = metrics_classify(aln_mode, ref_tx_dict, tx_dict, tx_biotype_map, psl_iter)
-            ec_df = evaluation_classify(aln_mode, ref_tx_dict, tx_dict, tx_biotype_map, psl_iter, seq_dict)
-            results[tools.sqlInterface.tables[aln_mode][tx_mode]['metrics'].__tablename__] = mc_df
-            results[tools.sqlInterface.tables[aln_mode][tx_mode]['evaluation'].__tablename__] = ec_df
+            mc_rows, ec_rows = rows[tx_mode, aln_mode]
+            results[tools.sqlInterface.tables[aln_mode][tx_mode]['metrics'].__tablename__] = build_metrics_df(mc_rows)
+            results[tools.sqlInterface.tables[aln_mode][tx_mode]['evaluation'].__tablename__] = \
+                build_evaluation_df(ec_rows)
+        hits, misses = cache_stats[tx_mode]
+        logger.info('Transcript sequence cache for {} {} had {} hits and {} misses.'.format(
+            tx_mode, eval_args.genome, hits, misses))
     return results
 
 
-def metrics_classify(aln_mode, ref_tx_dict, tx_dict, tx_biotype_map, psl_iter):
+def classify_chunk(chunk):
     """
-    Calculates the alignment metrics and the number of missing original introns on this transcript_chunk
-    :return: DataFrame
+    Classifies every alignment of a chunk of target transcripts from one transcript mode, computing the metrics and
+    the evaluations in a single pass over the alignments. Reads its inputs from _shared.
+
+    :param chunk: tuple of (tx_mode, tuple of target transcript names)
+    :return: tuple of (tx_mode, {aln_mode: (metrics rows, evaluation rows)}, sequence cache hits, misses)
+    """
+    tx_mode, tx_names = chunk
+    ref_tx_dict = _shared['ref_tx_dict']
+    tx_biotype_map = _shared['tx_biotype_map']
+    tx_dict = _shared['tx_dicts'][tx_mode]
+    seq_cache = tools.transcripts.TranscriptSequenceCache(_shared['seq_dict'])
+    r = {}
+    for aln_mode, psl_dict in _shared['psl_dicts'][tx_mode].iteritems():
+        mc_rows = []
+        ec_rows = []
+        psl_iter = (psl for tx_name in tx_names for psl in psl_dict.get(tx_name, []))
+        for ref_tx, tx, psl, biotype in tx_iter(psl_iter, ref_tx_dict, tx_dict, tx_biotype_map):
+            mc_rows.append(metrics_classify(aln_mode, ref_tx, tx, psl, biotype))
+            ec_rows.extend(evaluation_classify(aln_mode, ref_tx, tx, psl, biotype, seq_cache))
+        r[aln_mode] = mc_rows, ec_rows
+    return tx_mode, r, seq_cache.hits, seq_cache.misses
+
+
+def metrics_classify(aln_mode, ref_tx, tx, psl, biotype):
+    """
+    Calculates the alignment metrics and the number of missing original introns for one alignment
+    :return: row matching the columns of build_metrics_df()
+    """
+    if biotype == 'protein_coding':
+        start_ok, stop_ok = start_stop_stat(tx)
+    else:
+        start_ok = stop_ok = None
+    percent_missing_introns = calculate_percent_original_introns(ref_tx, tx, psl, aln_mode)
+    percent_missing_exons = calculate_percent_original_exons(ref_tx, psl, aln_mode)
+    return [ref_tx.name2, ref_tx.name, tx.name, psl.coverage, psl.identity, psl.percent_n, percent_missing_introns,
+            percent_missing_exons, start_ok, stop_ok]
+
+
+def evaluation_classify(aln_mode, ref_tx, tx, psl, biotype, seq_cache):
+    """
+    Calculates the evaluation metrics for one alignment
+    :return: list of rows
     """
     r = []
-    for ref_tx, tx, psl, biotype in tx_iter(psl_iter, ref_tx_dict, tx_dict, tx_biotype_map):
-        if biotype == 'protein_coding':
-            start_ok, stop_ok = start_stop_stat(tx)
-            r.append([ref_tx.name2, ref_tx.name, tx.name, 'StartCodon', start_ok])
-            r.append([ref_tx.name2, ref_tx.name, tx.name, 'StopCodon', stop_ok])
-        percent_missing_introns = calculate_percent_original_introns(ref_tx, tx, psl, aln_mode)
-        percent_missing_exons = calculate_percent_original_exons(ref_tx, psl, aln_mode)
-        r.append([ref_tx.name2, ref_tx.name, tx.name, 'AlnCoverage', psl.coverage])
-        r.append([ref_tx.name2, ref_tx.name, tx.name, 'AlnIdentity', psl.identity])
-        r.append([ref_tx.name2, ref_tx.name, tx.name, 'PercentUnknownBases', psl.percent_n])
-        r.append([ref_tx.name2, ref_tx.name, tx.name, 'PercentOriginalIntrons', percent_missing_introns])
-        r.append([ref_tx.name2, ref_tx.name, tx.name, 'PercentOriginalExons', percent_missing_exons])
-    columns = ['GeneId', 'TranscriptId', 'AlignmentId', 'classifier', 'value']
+    indels = find_indels(tx, psl, aln_mode)
+    for category, i in indels:
+        r.append([ref_tx.name2, ref_tx.name, tx.name, category, i.chromosome, i.start, i.stop, i.strand])
+    if biotype == 'protein_coding' and tx.cds_size > 50:  # we don't want to evaluate tiny ORFs
+        i = in_frame_stop(tx, seq_cache)
+        if i is not None:
+            r.append([ref_tx.name2, ref_tx.name, tx.name, 'InFrameStop', i.chromosome, i.start, i.stop, i.strand])
+    return r
+
+
+def build_metrics_df(r):
+    """
+    Converts the rows produced by metrics_classify into the metrics table
+    :return: DataFrame
+    """
+    columns = ['GeneId', 'TranscriptId', 'AlignmentId', 'AlnCoverage', 'AlnIdentity', 'PercentUnknownBases',
+               'PercentOriginalIntrons', 'PercentOriginalExons', 'StartCodon', 'StopCodon']
     df = pd.DataFrame(r, columns=columns)
-    df.value = pd.to_numeric(df.value)  # coerce all into floats
-    df = df.sort_values(columns)
-    df = df.set_index(['GeneId', 'TranscriptId', 'AlignmentId', 'classifier'])
+    # every classifier is stored as a float. StartCodon and StopCodon are NaN for non-coding transcripts
+    df[columns[3:]] = df[columns[3:]].astype(float)
+    df = df.sort_values(columns[:3])
+    df = df.set_index(['GeneId', 'TranscriptId', 'AlignmentId'])
     assert len(r) == len(df)
     return df
 
 
-def evaluation_classify(aln_mode, ref_tx_dict, tx_dict, tx_biotype_map, psl_iter, seq_dict):
+def build_evaluation_df(r):
     """
-    Calculates the evaluation metrics on this transcript_chunk
+    Converts the rows produced by evaluation_classify into the evaluation table
     :return: DataFrame
     """
-    r = []
-    for ref_tx, tx, psl, biotype in tx_iter(psl_iter, ref_tx_dict, tx_dict, tx_biotype_map):
-        indels = find_indels(tx, psl, aln_mode)
-        for category, i in indels:
-            r.append([ref_tx.name2, ref_tx.name, tx.name, category, i.chromosome, i.start, i.stop, i.strand])
-        if biotype == 'protein_coding' and tx.cds_size > 50:  # we don't want to evaluate tiny ORFs
-            i = in_frame_stop(tx, seq_dict)
-            if i is not None:
-                r.append([ref_tx.name2, ref_tx.name, tx.name, 'InFrameStop', i.chromosome, i.start, i.stop, i.strand])
     columns = ['GeneId', 'TranscriptId', 'AlignmentId', 'classifier', 'chromosome', 'start', 'stop', 'strand']
     df = pd.DataFrame(r, columns=columns)
     df = df.sort_values(columns)
@@ -174,23 +266,17 @@ def calculate_percent_original_introns(ref_tx, tx, psl, aln_mode):
     ref_introns = get_intron_coordinates(ref_tx, aln_mode)
 
     # generate a list of target introns in current coordinates (mRNA or CDS)
-    # note that since this PSL is target-referenced, we use query_coordinate_to_target()
-    tgt_introns = []
-    for intron in get_intron_coordinates(tx, aln_mode):
-        p = psl.query_coordinate_to_target(intron)
-        if p is not None:
-            tgt_introns.append(p)
+    # note that since this PSL is target-referenced, we use query_coordinates_to_target()
+    tgt_introns = psl.query_coordinates_to_target(get_intron_coordinates(tx, aln_mode))
+    tgt_introns = np.sort(tgt_introns[tgt_introns != tools.intervals.UNMAPPED])
 
     # if we lost all introns due to CDS filtering, return nan
     if len(tgt_introns) == 0:
         return float('nan')
 
     # count the number of introns within wiggle distance of each other
-    num_original = 0
-    for ref_intron in ref_introns:
-        closest = tools.mathOps.find_closest(tgt_introns, ref_intron)
-        if closest - fuzz_distance < ref_intron < closest + fuzz_distance:
-            num_original += 1
+    closest = tools.mathOps.find_closest_sorted(tgt_introns, ref_introns)
+    num_original = np.count_nonzero((closest - fuzz_distance < ref_introns) & (ref_introns < closest + fuzz_distance))
     return tools.mathOps.format_ratio(num_original, len(ref_introns))
 
 
@@ -198,25 +284,35 @@ def calculate_percent_original_exons(ref_tx, psl, aln_mode):
     """
     Calculates how many reference exons are missing in this transcript.
 
-    This is determined by using coordinate translations from the reference exons to the target, determining how many
-    of the target bases are covered through brute force
+    This is determined by converting the reference exons to alignment coordinates and intersecting them with the
+    aligned blocks of the alignment, determining how many of the target bases are covered. Both the exons and the
+    blocks are sorted and non-overlapping, so this is a linear merge of the two lists.
 
     :param ref_tx: GenePredTranscript object representing the parent transcript
     :param psl: PslRow object representing the mRNA/CDS alignment between ref_tx and tx
     :param aln_mode: One of ('CDS', 'mRNA'). Determines if we aligned CDS or mRNA.
     :return: float between 0 and 1
     """
+    if psl.strand not in ['+', '-', '++']:
+        raise NotImplementedError('PslRow does not support coordinate conversions for strand {}'.format(psl.strand))
     # convert the reference exons to alignment coordinates.
     # We don't need the original exons because we can't produce useful coordinates here
     # which is why this is a metric and not an evaluation
-    ref_exons = get_exon_intervals(ref_tx, aln_mode).values()
-    # note that since this PSL is target-referenced, we use target_coordinate_to_query()
+    ref_exons = sorted(get_exon_intervals(ref_tx, aln_mode).values())
+    # note that since this PSL is target-referenced, we intersect with the target blocks
+    blocks = [(max(t_start, psl.t_start), min(t_start + block_size, psl.t_end))
+              for t_start, block_size in itertools.izip(psl.t_starts, psl.block_sizes)]
     num_original = 0
+    i = 0
     for exon in ref_exons:
+        # skip blocks that end before this exon begins. They cannot overlap any later exon either
+        while i < len(blocks) and blocks[i][1] <= exon.start:
+            i += 1
         present_bases = 0
-        for i in xrange(exon.start, exon.stop):
-            if psl.target_coordinate_to_query(i) is not None:
-                present_bases += 1
+        j = i
+        while j < len(blocks) and blocks[j][0] < exon.stop:
+            present_bases += max(0, min(blocks[j][1], exon.stop) - max(blocks[j][0], exon.start))
+            j += 1
         if tools.mathOps.format_ratio(present_bases, len(exon)) >= missing_exons_coverage_cutoff:
             num_original += 1
     return tools.mathOps.format_ratio(num_original, len(ref_exons))
@@ -227,23 +323,22 @@ def calculate_percent_original_exons(ref_tx, psl, aln_mode):
 ###
 
 
-def in_frame_stop(tx, fasta):
+def in_frame_stop(tx, seq_cache):
     """
     Finds the first in frame stop of this transcript, if there are any
 
     :param tx: Target GenePredTranscript object
-    :param fasta: pyfasta Fasta object mapping the genome fasta for this analysis
+    :param seq_cache: TranscriptSequenceCache of the genome sequence for this analysis
     :return: A ChromosomeInterval object if an in frame stop was found otherwise None
     """
-    seq = tx.get_cds(fasta)
-    for pos, codon in tools.bio.read_codons_with_position(seq):
-        if tools.bio.translate_sequence(codon) == '*':
-            start = tx.cds_coordinate_to_chromosome(pos)
-            stop = tx.cds_coordinate_to_chromosome(pos + 3)
-            if tx.strand == '-':
-                start, stop = stop, start
-            return tools.intervals.ChromosomeInterval(tx.chromosome, start, stop, tx.strand)
-    return None
+    pos = tools.bio.find_first_stop(seq_cache.get_cds(tx))
+    if pos is None:
+        return None
+    start = tx.cds_coordinate_to_chromosome(pos)
+    stop = tx.cds_coordinate_to_chromosome(pos + 3)
+    if tx.strand == '-':
+        start, stop = stop, start
+    return tools.intervals.ChromosomeInterval(tx.chromosome, start, stop, tx.strand)
 
 
 def find_indels(tx, psl, aln_mode):
@@ -393,15 +488,15 @@ def get_intron_coordinates(tx, aln_mode):
 
     :param tx:GenePredTranscript object
     :param aln_mode: One of ('CDS', 'mRNA'). Used to determine if we aligned in CDS space or mRNA space
-    :return: list of integers
+    :return: numpy array of integers
     """
     if aln_mode == 'CDS':
         tx = convert_cds_frame(tx)
-        introns = [tx.chromosome_coordinate_to_cds(tx.start + x) for x in tx.block_starts[1:]]
+        introns = tx.chromosome_coordinates_to_cds(tx.start + np.array(tx.block_starts[1:], dtype=np.int64))
     else:
-        introns = [tx.chromosome_coordinate_to_mrna(tx.start + x) for x in tx.block_starts[1:]]
-    # remove None which means this transcript is protein_coding and that exon is entirely non-coding
-    return [x for x in introns if x is not None]
+        introns = tx.chromosome_coordinates_to_mrna(tx.start + np.array(tx.block_starts[1:], dtype=np.int64))
+    # remove UNMAPPED which means this transcript is protein_coding and that exon is entirely non-coding
+    return introns[introns != tools.intervals.UNMAPPED]
 
 
 def get_exon_intervals(tx, aln_mode):
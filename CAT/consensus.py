@@ -24,26 +24,146 @@ GFF3 tags generated in this process:
     comma separated in this tag.
 """
 import collections
-import copy
+import itertools
+import multiprocessing
+import Queue
+import traceback
 import luigi
-import math
 
 import pandas as pd
 import numpy as np
 
+import tools.dataOps
 import tools.intervals
 import tools.mathOps
 import tools.fileOps
 import tools.sqlInterface
 import tools.transcripts
 import tools.nameConversions
-from tools.defaultOrderedDict import DefaultOrderedDict
 
 pd.options.mode.chained_assignment = None  # false positive in novel splice finding code
 id_template = '{genome:.10}_{tag_type}{unique_id:07d}'
 
 
-def generate_consensus(args, genome):
+# reference annotation data shared by the consensus finding of every genome
+ReferenceData = collections.namedtuple('ReferenceData', ['annotation', 'gene_transcript_map', 'gene_biotype_map',
+                                                         'transcript_biotype_map', 'common_name_map'])
+
+# inputs shared with the worker processes. generate_consensus() sets these before the pool is created so that the
+# workers inherit them through fork instead of having them pickled for every shard.
+_shared = {}
+
+
+def consensus_genomes(consensus_args, ref_db_path, num_cpu):
+    """
+    Runs consensus finding for several genomes at once.
+
+    The reference annotation is loaded once, then each genome is handled by its own forked process, which inherits
+    the reference data instead of loading it again. At most num_cpu genomes are run at a time. If there are more CPUs
+    than genomes, the gene loop of each genome is split into shards over the remaining CPUs.
+
+    :param consensus_args: dictionary of {genome: argparse Namespace produced by Consensus.get_args()}
+    :param ref_db_path: path to the reference genome database
+    :param num_cpu: maximum number of processes to use
+    :return: dictionary of {genome: metrics}
+    """
+    ref_data = load_reference_data(ref_db_path)
+    genomes = list(consensus_args)
+    num_shards = max(1, num_cpu // max(1, len(genomes)))
+    # daemonic processes, such as luigi workers in some configurations, cannot have children
+    if num_cpu == 1 or len(genomes) < 2 or multiprocessing.current_process().daemon:
+        return {genome: generate_consensus(consensus_args[genome], genome, ref_data, num_shards)
+                for genome in genomes}
+
+    queue = multiprocessing.Queue()
+    running = {}
+    results = {}
+    try:
+        while genomes or running:
+            while genomes and len(running) < num_cpu:
+                genome = genomes.pop(0)
+                p = multiprocessing.Process(target=run_genome_consensus,
+                                            args=(queue, consensus_args[genome], genome, ref_data, num_shards))
+                p.start()
+                running[genome] = p
+            try:
+                genome, metrics, error = queue.get(timeout=10)
+            except Queue.Empty:
+                # a process that exits cleanly has already sent its result, so only a crash can be missed here
+                for genome, p in running.iteritems():
+                    if p.exitcode is not None and p.exitcode != 0:
+                        raise RuntimeError('Consensus finding for {} exited with code {}.'.format(genome, p.exitcode))
+                continue
+            running.pop(genome).join()
+            if error is not None:
+                raise RuntimeError('Consensus finding for {} failed:\n{}'.format(genome, error))
+            results[genome] = metrics
+    finally:
+        for p in running.itervalues():
+            p.terminate()
+            p.join()
+    return results
+
+
+def run_genome_consensus(queue, args, genome, ref_data, num_shards):
+    """
+    Process target used by consensus_genomes(). Sends (genome, metrics, error) to the parent through queue, where
+    error is the formatted traceback if consensus finding failed.
+    """
+    try:
+        queue.put((genome, generate_consensus(args, genome, ref_data, num_shards), None))
+    except Exception:
+        queue.put((genome, None, traceback.format_exc()))
+
+
+def load_reference_data(ref_db_path):
+    """
+    Loads the reference annotation table and the maps derived from it that consensus finding needs.
+    :param ref_db_path: path to the reference genome database
+    :return: ReferenceData
+    """
+    ref_df = tools.sqlInterface.load_annotation(ref_db_path)
+    gene_transcript_map = collections.defaultdict(set)
+    for gene_id, tx_id in itertools.izip(ref_df.GeneId, ref_df.TranscriptId):
+        gene_transcript_map[gene_id].add(tx_id)
+    return ReferenceData(annotation=ref_df,
+                         gene_transcript_map=dict(gene_transcript_map),
+                         gene_biotype_map=dict(zip(ref_df.GeneId, ref_df.GeneBiotype)),
+                         transcript_biotype_map=dict(zip(ref_df.TranscriptId, ref_df.TranscriptBiotype)),
+                         common_name_map=dict(zip(ref_df.GeneId, ref_df.GeneName)))
+
+
+def initialize_metrics():
+    """Returns an empty metrics dictionary for consensus finding"""
+    return {'Alignment Modes': collections.Counter(), 'Transcript Modes': collections.Counter(),  # coding only
+            'Gene Failed': collections.Counter(), 'Transcript Failed': collections.Counter(),
+            'Transcript Missing': collections.Counter(),
+            'Gene Missing': collections.Counter(),
+            'Duplicate transcripts': collections.Counter(),
+            'Discarded by strand resolution': 0,
+            'Transcript Categories': collections.defaultdict(collections.Counter),
+            'Coverage': collections.defaultdict(list),
+            'Identity': collections.defaultdict(list),
+            'Consensus Score': collections.defaultdict(list),
+            'Splice Support': collections.defaultdict(list)}
+
+
+def merge_metrics(metrics, other):
+    """
+    Adds the metrics of another part of the same genome into metrics. Counts are summed and lists are concatenated.
+    """
+    for key, val in other.iteritems():
+        if isinstance(val, collections.Counter):
+            metrics[key].update(val)
+        elif isinstance(val, dict):
+            merge_metrics(metrics[key], val)
+        elif isinstance(val, list):
+            metrics[key].extend(val)
+        else:
+            metrics[key] += val
+
+
+def generate_consensus(args, genome, ref_data=None, num_shards=1):
     """
     Entry point for consensus finding algorithm. Main consensus finding logic is here.
 
@@ -59,28 +179,25 @@ def generate_consensus(args, genome):
     For each gene, see if we have it. If not, it is missing. If we do have it, see if all transcripts are failing.
     If all transcripts are failing, pick one. Otherwise, take all transcripts for this gene that are not failing.
 
+    The genes are split into num_shards contiguous ranges, which are resolved in a pool of processes.
+
     :param args: Argument namespace from luigi
+    :param genome: genome name
+    :param ref_data: ReferenceData from load_reference_data(). Loaded from args.ref_db_path if not provided.
+    :param num_shards: number of processes to resolve genes in
     """
     # stores a mapping of alignment IDs to tags for the final consensus set
     consensus_dict = {}
 
     # store some metrics for plotting
-    metrics = {'Alignment Modes': collections.Counter(), 'Transcript Modes': collections.Counter(),  # coding only
-               'Gene Failed': collections.Counter(), 'Transcript Failed': collections.Counter(),
-               'Transcript Missing': collections.Counter(),
-               'Gene Missing': collections.Counter(),
-               'Duplicate transcripts': collections.Counter(),
-               'Discarded by strand resolution': 0,
-               'Transcript Categories': collections.defaultdict(lambda: collections.Counter()),
-               'Coverage': collections.defaultdict(list),
-               'Identity': collections.defaultdict(list),
-               'Consensus Score': collections.defaultdict(list),
-               'Splice Support': collections.defaultdict(list)}
+    metrics = initialize_metrics()
 
     # load all genePreds
     tx_dict = tools.transcripts.load_gps(args.gp_list)
     # load annotation data
-    ref_df = tools.sqlInterface.load_annotation(args.ref_db_path)
+    if ref_data is None:
+        ref_data = load_reference_data(args.ref_db_path)
+    ref_df = ref_data.annotation
 
     # load transMap evaluation data
     tm_eval = load_transmap_evals(args.db_path, ref_df)
@@ -100,62 +217,117 @@ def generate_consensus(args, genome):
         splice_support = args.cgp_splice_support if args.hints_db_has_rnaseq else 0
         consensus_dict.update(find_novel_transcripts(intron_df, tx_dict, metrics, args.cgp_num_exons, splice_support))
 
-    # gene transcript map to iterate over so that we capture missing gene information
-    gene_transcript_map = tools.sqlInterface.get_gene_transcript_map(args.ref_db_path)
-    gene_biotype_map = tools.sqlInterface.get_gene_biotype_map(args.ref_db_path)
-    transcript_biotype_map = tools.sqlInterface.get_transcript_biotype_map(args.ref_db_path)
-    common_name_map = dict(zip(*[ref_df.GeneId, ref_df.GeneName]))
+    # scored_df is sorted by gene and transcript, so the rows of each gene and of each transcript are contiguous.
+    # Decisions are made on row positions, looking up full rows only for the chosen alignments.
+    gene_slices = find_group_slices(scored_df.index.get_level_values('GeneId'))
+    tx_slices = find_group_slices(scored_df.index.values)
+    scored_df = scored_df.reset_index(level='GeneId', drop=True)
+    _shared.update(args=args, ref_data=ref_data, tx_dict=tx_dict, scored_df=scored_df, gene_slices=gene_slices,
+                   tx_slices=tx_slices, is_passing=scored_df.TranscriptClass.isin(['Passing', 'Excellent']).values,
+                   consensus_scores=scored_df.ConsensusScore.values, records=scored_df.reset_index().to_dict('records'))
+
+    # iterate over every reference gene so that we capture missing gene information
+    gene_ids = sorted(ref_data.gene_transcript_map)
+    shard_size = -(-len(gene_ids) // num_shards)
+    shards = list(tools.dataOps.grouper(gene_ids, shard_size)) if gene_ids else []
+    try:
+        # daemonic processes, such as luigi workers in some configurations, cannot have children
+        if len(shards) > 1 and not multiprocessing.current_process().daemon:
+            pool = multiprocessing.Pool(len(shards))
+            try:
+                shard_results = pool.map(find_shard_consensus, shards, chunksize=1)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            shard_results = map(find_shard_consensus, shards)
+    finally:
+        _shared.clear()
+
+    for shard_consensus_dict, shard_metrics in shard_results:
+        consensus_dict.update(shard_consensus_dict)
+        merge_metrics(metrics, shard_metrics)
+
+    # the remaining steps look up every consensus transcript several times. tx_dict builds a new object on each lookup,
+    # so build the objects of the consensus set once
+    consensus_txs = {aln_id: tx_dict[aln_id] for aln_id in consensus_dict}
+
+    # perform final filtering steps
+    deduplicated_consensus = deduplicate_consensus(consensus_dict, consensus_txs, metrics)
+    deduplicated_strand_resolved_consensus = resolve_opposite_strand(deduplicated_consensus, consensus_txs, metrics)
+
+    # sort by genomic interval for prettily increasing numbers. the name breaks ties so that the numbering does not
+    # depend on the order the transcripts were resolved in
+    final_consensus = sorted(deduplicated_strand_resolved_consensus,
+                             key=lambda (tx, attrs): (consensus_txs[tx].chromosome, consensus_txs[tx].start, tx))
+
+    # calculate final gene set completeness
+    calculate_completeness(final_consensus, metrics)
+
+    # write out results, renaming to unique names
+    write_consensus(final_consensus, consensus_txs, genome, args.consensus_gp, args.consensus_gp_info,
+                    args.consensus_gff3)
+
+    return metrics
+
+
+def find_shard_consensus(gene_ids):
+    """
+    Resolves the consensus transcripts of a range of reference genes. Reads its inputs from _shared.
+    :param gene_ids: sequence of gene IDs
+    :return: tuple of (consensus dict, metrics)
+    """
+    args = _shared['args']
+    ref_data = _shared['ref_data']
+    tx_dict = _shared['tx_dict']
+    scored_df = _shared['scored_df']
+    gene_slices = _shared['gene_slices']
+    tx_slices = _shared['tx_slices']
+    is_passing = _shared['is_passing']
+    consensus_scores = _shared['consensus_scores']
+    records = _shared['records']
+
+    consensus_dict = {}
+    metrics = initialize_metrics()
+    if args.augustus_cgp is True:
+        metrics['CGP'] = {'Novel genes': 0, 'Novel isoforms': 0}
 
-    for gene_id, tx_list in gene_transcript_map.iteritems():
+    for gene_id in gene_ids:
+        tx_list = ref_data.gene_transcript_map[gene_id]
         gene_consensus_dict = {}
-        gene_df = slice_df(scored_df, gene_id)
-        gene_biotype = gene_biotype_map[gene_id]
-        if len(gene_df) == 0:
+        gene_biotype = ref_data.gene_biotype_map[gene_id]
+        if gene_id not in gene_slices:
             metrics['Gene Missing'][gene_biotype] += 1
             for tx_id in tx_list:
-                tx_biotype = transcript_biotype_map[tx_id]
+                tx_biotype = ref_data.transcript_biotype_map[tx_id]
                 metrics['Transcript Missing'][tx_biotype] += 1
             continue
-        failed_gene = is_failed_df(gene_df)
+        gene_slice = gene_slices[gene_id]
+        # failed genes have no passing/excellent transcripts
+        failed_gene = not is_passing[gene_slice].any()
         if failed_gene is True:
-            aln_id, d = rescue_failed_gene(gene_df, tx_dict, gene_id, metrics)
+            aln_id, d = rescue_failed_gene(scored_df.iloc[gene_slice], tx_dict, gene_id, metrics)
             gene_consensus_dict[aln_id] = d
             metrics['Gene Failed'][gene_biotype] += 1
         else:
             for tx_id in tx_list:
-                tx_biotype = transcript_biotype_map[tx_id]
-                tx_df = slice_df(gene_df, tx_id)
-                if len(tx_df) == 0:
+                tx_biotype = ref_data.transcript_biotype_map[tx_id]
+                tx_slice = tx_slices.get((gene_id, tx_id))
+                if tx_slice is None:
                     metrics['Transcript Missing'][tx_biotype] += 1
-                elif is_failed_df(tx_df):
+                elif not is_passing[tx_slice].any():
                     metrics['Transcript Failed'][tx_biotype] += 1
                 else:
-                    best_rows = find_best_score(tx_df)
+                    best_rows = [records[i] for i in find_best_rows(consensus_scores, tx_slice)]
                     aln_id, d = incorporate_tx(best_rows, gene_id, metrics, failed_gene=False)
                     gene_consensus_dict[aln_id] = d
         if args.augustus_cgp is True:
+            gene_df = scored_df.iloc[gene_slice]
             gene_consensus_dict.update(find_novel_cgp_splices(gene_consensus_dict, gene_df, tx_dict, gene_id,
-                                                              common_name_map, metrics, failed_gene,
+                                                              ref_data.common_name_map, metrics, failed_gene,
                                                               args.cgp_num_exons))
         consensus_dict.update(gene_consensus_dict)
-
-    # perform final filtering steps
-    deduplicated_consensus = deduplicate_consensus(consensus_dict, tx_dict, metrics)
-    deduplicated_strand_resolved_consensus = resolve_opposite_strand(deduplicated_consensus, tx_dict, metrics)
-
-    # sort by genomic interval for prettily increasing numbers
-    final_consensus = sorted(deduplicated_strand_resolved_consensus,
-                             key=lambda (tx, attrs): (tx_dict[tx].chromosome, tx_dict[tx].start))
-
-    # calculate final gene set completeness
-    calculate_completeness(final_consensus, metrics)
-
-    # write out results. consensus tx dict has the unique names
-    consensus_gene_dict = write_consensus_gps(args.consensus_gp, args.consensus_gp_info,
-                                              final_consensus, tx_dict, genome)
-    write_consensus_gff3(consensus_gene_dict, args.consensus_gff3)
-
-    return metrics
+    return consensus_dict, metrics
 
 
 def load_transmap_evals(db_path, ref_df):
@@ -254,12 +426,8 @@ def load_metrics_evaluations(db_path, transcript_modes, ref_df, tm_eval, coding_
             metrics_table = tools.sqlInterface.tables[aln_mode][tx_mode]['metrics']
             evaluations_table = tools.sqlInterface.tables[aln_mode][tx_mode]['evaluation']
             mc_df = tools.sqlInterface.load_metrics(metrics_table, session)
-            mc_df = pd.pivot_table(mc_df, index=['GeneId', 'TranscriptId', 'AlignmentId'], columns='classifier',
-                                   values='value', fill_value=None).reset_index()
             mc_df['AlnMode'] = [aln_mode] * len(mc_df)
             ec_df = tools.sqlInterface.load_evaluation(evaluations_table, session)
-            ec_df = pd.pivot_table(ec_df, index=['GeneId', 'TranscriptId', 'AlignmentId'], columns='classifier',
-                                   values='value', fill_value=None).reset_index()
             ec_df['AlnMode'] = [aln_mode] * len(ec_df)
             dfs.extend([mc_df, ec_df])
 
@@ -282,11 +450,7 @@ def load_metrics_evaluations(db_path, transcript_modes, ref_df, tm_eval, coding_
     # we use a left outer join because of CGP transcripts
     merged_df = pd.merge(ref_merged, tm_eval_subset, on='TranscriptId', how='left')
     # add in transcript class
-
-    def add_class(s):
-        return 'Passing' if s.AlnIdentity >= coding_cutoff else 'Failing'
-
-    merged_df['TranscriptClass'] = merged_df.apply(add_class, axis=1)
+    merged_df['TranscriptClass'] = np.where(merged_df.AlnIdentity >= coding_cutoff, 'Passing', 'Failing')
 
     # bring in intron support, if we have it
     if intron_df is not None:
@@ -320,45 +484,42 @@ def score_coding_df(merged_df, has_rnaseq_data):
     w/rnaseq: evaluation score == 1 and rnaseq_support >= 0.8
     w/o rnaseq: evaluation score == 1
     """
-    def evaluation_score(s):
-        ifs = s.InFrameStop == 1
+    def column_equals(df, column, value):
+        """compares a column to value, treating a missing column as equal"""
+        return df[column] == value if column in df else pd.Series(True, index=df.index)
+
+    def evaluation_score(df):
+        ifs = df.InFrameStop == 1
         # coding indel data may be missing if we have zero calls. Happens in test data.
-        indel = s.get('CodingDeletion', 0) == 0 or s.get('CodingInsertion', 0) == 0
-        start_penalty = 1 if s.StartCodon_Tgt == 0 and s.StartCodon_Ref == 1 else 0
-        stop_penalty = 1 if s.StopCodon_Tgt == 0 and s.StopCodon_Ref == 1 else 0
-        # using bool -> integer implicit casting here
-        return 1 - tools.mathOps.format_ratio(ifs + indel + start_penalty + stop_penalty, 4)
+        indel = column_equals(df, 'CodingDeletion', 0) | column_equals(df, 'CodingInsertion', 0)
+        start_penalty = (df.StartCodon_Tgt == 0) & (df.StartCodon_Ref == 1)
+        stop_penalty = (df.StopCodon_Tgt == 0) & (df.StopCodon_Ref == 1)
+        num_penalties = ifs.astype(int) + indel.astype(int) + start_penalty.astype(int) + stop_penalty.astype(int)
+        return 1 - num_penalties / 4.0
 
-    def structure_score(s):
+    def structure_score(df, evaluation_scores):
         # need to handle the case of a single exon transcript
-        percent_original_introns = s.PercentOriginalIntrons if not math.isnan(s.PercentOriginalIntrons) else 1
-        return 0.7 * percent_original_introns + 0.2 * percent_original_introns + 0.1 * evaluation_score(s)
-
-    def rnaseq_support(s):
-        if s.AlnMode == 'mRNA':
-            r = s.PercentIntronsSupported
-        else:
-            r = s.PercentCodingIntronsSupported
-        return 1 if np.isnan(r) else r
-
-    def coding_consensus_metric(s):
-        if has_rnaseq_data is True:
-            return 0.05 * s.AlnCoverage + 0.5 * s.AlnIdentity + 0.3 * rnaseq_support(s) + 0.15 * structure_score(s)
-        else:
-            return 0.05 * s.AlnCoverage + 0.7 * s.AlnIdentity + 0.25 * structure_score(s)
-
-    def calculate_class(s):
-        """upgrades the class of a transcript if it was passing and now should be excellent"""
-        if has_rnaseq_data is True:
-            if s.TranscriptClass == 'Passing' and evaluation_score(s) == 1 and s.PercentIntronsSupported >= 0.8:
-                return 'Excellent'
-        else:
-            if s.TranscriptClass == 'Passing' and evaluation_score(s) == 1:
-                return 'Excellent'
-        return s.TranscriptClass
-
-    merged_df['ConsensusScore'] = merged_df.apply(coding_consensus_metric, axis=1)
-    merged_df['TranscriptClass'] = merged_df.apply(calculate_class, axis=1)
+        percent_original_introns = df.PercentOriginalIntrons.fillna(1)
+        return 0.7 * percent_original_introns + 0.2 * percent_original_introns + 0.1 * evaluation_scores
+
+    def rnaseq_support(df):
+        r = np.where(df.AlnMode == 'mRNA', df.PercentIntronsSupported, df.PercentCodingIntronsSupported)
+        return np.where(np.isnan(r), 1, r)
+
+    evaluation_scores = evaluation_score(merged_df)
+    structure_scores = structure_score(merged_df, evaluation_scores)
+    if has_rnaseq_data is True:
+        merged_df['ConsensusScore'] = 0.05 * merged_df.AlnCoverage + 0.5 * merged_df.AlnIdentity + \
+                                      0.3 * rnaseq_support(merged_df) + 0.15 * structure_scores
+    else:
+        merged_df['ConsensusScore'] = 0.05 * merged_df.AlnCoverage + 0.7 * merged_df.AlnIdentity + \
+                                      0.25 * structure_scores
+
+    # upgrade the class of transcripts that were passing and now should be excellent
+    excellent = (merged_df.TranscriptClass == 'Passing') & (evaluation_scores == 1)
+    if has_rnaseq_data is True:
+        excellent &= merged_df.PercentIntronsSupported >= 0.8
+    merged_df['TranscriptClass'] = np.where(excellent, 'Excellent', merged_df.TranscriptClass)
     return merged_df
 
 
@@ -378,19 +539,6 @@ def score_non_coding_df(tm_eval, intron_df):
     :param intron_df: DataFrame produced by load_intron_vectors(), if we had RNAseq data
     :return: DataFrame
     """
-    def non_coding_consensus_metric(s):
-        if intron_df is not None:
-            return 0.05 * s.TransMapIdentity + 0.5 * s.TransMapCoverage + 0.15 * s.TransMapPercentOriginalIntrons + \
-                   0.3 * s.PercentIntronsSupported if not math.isnan(s.PercentIntronsSupported) else 1
-        else:
-            return 0.05 * s.TransMapIdentity + 0.7 * s.TransMapCoverage + 0.25 * s.TransMapPercentOriginalIntrons
-
-    def calculate_class(s):
-        """upgrades the class of a transcript if it was passing and now should be excellent"""
-        if s.TranscriptClass == 'Passing' and s.PercentIntronsSupported >= 0.8:
-            return 'Excellent'
-        return s.TranscriptClass
-
     df = tm_eval[(tm_eval.TranscriptBiotype != 'protein_coding') & (tm_eval.TransMapCoverage > 0.4)]
     if len(df) == 0:
         return df  # some annotations may have no protein coding transcripts
@@ -398,9 +546,16 @@ def score_non_coding_df(tm_eval, intron_df):
     if intron_df is not None:
         # left outer join to keep transcripts not in intron dict (single exon)
         df = pd.merge(df, intron_df, on=['GeneId', 'AlignmentId'], how='left')
-        df['TranscriptClass'] = df.apply(calculate_class, axis=1)
-
-    df['ConsensusScore'] = df.apply(non_coding_consensus_metric, axis=1)
+        # upgrade the class of transcripts that were passing and now should be excellent
+        excellent = (df.TranscriptClass == 'Passing') & (df.PercentIntronsSupported >= 0.8)
+        df['TranscriptClass'] = np.where(excellent, 'Excellent', df.TranscriptClass)
+        score = 0.05 * df.TransMapIdentity + 0.5 * df.TransMapCoverage + 0.15 * df.TransMapPercentOriginalIntrons + \
+                0.3 * df.PercentIntronsSupported
+        # transcripts without intron support data are given a score of 1
+        df['ConsensusScore'] = np.where(df.PercentIntronsSupported.isnull(), 1, score)
+    else:
+        df['ConsensusScore'] = 0.05 * df.TransMapIdentity + 0.7 * df.TransMapCoverage + \
+                               0.25 * df.TransMapPercentOriginalIntrons
     # rename the identity/coverage columns to match the coding
     df = df.rename(columns={'TransMapIdentity': 'AlnIdentity', 'TransMapCoverage': 'AlnCoverage'})
     df['AlnMode'] = ['mRNA'] * len(df)
@@ -423,6 +578,17 @@ def find_novel_transcripts(intron_df, tx_dict, metrics, num_introns, splice_supp
     return consensus
 
 
+def find_best_rows(scores, rows):
+    """
+    Finds the rows in a range of the pre-sorted DataFrame that tie the score of the first row.
+    :param scores: numpy array of the scores of every row
+    :param rows: slice of the rows to consider
+    :return: numpy array of row positions
+    """
+    range_scores = scores[rows]
+    return np.flatnonzero(range_scores == range_scores[0]) + rows.start
+
+
 def find_best_score(tx_df, column='ConsensusScore'):
     """
     Finds the best transcript in the pre-sorted filtered DataFrame, handling the case where it does not exist.
@@ -438,49 +604,44 @@ def find_best_score(tx_df, column='ConsensusScore'):
 
 
 def incorporate_tx(best_rows, gene_id, metrics, failed_gene):
-    """incorporate a transcript into the consensus set, storing metrics. Updates gene_seen."""
-    best_series = best_rows.iloc[0]
+    """
+    incorporate a transcript into the consensus set, storing metrics.
+    :param best_rows: list of tied rows as dicts of {column: value}, including TranscriptId. The first is used.
+    """
+    best_row = best_rows[0]
     # construct the tags for this transcript
-    d = {'source_transcript': best_series.name,
+    d = {'source_transcript': best_row['TranscriptId'],
          'source_gene': gene_id,
-         'transcript_mode': tools.nameConversions.alignment_type(best_series.AlignmentId),
-         'score': round(best_series.ConsensusScore, 2),
+         'transcript_mode': tools.nameConversions.alignment_type(best_row['AlignmentId']),
+         'score': round(best_row['ConsensusScore'], 2),
          'failed_gene': failed_gene,
-         'transcript_class': best_series.TranscriptClass,
-         'gene_biotype': best_series.GeneBiotype,
-         'transcript_biotype': best_series.TranscriptBiotype}
-    if best_series.Paralogy > 1:
-        assert best_series.ParalogStatus is not None
-        d['paralogy'] = best_series.Paralogy
-        d['paralog_status'] = best_series.ParalogStatus
-    if 'GeneAlternateContigs' in best_series and best_series.GeneAlternateContigs is not None:
-        d['gene_alterate_contigs'] = best_series.GeneAlternateContigs
-    if best_series.GeneName is not None:
-        d['source_gene_common_name'] = best_series.GeneName
-    if best_series.TranscriptBiotype == 'protein_coding':
+         'transcript_class': best_row['TranscriptClass'],
+         'gene_biotype': best_row['GeneBiotype'],
+         'transcript_biotype': best_row['TranscriptBiotype']}
+    if best_row['Paralogy'] > 1:
+        assert best_row['ParalogStatus'] is not None
+        d['paralogy'] = best_row['Paralogy']
+        d['paralog_status'] = best_row['ParalogStatus']
+    if 'GeneAlternateContigs' in best_row and best_row['GeneAlternateContigs'] is not None:
+        d['gene_alterate_contigs'] = best_row['GeneAlternateContigs']
+    if best_row['GeneName'] is not None:
+        d['source_gene_common_name'] = best_row['GeneName']
+    biotype = best_row['TranscriptBiotype']
+    if biotype == 'protein_coding':
         metrics['Transcript Modes'][evaluate_ties(best_rows)] += 1
-    metrics['Transcript Categories'][best_series.TranscriptBiotype][best_series.TranscriptClass] += 1
-    metrics['Coverage'][best_series.TranscriptBiotype].append(best_series.AlnCoverage)
-    metrics['Identity'][best_series.TranscriptBiotype].append(best_series.AlnIdentity)
-    metrics['Consensus Score'][best_series.TranscriptBiotype].append(best_series.ConsensusScore)
-    if hasattr(best_series, 'PercentIntronsSupported'):
+    metrics['Transcript Categories'][biotype][best_row['TranscriptClass']] += 1
+    metrics['Coverage'][biotype].append(best_row['AlnCoverage'])
+    metrics['Identity'][biotype].append(best_row['AlnIdentity'])
+    metrics['Consensus Score'][biotype].append(best_row['ConsensusScore'])
+    if 'PercentIntronsSupported' in best_row:
         # Add intron support, which we won't have if we don't have RNA-seq
-        metrics['Splice Support'][best_series.TranscriptBiotype].append(best_series.PercentIntronsSupported)
-    return best_series.AlignmentId, d
+        metrics['Splice Support'][biotype].append(best_row['PercentIntronsSupported'])
+    return best_row['AlignmentId'], d
 
 
 def evaluate_ties(best_rows):
     """Find out how many transcript modes agreed on this"""
-    return ','.join(sorted(set([tools.nameConversions.alignment_type(x) for x in best_rows.AlignmentId])))
-
-
-def is_failed_df(df):
-    """Failed genes have no passing/excellent transcripts. Handles series"""
-    try:
-        return not (df.TranscriptClass.str.contains('Passing').any() or
-                    df.TranscriptClass.str.contains('Excellent').any())
-    except AttributeError:
-        return df.TranscriptClass == 'Failing'
+    return ','.join(sorted(set([tools.nameConversions.alignment_type(x['AlignmentId']) for x in best_rows])))
 
 
 def rescue_failed_gene(gene_df, tx_dict, gene_id, metrics):
@@ -489,17 +650,25 @@ def rescue_failed_gene(gene_df, tx_dict, gene_id, metrics):
     gene_df['RescueScore'] = gene_df.ConsensusScore * tx_lengths
     gene_df = gene_df.sort_values('RescueScore', ascending=False)
     best_rows = find_best_score(gene_df, 'RescueScore')
-    return incorporate_tx(best_rows, gene_id, metrics, failed_gene=True)
+    return incorporate_tx(best_rows.reset_index().to_dict('records'), gene_id, metrics, failed_gene=True)
 
 
-def slice_df(df, ix):
+def find_group_slices(index):
     """
-    Slices a DataFrame by an index, handling the case where the index is missing
+    Finds the rows of each value in a sorted index, so that the groups of a DataFrame can be sliced out by position
+    instead of being looked up one at a time.
+    :param index: pandas Index where equal values are adjacent
+    :return: dict of {value: slice}
     """
-    try:
-        return df.xs(ix)
-    except KeyError:
-        return pd.DataFrame()
+    values = np.asarray(index)
+    if len(values) == 0:
+        return {}
+    boundaries = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate([[0], boundaries])
+    stops = np.concatenate([boundaries, [len(values)]])
+    r = {values[start]: slice(start, stop) for start, stop in itertools.izip(starts, stops)}
+    assert len(r) == len(starts), 'index is not grouped'
+    return r
 
 
 def find_novel_cgp_splices(gene_consensus_dict, gene_df, tx_dict, gene_id, common_name_map, metrics, failed_gene,
@@ -632,131 +801,151 @@ def calculate_completeness(final_consensus, metrics):
     metrics['Completeness'] = {'Gene': genes, 'Transcript': txs}
 
 
-def write_consensus_gps(consensus_gp, consensus_gp_info, final_consensus, tx_dict, genome):
+def write_consensus(final_consensus, tx_dict, genome, consensus_gp, consensus_gp_info, consensus_gff3):
     """
-    Write the resulting gp + gp_info, generating genome-specific unique identifiers
+    Write the resulting gp + gp_info + gff3, generating genome-specific unique identifiers.
+
+    final_consensus is sorted by position, so the transcripts of a gene are not always adjacent. A first pass numbers
+    the genes, records the positions of the transcripts of each gene and finds the gp_info columns. The genePred and
+    gp_info rows are then written in order, and the gff3 records gene by gene in order of their first transcript, so
+    that only the transcripts of one gene are held in memory at a time.
     """
-    gene_count = 0
-    tx_count = 1
-    consensus_gene_dict = DefaultOrderedDict(lambda: DefaultOrderedDict(list))  # used to make gff3 next
-    gp_infos = []
-    genes_seen = set()
+    def format_gp_info_value(val, column):
+        """formats a gp_info value the way pandas did, which writes integers as floats in columns with missing values"""
+        if val is None or (isinstance(val, float) and np.isnan(val)):
+            return ''
+        elif column in partial_columns and isinstance(val, (int, long, np.integer)) and not isinstance(val, bool):
+            return str(float(val))
+        return str(val)
+
+    gene_nums = []
+    genes = collections.OrderedDict()  # (chromosome, gene number) -> positions of its transcripts in final_consensus
+    source_gene_nums = {}
+    column_counts = collections.Counter()
+    for i, (tx, attrs) in enumerate(final_consensus):
+        tx_obj = tx_dict[tx]
+        # every transcript of a source gene gets the same number, even if other genes come between them
+        gene_num = source_gene_nums.setdefault(tx_obj.name2, len(source_gene_nums) + 1)
+        gene_nums.append(gene_num)
+        genes.setdefault((tx_obj.chromosome, gene_num), []).append(i)
+        column_counts.update(attrs.iterkeys())
+    columns = sorted(column_counts)
+    partial_columns = {column for column, count in column_counts.iteritems() if count < len(final_consensus)}
+
     consensus_gp = luigi.LocalTarget(consensus_gp)
-    with consensus_gp.open('w') as out_gp:
-        for tx, attrs in final_consensus:
-            tx_obj = copy.deepcopy(tx_dict[tx])
-            tx_obj.name = id_template.format(genome=genome, tag_type='T', unique_id=tx_count)
-            tx_obj.id = attrs.get('score', 0)
-            tx_count += 1
-            if tx_obj.name2 not in genes_seen:
-                genes_seen.add(tx_obj.name2)
-                gene_count += 1
-            tx_obj.name2 = id_template.format(genome=genome, tag_type='G', unique_id=gene_count)
-            out_gp.write('\t'.join(tx_obj.get_gene_pred()) + '\n')
-            consensus_gene_dict[tx_obj.chromosome][tx_obj.name2].append([tx_obj, attrs.copy()])
-            gp_info = attrs.copy()
-            gp_info['transcript_id'] = tx_obj.name
-            gp_info['gene_id'] = tx_obj.name2
-            gp_infos.append(gp_info)
-    gp_info_df = pd.DataFrame(gp_infos)
-    gp_info_df = gp_info_df.set_index(['gene_id', 'transcript_id'])
     consensus_gp_info = luigi.LocalTarget(consensus_gp_info)
-    with consensus_gp_info.open('w') as outf:
-        gp_info_df.to_csv(outf, sep='\t')
-    return consensus_gene_dict
-
-
-def write_consensus_gff3(consensus_gene_dict, consensus_gff3):
-    """
-    Write the consensus set in gff3 format
-    """
-    def convert_frame(exon_frame):
-        """converts genePred-style exonFrame to GFF-style phase"""
-        mapping = {0: 0, 1: 2, 2: 1, -1: '.'}
-        return mapping[exon_frame]
-
-    def convert_attrs(attrs, id_field):
-        """converts the attrs dict to a attributes field. assigns name to the gene common name for display"""
-        attrs['ID'] = id_field
-        try:
-            score = attrs['score']
-            del attrs['score']
-        except KeyError:
-            score = 0
-        if 'source_gene_common_name' in attrs:
-            attrs['Name'] = attrs['source_gene_common_name']
-        attrs_str = ['='.join([key, str(val)]) for key, val in sorted(attrs.iteritems())]
-        return score, ';'.join(attrs_str)
-
-    def generate_gene_record(chrom, tx_objs, gene_id, attrs):
-        """calculates the gene interval for this list of tx"""
-        intervals = set()
-        for tx in tx_objs:
-            intervals.update(tx.exon_intervals)
-        intervals = sorted(intervals)
-        strand = tx_objs[0].strand
-        # subset the attrs to gene fields
-        useful_keys = ['source_gene_common_name', 'source_gene', 'gene_biotype', 'failed_gene',
-                       'alternative_source_transcripts', 'paralog_status', 'gene_alterate_contigs']
-        attrs = {key: attrs[key] for key in useful_keys if key in attrs}
-        score, attrs_field = convert_attrs(attrs, gene_id)
-        return [chrom, 'CAT', 'gene', intervals[0].start + 1, intervals[-1].stop + 1, score, strand, '.', attrs_field]
-
-    def generate_transcript_record(chrom, tx_obj, attrs):
-        """generates transcript records, calls generate_exon_records to generate those too"""
-        tx_id = tx_obj.name
-        gene_id = tx_obj.name2
-        attrs['Parent'] = gene_id
-        score, attrs_field = convert_attrs(attrs, tx_id)
-        yield [chrom, 'CAT', 'transcript', tx_obj.start + 1, tx_obj.stop + 1, score, tx_obj.strand, '.', attrs_field]
-        for line in generate_exon_records(chrom, tx_obj, tx_id, attrs):
-            yield line
-        for line in generate_start_stop_codon_records(chrom, tx_obj, tx_id, attrs):
-            yield line
-
-    def generate_exon_records(chrom, tx_obj, tx_id, attrs):
-        """generates exon records"""
-        attrs['Parent'] = tx_id
-        for i, (exon, exon_frame) in enumerate(zip(*[tx_obj.exon_intervals, tx_obj.exon_frames]), 1):
-            score, attrs_field = convert_attrs(attrs, 'exon:{}:{}'.format(tx_id, i))
-            yield [chrom, 'CAT', 'exon', exon.start + 1, exon.stop + 1, score, exon.strand, '.', attrs_field]
-            cds_interval = exon.intersection(tx_obj.coding_interval)
-            if cds_interval is not None:
-                score, attrs_field = convert_attrs(attrs, 'CDS:{}:{}'.format(tx_id, i))
-                yield [chrom, 'CAT', 'CDS', cds_interval.start + 1, cds_interval.stop + 1, score, exon.strand,
-                       convert_frame(exon_frame), attrs_field]
-
-    def generate_start_stop_codon_records(chrom, tx_obj, tx_id, attrs):
-        """generate start/stop codon GFF3 records, handling frame appropriately"""
-        cds_frames = [x for x in tx_obj.exon_frames if x != -1]
-        if tx_obj.cds_start_stat == 'cmpl':
-            score, attrs_field = convert_attrs(attrs, 'start_codon:{}'.format(tx_id))
-            start, stop = tools.transcripts.get_start_interval(tx_obj)
-            if tx_obj.strand == '-':
-                start_frame = convert_frame(cds_frames[-1])
-            else:
-                start_frame = convert_frame(cds_frames[0])
-            yield [chrom, 'CAT', 'start_codon', start + 1, stop + 1, score, tx_obj.strand, start_frame, attrs_field]
-        if tx_obj.cds_end_stat == 'cmpl':
-            score, attrs_field = convert_attrs(attrs, 'stop_codon:{}'.format(tx_id))
-            start, stop = tools.transcripts.get_stop_interval(tx_obj)
-            if tx_obj.strand == '-':
-                stop_frame = convert_frame(cds_frames[-1])
-            else:
-                stop_frame = convert_frame(cds_frames[0])
-            yield [chrom, 'CAT', 'stop_codon', start + 1, stop + 1, score, tx_obj.strand, stop_frame, attrs_field]
-
-    # main gff3 writing logic
     consensus_gff3 = luigi.LocalTarget(consensus_gff3)
-    with consensus_gff3.open('w') as out_gff3:
+    with consensus_gp.open('w') as out_gp, consensus_gp_info.open('w') as out_gp_info, \
+            consensus_gff3.open('w') as out_gff3:
+        tools.fileOps.print_row(out_gp_info, ['gene_id', 'transcript_id'] + columns)
+        for i, (tx, attrs) in enumerate(final_consensus):
+            tx_id = id_template.format(genome=genome, tag_type='T', unique_id=i + 1)
+            gene_id = id_template.format(genome=genome, tag_type='G', unique_id=gene_nums[i])
+            tx_obj = tx_dict[tx]
+            out_gp.write('\t'.join(tx_obj.get_gene_pred(name=tx_id, name2=gene_id, uid=attrs.get('score', 0))) + '\n')
+            tools.fileOps.print_row(out_gp_info, [gene_id, tx_id] + [format_gp_info_value(attrs.get(column), column)
+                                                                     for column in columns])
+
         out_gff3.write('##gff-version 3\n')
-        for chrom in sorted(consensus_gene_dict):
-            for gene_id, tx_list in consensus_gene_dict[chrom].iteritems():
-                tx_objs, attrs_list = zip(*tx_list)
-                attrs = tx_list[0][1]  # grab the attrs from the first transcript
-                tools.fileOps.print_row(out_gff3, generate_gene_record(chrom, tx_objs, gene_id, attrs))
-                tx_lines = []
-                for tx_obj, attrs in tx_list:
-                    tx_lines.extend(list(generate_transcript_record(chrom, tx_obj, attrs)))
-                tx_lines = sorted(tx_lines, key=lambda l: l[3])
-                tools.fileOps.print_rows(out_gff3, tx_lines)
+        for (chrom, gene_num), positions in genes.iteritems():
+            gene_id = id_template.format(genome=genome, tag_type='G', unique_id=gene_num)
+            tx_list = []
+            for i in positions:
+                tx, attrs = final_consensus[i]
+                tx_list.append([tx_dict[tx], id_template.format(genome=genome, tag_type='T', unique_id=i + 1),
+                                attrs.copy()])
+            tools.fileOps.print_rows(out_gff3, generate_gene_records(chrom, gene_id, tx_list))
+
+
+def generate_gene_records(chrom, gene_id, tx_list):
+    """
+    Generates the gff3 records of one consensus gene: the gene record followed by the records of its transcripts
+    sorted by start position.
+    :param tx_list: list of [tx_obj, tx_id, attrs] for each transcript of this gene. attrs will be modified.
+    """
+    yield generate_gene_record(chrom, gene_id, [tx_obj for tx_obj, tx_id, attrs in tx_list], tx_list[0][2])
+    tx_lines = []
+    for tx_obj, tx_id, attrs in tx_list:
+        tx_lines.extend(generate_transcript_record(chrom, tx_obj, tx_id, gene_id, attrs))
+    for line in sorted(tx_lines, key=lambda l: l[3]):
+        yield line
+
+
+def convert_frame(exon_frame):
+    """converts genePred-style exonFrame to GFF-style phase"""
+    mapping = {0: 0, 1: 2, 2: 1, -1: '.'}
+    return mapping[exon_frame]
+
+
+def convert_attrs(attrs, id_field):
+    """converts the attrs dict to a attributes field. assigns name to the gene common name for display"""
+    attrs['ID'] = id_field
+    try:
+        score = attrs['score']
+        del attrs['score']
+    except KeyError:
+        score = 0
+    if 'source_gene_common_name' in attrs:
+        attrs['Name'] = attrs['source_gene_common_name']
+    attrs_str = ['='.join([key, str(val)]) for key, val in sorted(attrs.iteritems())]
+    return score, ';'.join(attrs_str)
+
+
+def generate_gene_record(chrom, gene_id, tx_objs, attrs):
+    """calculates the gene interval for this list of tx"""
+    intervals = set()
+    for tx in tx_objs:
+        intervals.update(tx.exon_intervals)
+    intervals = sorted(intervals)
+    strand = tx_objs[0].strand
+    # subset the attrs to gene fields
+    useful_keys = ['source_gene_common_name', 'source_gene', 'gene_biotype', 'failed_gene',
+                   'alternative_source_transcripts', 'paralog_status', 'gene_alterate_contigs']
+    attrs = {key: attrs[key] for key in useful_keys if key in attrs}
+    score, attrs_field = convert_attrs(attrs, gene_id)
+    return [chrom, 'CAT', 'gene', intervals[0].start + 1, intervals[-1].stop + 1, score, strand, '.', attrs_field]
+
+
+def generate_transcript_record(chrom, tx_obj, tx_id, gene_id, attrs):
+    """generates transcript records, calls generate_exon_records to generate those too"""
+    attrs['Parent'] = gene_id
+    score, attrs_field = convert_attrs(attrs, tx_id)
+    yield [chrom, 'CAT', 'transcript', tx_obj.start + 1, tx_obj.stop + 1, score, tx_obj.strand, '.', attrs_field]
+    for line in generate_exon_records(chrom, tx_obj, tx_id, attrs):
+        yield line
+    for line in generate_start_stop_codon_records(chrom, tx_obj, tx_id, attrs):
+        yield line
+
+
+def generate_exon_records(chrom, tx_obj, tx_id, attrs):
+    """generates exon records"""
+    attrs['Parent'] = tx_id
+    for i, (exon, exon_frame) in enumerate(zip(*[tx_obj.exon_intervals, tx_obj.exon_frames]), 1):
+        score, attrs_field = convert_attrs(attrs, 'exon:{}:{}'.format(tx_id, i))
+        yield [chrom, 'CAT', 'exon', exon.start + 1, exon.stop + 1, score, exon.strand, '.', attrs_field]
+        cds_interval = exon.intersection(tx_obj.coding_interval)
+        if cds_interval is not None:
+            score, attrs_field = convert_attrs(attrs, 'CDS:{}:{}'.format(tx_id, i))
+            yield [chrom, 'CAT', 'CDS', cds_interval.start + 1, cds_interval.stop + 1, score, exon.strand,
+                   convert_frame(exon_frame), attrs_field]
+
+
+def generate_start_stop_codon_records(chrom, tx_obj, tx_id, attrs):
+    """generate start/stop codon GFF3 records, handling frame appropriately"""
+    cds_frames = [x for x in tx_obj.exon_frames if x != -1]
+    if tx_obj.cds_start_stat == 'cmpl':
+        score, attrs_field = convert_attrs(attrs, 'start_codon:{}'.format(tx_id))
+        start, stop = tools.transcripts.get_start_interval(tx_obj)
+        if tx_obj.strand == '-':
+            start_frame = convert_frame(cds_frames[-1])
+        else:
+            start_frame = convert_frame(cds_frames[0])
+        yield [chrom, 'CAT', 'start_codon', start + 1, stop + 1, score, tx_obj.strand, start_frame, attrs_field]
+    if tx_obj.cds_end_stat == 'cmpl':
+        score, attrs_field = convert_attrs(attrs, 'stop_codon:{}'.format(tx_id))
+        start, stop = tools.transcripts.get_stop_interval(tx_obj)
+        if tx_obj.strand == '-':
+            stop_frame = convert_frame(cds_frames[-1])
+        else:
+            stop_frame = convert_frame(cds_frames[0])
+        yield [chrom, 'CAT', 'stop_codon', start + 1, stop + 1, score, tx_obj.strand, stop_frame, attrs_field]
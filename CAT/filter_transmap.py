@@ -121,10 +121,7 @@ def resolve_paralogs(updated_aln_eval_df, genome):
     :param updated_aln_eval_df: DataFrame produced by fit_distributions()
     :return: tuple of (metrics_dict, filtered DataFrame)
     """
-    def apply_label(s):
-        return s.TranscriptClass if s.ParalogStatus != 'NotConfident' else 'Failing'
-
-    updated_aln_eval_df['Score'] = updated_aln_eval_df.apply(calculate_synteny_score, axis=1)
+    updated_aln_eval_df['Score'] = calculate_synteny_score(updated_aln_eval_df)
     updated_aln_eval_df = updated_aln_eval_df.sort_values(by='Score', ascending=False)
 
     paralog_status = []  # stores the results for a new column
@@ -162,7 +159,7 @@ def resolve_paralogs(updated_aln_eval_df, genome):
     status_df = pd.DataFrame(paralog_status)
     status_df.columns = ['AlignmentId', 'ParalogStatus']
     merged = pd.merge(status_df, updated_aln_eval_df, on='AlignmentId')  # this filters out paralogous alignments
-    merged['TranscriptClass'] = merged.apply(apply_label, axis=1)
+    merged['TranscriptClass'] = np.where(merged.ParalogStatus != 'NotConfident', merged.TranscriptClass, 'Failing')
     return paralog_metrics, merged
 
 
@@ -201,7 +198,7 @@ def resolve_split_genes(paralog_filtered_df, tx_dict):
         for _, s in rec.iterrows():
             if gene_biotype is not None and s.TranscriptBiotype != gene_biotype:
                 continue
-            chroms[tx_dict[s.AlignmentId].chromosome].append([s.AlignmentId, calculate_synteny_score(s)])
+            chroms[tx_dict[s.AlignmentId].chromosome].append([s.AlignmentId, s.Score])
         return chroms
 
     def find_best_chroms(chroms):
@@ -265,16 +262,16 @@ def create_new_table(paralog_filtered_df, resolve_split_genes_flag):
     return df.set_index(['TranscriptId', 'AlignmentId'])
 
 
-def calculate_synteny_score(s):
+def calculate_synteny_score(df):
     """
-    Function to score an alignment. Scoring method:
+    Function to score alignments. Scoring method:
     0.2 * coverage + 0.35 * identity + 0.2 * percent_original_introns + 0.25 * synteny
-    :param s: pandas Series
-    :return: float between 0 and 1
+    :param df: pandas DataFrame
+    :return: Series of floats between 0 and 1
     """
-    r = 0.2 * s.TransMapCoverage + \
-        0.35 * s.TransMapIdentity + \
-        0.2 * s.TransMapPercentOriginalIntrons + \
-        0.25 * (1.0 * s.Synteny / 6)
-    assert 0 <= r <= 1
+    r = 0.2 * df.TransMapCoverage + \
+        0.35 * df.TransMapIdentity + \
+        0.2 * df.TransMapPercentOriginalIntrons + \
+        0.25 * (1.0 * df.Synteny / 6)
+    assert ((0 <= r) & (r <= 1)).all()
     return r
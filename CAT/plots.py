@@ -79,7 +79,7 @@ def load_tm_metrics(dbs):
         session = tools.sqlInterface.start_session(db_path)
         table = tools.sqlInterface.TmEval
         for classifier in ['TransMapCoverage', 'TransMapIdentity']:
-            query = session.query(table.AlignmentId, table.value).filter(table.classifier == classifier)
+            query = session.query(table.AlignmentId, getattr(table, classifier))
             tm_metrics[tm_name_map[classifier]][genome] = dict(query.all())
     return tm_metrics
 
@@ -89,7 +89,7 @@ def load_para_data(dbs):
     for genome, db_path in dbs.iteritems():
         session = tools.sqlInterface.start_session(db_path)
         table = tools.sqlInterface.TmEval
-        query = session.query(table.TranscriptId, table.value).filter(table.classifier == 'Paralogy')
+        query = session.query(table.TranscriptId, table.Paralogy)
         para_data[genome] = dict(query.all())
     return para_data
 
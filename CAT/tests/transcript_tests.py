@@ -1,5 +1,26 @@
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
 import unittest
-from tools.transcripts import Transcript, GenePredTranscript
+from StringIO import StringIO
+import pandas as pd
+from sqlalchemy import create_engine
+from align_transcripts import cache_key, get_uncached_sequences
+from consensus import write_consensus
+from calibrate_job_costs import fit_assignment, fit_rate, measure_assignment, parse_args, sample_dict
+from classify import build_metrics_df
+from tools.alignmentCache import AlignmentCache, fill_names
+from tools.bio import find_first_stop, translate_sequence
+from tools.dataOps import cost_partition
+from tools.intervals import UNMAPPED, ChromosomeInterval, IntervalIndex
+from tools.psl import PslRow, PslTable, identical_psl
+from tools.sqlInterface import CdsTmMetrics, create_long_format_view
+from tools.transcripts import Transcript, GenePredTranscript, TranscriptTable, TranscriptSequenceCache, \
+    get_gene_pred_dict
+from tools.twobit import TwoBitFile
 
 
 class PositiveStrandTranscriptTests(unittest.TestCase):
@@ -137,6 +158,21 @@ class PositiveStrandTranscriptTests(unittest.TestCase):
         self.assertEqual(self.t.get_cds(self.chrom_seq), self.cds_seq)
         self.assertEqual(self.t.get_protein_sequence(self.chrom_seq), self.amino_acid)
 
+    def test_batch_coordinate_translations(self):
+        """
+        Batch coordinate translations should agree with the single coordinate translations
+        """
+        def check(batch_fn, fn, coords):
+            expected = [UNMAPPED if fn(i) is None else fn(i) for i in coords]
+            self.assertEqual(list(batch_fn(coords)), expected)
+        coords = range(-2, 18)
+        check(self.t.chromosome_coordinates_to_mrna, self.t.chromosome_coordinate_to_mrna, coords)
+        check(self.t.chromosome_coordinates_to_cds, self.t.chromosome_coordinate_to_cds, coords)
+        check(self.t.mrna_coordinates_to_chromosome, self.t.mrna_coordinate_to_chromosome, coords)
+        check(self.t.mrna_coordinates_to_cds, self.t.mrna_coordinate_to_cds, coords)
+        check(self.t.cds_coordinates_to_chromosome, self.t.cds_coordinate_to_chromosome, coords)
+        check(self.t.cds_coordinates_to_mrna, self.t.cds_coordinate_to_mrna, coords)
+
 
 class NegativeStrandTranscriptTests(unittest.TestCase):
     """
@@ -256,6 +292,21 @@ class NegativeStrandTranscriptTests(unittest.TestCase):
             if tmp is not None:
                 self.assertEqual(self.t.chromosome_coordinate_to_mrna(tmp), i)
 
+    def test_batch_coordinate_translations(self):
+        """
+        Batch coordinate translations should agree with the single coordinate translations
+        """
+        def check(batch_fn, fn, coords):
+            expected = [UNMAPPED if fn(i) is None else fn(i) for i in coords]
+            self.assertEqual(list(batch_fn(coords)), expected)
+        coords = range(-2, 18)
+        check(self.t.chromosome_coordinates_to_mrna, self.t.chromosome_coordinate_to_mrna, coords)
+        check(self.t.chromosome_coordinates_to_cds, self.t.chromosome_coordinate_to_cds, coords)
+        check(self.t.mrna_coordinates_to_chromosome, self.t.mrna_coordinate_to_chromosome, coords)
+        check(self.t.mrna_coordinates_to_cds, self.t.mrna_coordinate_to_cds, coords)
+        check(self.t.cds_coordinates_to_chromosome, self.t.cds_coordinate_to_chromosome, coords)
+        check(self.t.cds_coordinates_to_mrna, self.t.cds_coordinate_to_mrna, coords)
+
 
 class ComplicatedTranscript1(unittest.TestCase):
     """
@@ -886,5 +937,580 @@ class NegativeStrandGenePredTranscript(NegativeStrandTranscriptTests):
         self.assertEqual(self.t.get_gene_pred(), self.tokens)
 
 
+class TranscriptSequenceCacheTests(unittest.TestCase):
+    """Tests TranscriptSequenceCache using the transcript from PositiveStrandGenePredTranscript"""
+    def setUp(self):
+        self.chrom_seq = {'chr1': 'GTATTCTTGGACCTAA'}
+        self.a = GenePredTranscript(['A', 'chr1', '+', '2', '15', '4', '13', '3', '2,7,12', '6,10,15', '1',
+                                     'q2', 'cmpl', 'cmpl', '2,0,0'])
+        self.b = GenePredTranscript(['B', 'chr1', '+', '2', '15', '4', '13', '3', '2,7,12', '6,10,15', '1',
+                                     'q2', 'cmpl', 'cmpl', '2,0,0'])
+
+    def test_sequences(self):
+        cache = TranscriptSequenceCache(self.chrom_seq)
+        for _ in range(2):
+            self.assertEqual(cache.get_mrna(self.a), self.a.get_mrna(self.chrom_seq))
+            self.assertEqual(cache.get_cds(self.a), self.a.get_cds(self.chrom_seq))
+            self.assertEqual(cache.get_cds(self.a, in_frame=True), self.a.get_cds(self.chrom_seq, in_frame=True))
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.hits, 3)
+
+    def test_eviction(self):
+        cache = TranscriptSequenceCache(self.chrom_seq, max_size=1)
+        cache.get_mrna(self.a)
+        cache.get_mrna(self.b)
+        cache.get_mrna(self.a)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(len(cache.cache), 1)
+
+
+class TranscriptTableTests(unittest.TestCase):
+    """
+    Tests the TranscriptTable against GenePredTranscript objects built from the same records as the
+    PositiveStrandGenePredTranscript and NegativeStrandGenePredTranscript tests.
+    """
+
+    def setUp(self):
+        self.records = [['A', 'chr1', '+', '2', '15', '4', '13', '3', '2,7,12', '6,10,15', '1', 'q2', 'cmpl', 'cmpl',
+                         '2,0,0'],
+                        ['B', 'chr1', '-', '2', '15', '4', '13', '3', '2,7,12', '6,10,15', '1', 'q2', 'cmpl', 'cmpl',
+                         '0,0,1'],
+                        ['C', 'chr2', '+', '0', '10', '0', '0', '1', '0', '10', '1', 'q3', 'none', 'none', '-1']]
+        self.txs = [GenePredTranscript(r) for r in self.records]
+        self.table = TranscriptTable.from_gene_preds([StringIO('\n'.join('\t'.join(r) for r in self.records))])
+
+    def test_mapping(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(list(self.table), ['A', 'B', 'C'])
+        self.assertIn('B', self.table)
+        self.assertNotIn('D', self.table)
+        for tx in self.txs:
+            self.assertEqual(self.table[tx.name].get_gene_pred(), tx.get_gene_pred())
+            self.assertEqual(self.table[tx.name].exon_intervals, tx.exon_intervals)
+
+    def test_vectorized_properties(self):
+        self.assertEqual(self.table.cds_sizes().tolist(), [tx.cds_size for tx in self.txs])
+        self.assertEqual(self.table.num_coding_exons().tolist(), [tx.num_coding_exons for tx in self.txs])
+        self.assertEqual(self.table.num_coding_introns().tolist(), [tx.num_coding_introns for tx in self.txs])
+        rows, starts, stops = self.table.get_intron_arrays()
+        self.assertEqual(zip(rows, starts, stops), [(i, x.start, x.stop) for i, tx in enumerate(self.txs)
+                                                    for x in tx.intron_intervals])
+
+    def test_duplicate_names(self):
+        with self.assertRaises(RuntimeError):
+            TranscriptTable.from_gene_preds([StringIO('\t'.join(self.records[0])),
+                                             StringIO('\t'.join(self.records[0]))])
+
+    def test_parse_cache(self):
+        """
+        genePred files are only cached when given a cache directory, and the cache is rebuilt when the file changes
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gp = os.path.join(tmp_dir, 'test.gp')
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            with open(gp, 'w') as outf:
+                outf.write('\n'.join('\t'.join(r) for r in self.records[:2]))
+            self.assertEqual(sorted(get_gene_pred_dict(gp)), ['A', 'B'])
+            self.assertEqual(os.listdir(tmp_dir), ['test.gp'])
+            self.assertEqual(sorted(get_gene_pred_dict(gp, cache_dir)), ['A', 'B'])
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertEqual(sorted(get_gene_pred_dict(gp, cache_dir)), ['A', 'B'])
+            with open(gp, 'w') as outf:
+                outf.write('\t'.join(self.records[2]))
+            os.utime(gp, (0, 0))  # make sure the modification time changes
+            table = TranscriptTable.from_gene_preds([gp], cache_dir=cache_dir)
+            self.assertEqual(table['C'].get_gene_pred(), self.txs[2].get_gene_pred())
+            self.assertEqual(list(table), ['C'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class IntervalIndexTests(unittest.TestCase):
+    """
+    Tests the IntervalIndex against the intervals drawn out below:
+    chrom    0  1  2  3  4  5  6  7  8  9  10 11 12 13 14 15
+    a        +  +  +  +
+    b                    -  -  -
+    c              +  +  +  +  +  +  +  +  +  +
+    d                                               +  +
+    """
+
+    def setUp(self):
+        self.a = ChromosomeInterval('chr1', 0, 4, '+')
+        self.b = ChromosomeInterval('chr1', 4, 7, '-')
+        self.c = ChromosomeInterval('chr1', 2, 12, '+')
+        self.d = ChromosomeInterval('chr1', 14, 16, '+')
+        self.index = IntervalIndex([self.a, self.b, self.c, self.d])
+
+    def test_overlapping(self):
+        """
+        overlap queries follow ChromosomeInterval.overlap() and report items in input order
+        """
+        q = ChromosomeInterval('chr1', 3, 5, '+')
+        self.assertEqual(self.index.overlapping(q), [self.a, self.b, self.c])
+        self.assertEqual(self.index.overlapping(q, stranded=True), [self.a, self.c])
+        self.assertEqual(self.index.overlapping(ChromosomeInterval('chr1', 12, 14, '+')), [])
+        self.assertEqual(self.index.overlapping(ChromosomeInterval('chr1', 15, 15, '+')), [self.d])
+
+    def test_contained(self):
+        """
+        containment queries follow ChromosomeInterval.subset()
+        """
+        q = ChromosomeInterval('chr1', 0, 7, '-')
+        self.assertEqual(self.index.contained(q), [self.a, self.b])
+        self.assertEqual(self.index.contained(q, stranded=True), [self.b])
+        self.assertEqual(self.index.contained(ChromosomeInterval('chr1', 5, 14, '+')), [])
+
+    def test_nearest(self):
+        """
+        nearest neighbour queries follow ChromosomeInterval.separation() and report all ties
+        """
+        self.assertEqual(self.index.nearest(ChromosomeInterval('chr1', 12, 13, '+')), [self.c])
+        self.assertEqual(self.index.nearest(ChromosomeInterval('chr1', 13, 13, '+')), [self.c, self.d])
+        self.assertEqual(self.index.nearest(ChromosomeInterval('chr1', 8, 9, '-'), stranded=True), [self.b])
+        self.assertEqual(IntervalIndex([]).nearest(ChromosomeInterval('chr1', 8, 9, '-')), [])
+
+
+def write_two_bit(path, seqs, endian='<'):
+    """
+    Writes (name, sequence) pairs to a version 0 2bit file the same way faToTwoBit does.
+    """
+    def blocks(pattern, seq):
+        spans = [m.span() for m in re.finditer(pattern, seq)]
+        starts = [start for start, stop in spans]
+        sizes = [stop - start for start, stop in spans]
+        return struct.pack(endian + 'I' * (1 + 2 * len(spans)), len(spans), *(starts + sizes))
+    records = []
+    for name, seq in seqs:
+        packed = seq.upper().replace('N', 'T') + 'T' * (-len(seq) % 4)
+        dna = ''.join(chr(sum('TCAG'.index(b) << (6 - 2 * j) for j, b in enumerate(packed[i:i + 4])))
+                      for i in xrange(0, len(packed), 4))
+        records.append(struct.pack(endian + 'I', len(seq)) + blocks('[Nn]+', seq) + blocks('[a-z]+', seq) +
+                       struct.pack(endian + 'I', 0) + dna)
+    offset = 16 + sum(5 + len(name) for name, seq in seqs)
+    with open(path, 'wb') as outf:
+        outf.write(struct.pack(endian + 'IIII', 0x1A412743, 0, len(seqs), 0))
+        for (name, seq), record in zip(seqs, records):
+            outf.write(chr(len(name)) + name + struct.pack(endian + 'I', offset))
+            offset += len(record)
+        outf.write(''.join(records))
+
+
+class TwoBitTests(unittest.TestCase):
+    """
+    Tests the TwoBitFile reader against sequences with N-blocks and soft-masked blocks at odd offsets
+    """
+    def setUp(self):
+        self.seqs = [('chr1', 'ACGTacgtNNNNnnACGTTTGCAnnnAC'), ('chr2', 'GATTACA'), ('chrN', 'NNNNNNN')]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_slices(self):
+        """
+        every slice, index and length matches the source sequence, for either byte order
+        """
+        for endian in ['<', '>']:
+            path = os.path.join(self.tmp_dir, 'test.2bit')
+            write_two_bit(path, self.seqs, endian)
+            two_bit = TwoBitFile(path)
+            self.assertEqual(list(two_bit), [name for name, seq in self.seqs])
+            for name, seq in self.seqs:
+                record = two_bit[name]
+                self.assertEqual(len(record), len(seq))
+                self.assertEqual(record[-1], seq[-1])
+                self.assertEqual(record[::-3], seq[::-3])
+                for i in xrange(len(seq) + 1):
+                    for j in xrange(i, len(seq) + 2):
+                        self.assertEqual(record[i:j], seq[i:j])
+
+    def test_upper(self):
+        """
+        upper drops the soft-masking but keeps the N-blocks
+        """
+        path = os.path.join(self.tmp_dir, 'test.2bit')
+        write_two_bit(path, self.seqs)
+        self.assertEqual(TwoBitFile(path, upper=True)['chr1'][2:14], self.seqs[0][1][2:14].upper())
+
+    def test_get_mrna(self):
+        """
+        transcripts extract their sequence from a TwoBitFile the same way they do from a dictionary of strings
+        """
+        path = os.path.join(self.tmp_dir, 'test.2bit')
+        write_two_bit(path, self.seqs)
+        tx = Transcript(['chr1', '2', '25', 'test', '0', '-', '4', '22', '0,128,0', '3', '4,5,6', '0,8,17'])
+        self.assertEqual(tx.get_mrna(TwoBitFile(path)), tx.get_mrna(dict(self.seqs)))
+        self.assertEqual(tx.get_cds(TwoBitFile(path)), tx.get_cds(dict(self.seqs)))
+
+
+class TranslationTests(unittest.TestCase):
+    """
+    Tests the table driven translation functions
+    """
+    def test_translate_sequence(self):
+        """
+        IUPAC-aware codons translate, other ambiguous codons become ? and a trailing partial codon is dropped
+        """
+        self.assertEqual(translate_sequence('atgGCNtarTTYaxg'), 'MA*F?')
+        self.assertEqual(translate_sequence('ATGA'), 'M')
+        self.assertEqual(translate_sequence(''), '')
+
+    def test_find_first_stop(self):
+        """
+        only complete in-frame codons are checked, and the final codon is skipped by default
+        """
+        self.assertEqual(find_first_stop('ATGTAAATGTGA'), 3)
+        self.assertEqual(find_first_stop('ATGTAAATGTGA', frame=1), None)
+        self.assertEqual(find_first_stop('ATGATGTGA'), None)
+        self.assertEqual(find_first_stop('ATGATGTGA', skip_last=False), 6)
+        self.assertEqual(find_first_stop('CTAGATGA', frame=1), 1)
+
+
+class IdenticalPslTests(unittest.TestCase):
+    """
+    Tests the PSL built for identical pairs, which skip alignment
+    """
+    def test_nucleotide(self):
+        """
+        case is ignored and N bases are counted as N matches
+        """
+        psl = identical_psl('q', 'ACNNgtAC', 't', 'acnnGTAC')
+        self.assertEqual(psl.psl_string(), ['6', '0', '0', '2', '0', '0', '0', '0', '+', 'q', '8', '0', '8', 't', '8',
+                                            '0', '8', '1', '8', '0', '0'])
+
+    def test_translated(self):
+        psl = identical_psl('q', 'ATGAAATAA', 't', 'ATGAAATAA', translated=True)
+        self.assertEqual(psl.psl_string(), ['9', '0', '0', '0', '0', '0', '0', '0', '++', 'q', '9', '0', '9', 't', '9',
+                                            '0', '9', '1', '9', '0', '0'])
+
+
+class PslTableTests(unittest.TestCase):
+    """
+    Tests that the bulk PSL parser produces the same rows as parsing each line with PslRow
+    """
+    rows = [['20', '1', '0', '0', '1', '3', '1', '5', '+', 'q1', '30', '2', '26', 'chr1', '1000', '100', '131', '3',
+             '4,6,11,', '2,9,15,', '100,104,120,'],
+            ['10', '0', '0', '2', '0', '0', '1', '50', '-', 'q2', '12', '0', '12', 'chr2', '500', '200', '262', '2',
+             '5,7,', '0,5,', '200,255,'],
+            ['27', '0', '0', '0', '0', '0', '0', '0', '+-', 'q3', '27', '0', '27', 'chr1', '1000', '300', '327', '1',
+             '9,', '0,', '673,'],
+            ['9', '0', '0', '0', '0', '0', '0', '0', '++', 'q1', '9', '0', '9', 't1', '9', '0', '9', '1', '9', '0',
+             '0']]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'test.psl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_rows(self, rows):
+        with open(self.path, 'w') as outf:
+            for row in rows:
+                outf.write('\t'.join(row) + '\n')
+
+    def test_round_trip(self):
+        """
+        multi-block, negative strand and translated rows, and block lists without a trailing comma
+        """
+        self.write_rows(self.rows)
+        table = PslTable.from_psl(self.path)
+        self.assertEqual(len(table), len(self.rows))
+        for i, (row, psl) in enumerate(zip(self.rows, table)):
+            expected = PslRow(row)
+            for attr in PslRow.__slots__:
+                self.assertEqual(getattr(psl, attr), getattr(expected, attr))
+                self.assertEqual(getattr(table.get_row(i), attr), getattr(expected, attr))
+            self.assertEqual(psl.psl_string(), expected.psl_string())
+
+    def test_malformed(self):
+        """
+        a row whose block lists do not match its blockCount is an error, even if the totals over the file match
+        """
+        bad = list(self.rows[0])
+        bad[17] = '2'
+        self.write_rows([bad] + self.rows[1:])
+        self.assertRaises(RuntimeError, PslTable.from_psl, self.path)
+        shifted = [list(self.rows[0]), list(self.rows[1])]
+        shifted[0][17], shifted[1][17] = '4', '1'
+        self.write_rows(shifted)
+        self.assertRaises(RuntimeError, PslTable.from_psl, self.path)
+        short = list(self.rows[1])
+        short[20] = '200,'
+        self.write_rows([short])
+        self.assertRaises(RuntimeError, PslTable.from_psl, self.path)
+
+
+class AlignmentCacheTests(unittest.TestCase):
+    """
+    Tests the persistent alignment cache
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.db')
+        self.psl = '\t'.join(['10', '0', '0', '0', '0', '0', '0', '0', '+', 'q1', '10', '0', '10', 't1', '10', '0',
+                              '10', '1', '10,', '0,', '0,'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        """
+        results are keyed by sequence, not name, and persist between instances. Failed alignments are cached too
+        """
+        key = AlignmentCache.make_key('blat', 'ACGTACGTAC', 'acgtacgtac')
+        self.assertEqual(key, AlignmentCache.make_key('blat', 'acgtacgtac', 'ACGTACGTAC'))
+        self.assertNotEqual(key, AlignmentCache.make_key('blat CDS', 'ACGTACGTAC', 'ACGTACGTAC'))
+        missing = AlignmentCache.make_key('blat', 'ACGT', 'TTTT')
+        AlignmentCache(self.path).put_many([(key, self.psl), (missing, None)])
+        hits = AlignmentCache(self.path).get_many([key, missing, 'other'])
+        self.assertEqual(sorted(hits.keys()), sorted([key, missing]))
+        self.assertIsNone(hits[missing])
+        self.assertEqual(fill_names(hits[key], 'q1', 't1'), self.psl)
+        self.assertEqual(fill_names(hits[key], 'q2', 't2').split('\t')[9:14], ['q2', '10', '0', '10', 't2'])
+
+    def test_evict(self):
+        """
+        the least recently used entries beyond max_entries are removed
+        """
+        cache = AlignmentCache(self.path, max_entries=2)
+        for key in ['a', 'b', 'c']:
+            cache.put_many([(key, self.psl)])
+            time.sleep(0.01)
+        cache.get_many(['a'])
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(sorted(cache.get_many(['a', 'b', 'c']).keys()), ['a', 'c'])
+        self.assertEqual(cache.evict(), 0)
+
+    def test_uncached_sequences(self):
+        """
+        only pairs missing from the cache are aligned, and a pair cached as failing to align adds no PSL line
+        """
+        aligned = ('q1', 'ACGTACGTAC', 't1', 'ACGTACGTAA')
+        failed = ('q2', 'ACGTTTTTTT', 't2', 'GGGGGGGGGG')
+        new = ('q3', 'CCCCACGTAC', 't3', 'ACGTACGTAC')
+        cache = AlignmentCache(self.path)
+        cache.put_many([(cache_key(aligned[1], aligned[3], 'mRNA'), self.psl),
+                        (cache_key(failed[1], failed[3], 'mRNA'), None)])
+        cached = []
+        pairs = list(get_uncached_sequences(iter([aligned, failed, new]), cache, 'mRNA', cached))
+        self.assertEqual(pairs, [new])
+        self.assertEqual(cached, [self.psl])
+
+
+class CostPartitionTests(unittest.TestCase):
+    """
+    Tests the longest-processing-time-first partitioner
+    """
+    def test_balanced(self):
+        """
+        the number of groups comes from the total cost, the expensive items are spread out and order is kept
+        """
+        items = [('a', 5), ('b', 1), ('c', 1), ('d', 4), ('e', 3), ('f', 2), ('g', 1), ('h', 1)]
+        groups = cost_partition(items, lambda (name, cost): cost, 6)
+        self.assertEqual(len(groups), 3)
+        self.assertEqual([sum(cost for name, cost in g) for g in groups], [6, 6, 6])
+        for g in groups:
+            self.assertEqual(g, sorted(g))
+        self.assertEqual(sorted(x for g in groups for x in g), items)
+
+    def test_limits(self):
+        """
+        max_size adds groups when needed, an expensive item is never split, and empty input gives no groups
+        """
+        groups = cost_partition(range(10), lambda x: 0, 1, max_size=3)
+        self.assertEqual(sorted(len(g) for g in groups), [1, 3, 3, 3])
+        self.assertEqual(cost_partition([100], lambda x: x, 1), [[100]])
+        self.assertEqual(cost_partition([], lambda x: x, 1), [])
+
+
+
+class CalibrateJobCostsTests(unittest.TestCase):
+    """
+    Tests the fitting and the parent assignment measurements of calibrate_job_costs.py
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_gp(self, name, rows):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as outf:
+            for tx_id, chrom, name2, exons in rows:
+                starts, ends = zip(*exons)
+                outf.write('\t'.join(map(str, [tx_id, chrom, '+', starts[0], ends[-1], starts[0], ends[-1], len(exons),
+                                               ','.join(map(str, starts)) + ',', ','.join(map(str, ends)) + ',', 0,
+                                               name2, 'cmpl', 'cmpl', ','.join(['0'] * len(exons)) + ','])) + '\n')
+        return path
+
+    def test_sample_dict(self):
+        d = {str(i): i for i in xrange(20)}
+        self.assertEqual(sample_dict(d, 50, 1), sorted(d.items()))
+        sample = sample_dict(d, 5, 1)
+        self.assertEqual(len(sample), 5)
+        self.assertTrue(all(d[k] == v for k, v in sample))
+        self.assertEqual(sample, sample_dict(d, 5, 1))
+
+    def test_fit_rate(self):
+        """
+        the rate preserves the total time, rather than averaging the per-measurement rates
+        """
+        self.assertAlmostEqual(fit_rate([100, 300], [1, 5]), 6 / 400.)
+
+    def test_fit_assignment(self):
+        measurements = [(exons, jaccards, 2e-4 + 2e-5 * exons + 0.04 * jaccards)
+                        for exons, jaccards in [(1, 0), (5, 0), (12, 0), (3, 2), (8, 4), (20, 3)]]
+        fit = fit_assignment(measurements)
+        for name, expected in [['transcript', 2e-4], ['exon', 2e-5], ['jaccard', 0.04]]:
+            self.assertAlmostEqual(fit[name], expected)
+
+    def test_measure_assignment(self):
+        """
+        a CGP transcript spanning two genes that only shares exons with one counts a comparison per transMap
+        transcript without running bedtools. Chromosomes without transMap transcripts are skipped
+        """
+        tm_gp = self.write_gp('tm.gp', [['T1-1', 'chr1', 'G1', [(100, 200), (300, 400)]],
+                                        ['T2-1', 'chr1', 'G2', [(450, 500), (700, 800)]]])
+        cgp_gp = self.write_gp('cgp.gp', [['g1.t1', 'chr1', 'g1', [(150, 250), (600, 650)]],
+                                          ['g2.t1', 'chr1', 'g2', [(5000, 5100)]],
+                                          ['g3.t1', 'chr2', 'g3', [(100, 200)]]])
+        db_path = os.path.join(self.tmp_dir, 'ref.db')
+        pd.DataFrame({'TranscriptId': ['T1', 'T2'], 'GeneId': ['G1', 'G2'],
+                      'GeneBiotype': ['protein_coding', 'protein_coding']}).to_sql(
+            'annotation', create_engine('sqlite:///{}'.format(db_path)), index=False)
+        args = parse_args(['assignment', '--ref-db-path', db_path, '--tm-gp', tm_gp, '--cgp-gp', cgp_gp])
+        measurements = measure_assignment(args)
+        self.assertEqual([(exons, jaccards) for exons, jaccards, seconds in measurements], [(2, 2), (1, 0)])
+        self.assertTrue(all(seconds >= 0 for _, _, seconds in measurements))
+
+    def test_parse_args(self):
+        """
+        existing paths are made absolute, and TMR mode needs a hints database
+        """
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            open('genome.2bit', 'w').close()
+            args = parse_args(['augustus', '--mode', 'TM', '--genome-two-bit', 'genome.2bit', '--gp', 'x.gp',
+                               '--tm-psl', 'x.psl', '--ref-psl', 'ref.psl'])
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(args.genome_two_bit, os.path.join(os.path.realpath(self.tmp_dir), 'genome.2bit'))
+        self.assertEqual(args.gp, 'x.gp')
+        self.assertTrue(args.cfg.endswith(os.path.join('augustus_cfgs', 'extrinsic.ETM1.cfg')))
+        self.assertRaises(SystemExit, parse_args, ['augustus', '--mode', 'TMR', '--genome-two-bit', 'genome.2bit',
+                                                   '--gp', 'x.gp', '--tm-psl', 'x.psl', '--ref-psl', 'ref.psl'])
+
+
+class WriteConsensusTests(unittest.TestCase):
+    """
+    Tests the consensus genePred, gp_info and GFF3 writer
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.tmp_dir, 'consensus.' + ext) for ext in ['gp', 'gp_info', 'gff3']]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, rows):
+        """
+        :param rows: list of (name, chrom, start, stop, source gene, attrs) for single exon noncoding transcripts
+        :return: list of the lines of each output file
+        """
+        tx_dict = {name: GenePredTranscript([name, chrom, '+', start, stop, stop, stop, 1, '{},'.format(start),
+                                             '{},'.format(stop), 0, gene, 'none', 'none', '-1,'])
+                   for name, chrom, start, stop, gene, attrs in rows}
+        write_consensus([[name, attrs] for name, chrom, start, stop, gene, attrs in rows], tx_dict, 'genome',
+                        *self.paths)
+        return [[l.rstrip('\n').split('\t') for l in open(path)] for path in self.paths]
+
+    def test_outputs(self):
+        """
+        transcripts and genes are numbered in order, and integers in gp_info columns with missing values are written
+        as floats
+        """
+        gps, gp_infos, gff3 = self.write([['A-1', 'chr1', 100, 200, 'GA', {'score': 90.0, 'paralogy': 2}],
+                                          ['A-2', 'chr1', 120, 250, 'GA', {'score': 85.5}],
+                                          ['B-1', 'chr2', 150, 300, 'GB', {}]])
+        self.assertEqual([(gp[0], gp[10], gp[11]) for gp in gps],
+                         [('genome_T0000001', '90.0', 'genome_G0000001'),
+                          ('genome_T0000002', '85.5', 'genome_G0000001'),
+                          ('genome_T0000003', '0', 'genome_G0000002')])
+        self.assertEqual(gp_infos, [['gene_id', 'transcript_id', 'paralogy', 'score'],
+                                    ['genome_G0000001', 'genome_T0000001', '2.0', '90.0'],
+                                    ['genome_G0000001', 'genome_T0000002', '', '85.5'],
+                                    ['genome_G0000002', 'genome_T0000003', '', '']])
+        self.assertEqual(gff3[0], ['##gff-version 3'])
+        self.assertEqual([(l[0], l[2], l[3], l[4]) for l in gff3[1:] if l[2] in ['gene', 'transcript']],
+                         [('chr1', 'gene', '101', '251'), ('chr1', 'transcript', '101', '201'),
+                          ('chr1', 'transcript', '121', '251'), ('chr2', 'gene', '151', '301'),
+                          ('chr2', 'transcript', '151', '301')])
+
+    def test_interleaved_genes(self):
+        """
+        a gene whose transcripts are not adjacent in position order keeps one ID, and its GFF3 records stay together
+        """
+        gps, gp_infos, gff3 = self.write([['A-1', 'chr1', 100, 200, 'GA', {}],
+                                          ['B-1', 'chr1', 150, 300, 'GB', {}],
+                                          ['A-2', 'chr1', 250, 400, 'GA', {}]])
+        self.assertEqual([gp[11] for gp in gps], ['genome_G0000001', 'genome_G0000002', 'genome_G0000001'])
+        self.assertEqual([info[0] for info in gp_infos[1:]], [gp[11] for gp in gps])
+        self.assertEqual([(l[2], l[3], l[4]) for l in gff3[1:] if l[2] in ['gene', 'transcript']],
+                         [('gene', '101', '401'), ('transcript', '101', '201'), ('transcript', '251', '401'),
+                          ('gene', '151', '301'), ('transcript', '151', '301')])
+
+
+class LongFormatViewTests(unittest.TestCase):
+    """
+    Tests that the <table>_Long view of a wide metrics table gives the rows of the old long format metrics table
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///{}'.format(os.path.join(self.tmp_dir, 'genome.db')))
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_metrics_view(self):
+        """
+        the StartCodon and StopCodon rows of non-coding transcripts are left out, as they were never written
+        """
+        # GeneId, TranscriptId, AlignmentId, AlnCoverage, AlnIdentity, PercentUnknownBases, PercentOriginalIntrons,
+        # PercentOriginalExons, StartCodon, StopCodon as produced by classify.metrics_classify
+        rows = [['G2', 'T3', 'T3-1', 99.5, 98.0, 0.0, 100.0, 100.0, True, False],
+                ['G1', 'T1', 'T1-2', 80.0, 75.25, 1.5, 50.0, 66.7, False, True],
+                ['G1', 'T2', 'T2-1', 100.0, 100.0, 0.0, 0.0, 100.0, None, None]]
+        build_metrics_df(rows).to_sql(CdsTmMetrics.__tablename__, self.engine)
+        create_long_format_view(self.engine, CdsTmMetrics)
+        # the rows the old metrics_classify wrote, which only had codon rows for protein coding transcripts
+        classifiers = ['AlnCoverage', 'AlnIdentity', 'PercentUnknownBases', 'PercentOriginalIntrons',
+                       'PercentOriginalExons', 'StartCodon', 'StopCodon']
+        expected = sorted((row[0], row[1], row[2], classifier, float(value))
+                          for row in rows for classifier, value in zip(classifiers, row[3:]) if value is not None)
+        query = 'SELECT GeneId, TranscriptId, AlignmentId, classifier, value FROM "{}_Long"'.format(
+            CdsTmMetrics.__tablename__)
+        found = sorted(tuple(row) for row in self.engine.execute(query))
+        self.assertEqual(found, expected)
+        self.assertEqual(len(found), 3 * 7 - 2)
+
+    def test_replace(self):
+        """
+        rewriting the table and the view picks up the new rows
+        """
+        for rows in [[['G1', 'T1', 'T1-1', 90.0, 90.0, 0.0, 100.0, 100.0, True, True]],
+                     [['G1', 'T1', 'T1-1', 50.0, 40.0, 0.0, 100.0, 100.0, None, None]]]:
+            build_metrics_df(rows).to_sql(CdsTmMetrics.__tablename__, self.engine, if_exists='replace')
+            create_long_format_view(self.engine, CdsTmMetrics)
+        query = 'SELECT classifier, value FROM "{}_Long" WHERE classifier IN (\'AlnCoverage\', \'StartCodon\')'.format(
+            CdsTmMetrics.__tablename__)
+        self.assertEqual([tuple(row) for row in self.engine.execute(query)], [('AlnCoverage', 50.0)])
+
 if __name__ == '__main__':
     unittest.main()
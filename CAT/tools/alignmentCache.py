@@ -0,0 +1,98 @@
+"""
+A persistent cache of pairwise alignment results, stored in a sqlite database.
+
+Entries are keyed by a hash of the aligner settings and the two aligned sequences, so the same pair of sequences
+is only aligned once no matter which genome, transcript mode or run it comes from. The sequence names are not part of
+the key; they are removed from the PSL before it is stored and filled back in on retrieval. A pair that did not align
+is cached as None.
+
+The cache is bounded to max_entries. evict() removes the least recently used entries beyond that.
+"""
+import hashlib
+import time
+
+from sqlite import ExclusiveSqlConnection
+
+__author__ = 'Ian Fiddes'
+
+# sqlite limits the number of variables in a single statement
+_QUERY_SIZE = 500
+
+
+class AlignmentCache(object):
+    """Cache of PSL lines keyed by make_key()"""
+    def __init__(self, path, max_entries=5 * 10 ** 6):
+        self.path = path
+        self.max_entries = max_entries
+        with ExclusiveSqlConnection(self.path) as con:
+            con.execute('CREATE TABLE IF NOT EXISTS alignments (key TEXT PRIMARY KEY, psl TEXT, last_used REAL)')
+            con.execute('CREATE INDEX IF NOT EXISTS alignments_last_used ON alignments (last_used)')
+
+    @staticmethod
+    def make_key(settings, q_seq, t_seq):
+        """
+        Hashes the settings used to align a pair and the pair's sequences. Case is ignored.
+        :param settings: string describing everything besides the sequences that affects the alignment
+        """
+        h = hashlib.sha1()
+        for x in [settings, q_seq.upper(), t_seq.upper()]:
+            h.update(x)
+            h.update('\0')
+        return h.hexdigest()
+
+    def get_many(self, keys):
+        """
+        Looks up keys, marking the ones found as recently used.
+        :return: dictionary of key to PSL template (see fill_names) or None, for the keys that were found
+        """
+        keys = list(set(keys))
+        hits = {}
+        with ExclusiveSqlConnection(self.path) as con:
+            for i in xrange(0, len(keys), _QUERY_SIZE):
+                batch = keys[i:i + _QUERY_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                for key, psl in con.execute('SELECT key, psl FROM alignments WHERE key IN ({})'.format(placeholders),
+                                            batch):
+                    hits[key] = psl
+            now = time.time()
+            con.executemany('UPDATE alignments SET last_used = ? WHERE key = ?', [(now, key) for key in hits])
+        return hits
+
+    def put_many(self, items):
+        """
+        Stores alignment results.
+        :param items: iterable of (key, PSL line or None) tuples
+        """
+        now = time.time()
+        rows = [(key, strip_names(psl) if psl is not None else None, now) for key, psl in items]
+        with ExclusiveSqlConnection(self.path) as con:
+            con.executemany('INSERT OR REPLACE INTO alignments VALUES (?, ?, ?)', rows)
+
+    def evict(self):
+        """
+        Removes the least recently used entries beyond max_entries.
+        :return: number of entries removed
+        """
+        with ExclusiveSqlConnection(self.path) as con:
+            num_entries = con.execute('SELECT COUNT(*) FROM alignments').fetchone()[0]
+            excess = num_entries - self.max_entries
+            if excess <= 0:
+                return 0
+            con.execute('DELETE FROM alignments WHERE key IN '
+                        '(SELECT key FROM alignments ORDER BY last_used LIMIT ?)', (excess,))
+        return excess
+
+
+def strip_names(psl):
+    """Removes the query and target names from a tab separated PSL line, producing a template"""
+    tokens = psl.split('\t')
+    tokens[9] = tokens[13] = ''
+    return '\t'.join(tokens)
+
+
+def fill_names(template, q_name, t_name):
+    """Fills the query and target names into a template produced by strip_names"""
+    tokens = template.split('\t')
+    tokens[9] = q_name
+    tokens[13] = t_name
+    return '\t'.join(tokens)
@@ -4,8 +4,10 @@ Basic biology related functions
 import string
 import array
 import os
+import numpy as np
 from pyfasta import Fasta, NpyFastaRecord
 from fileOps import opengz
+from twobit import TwoBitFile
 
 
 class UpperNpyFastaRecord(NpyFastaRecord):
@@ -131,6 +133,22 @@ _codon_table = {
     }
 
 
+# For bulk translation each base is mapped to its index in _codon_alphabet (any other character gets the final index)
+# and each codon to the number formed by its three base indices, which indexes into a flat amino acid table.
+_codon_alphabet = ''.join(sorted({b for c in _codon_table for b in c}))
+_codon_radix = len(_codon_alphabet) + 1
+_base_to_index = [chr(len(_codon_alphabet))] * 256
+for _i, _b in enumerate(_codon_alphabet):
+    _base_to_index[ord(_b)] = _base_to_index[ord(_b.lower())] = chr(_i)
+_base_to_index = ''.join(_base_to_index)
+_amino_acid_table = np.full(_codon_radix ** 3, '?', dtype='S1')
+for _c, _aa in _codon_table.iteritems():
+    if len(_c) == 3:
+        _amino_acid_table[(_codon_alphabet.index(_c[0]) * _codon_radix + _codon_alphabet.index(_c[1])) * _codon_radix +
+                          _codon_alphabet.index(_c[2])] = _aa
+_is_stop_table = _amino_acid_table == '*'
+
+
 def codon_to_amino_acid(c):
     """
     Given a codon C, return an amino acid or ??? if codon unrecognized.
@@ -144,22 +162,49 @@ def codon_to_amino_acid(c):
     return '?'
 
 
+def codon_indices(sequence):
+    """
+    Converts the complete codons of a sequence, read from the first base, to indices into the bulk translation
+    tables. Case insensitive.
+    :param sequence: DNA string
+    :return: numpy array with one index per codon
+    """
+    sequence = str(sequence)
+    sequence = sequence[:len(sequence) - len(sequence) % 3].translate(_base_to_index)
+    bases = np.frombuffer(sequence, dtype=np.uint8).reshape(-1, 3).astype(np.intp)
+    return (bases[:, 0] * _codon_radix + bases[:, 1]) * _codon_radix + bases[:, 2]
+
+
 def translate_sequence(sequence):
     """
     Translates a given DNA sequence to single-letter amino acid
     space. If the sequence is not a multiple of 3 and is not a unique degenerate codon it will be truncated silently.
     """
-    result = []
     sequence = sequence.upper()
-    i = 0
-    for i in xrange(0, len(sequence) - len(sequence) % 3, 3):
-        result.append(codon_to_amino_acid(sequence[i: i + 3]))
+    result = _amino_acid_table[codon_indices(sequence)].tostring()
+    i = max(len(result) - 1, 0) * 3
     if len(sequence) % 3 == 2:
         c = codon_to_amino_acid(sequence[i + 3:] + 'N')
         assert len(c) == 3, sequence
         if c != '?':
-            result.append(c)
-    return ''.join(result)
+            result += c
+    return result
+
+
+def find_first_stop(seq, frame=0, skip_last=True):
+    """
+    Finds the first stop codon among the codons read_codons_with_position(seq, frame, skip_last) would produce.
+    :param seq: DNA string
+    :param frame: offset of the first codon
+    :param skip_last: ignore the final codon, as read_codons_with_position does
+    :return: position of the first base of the stop codon in seq, or None if there is none
+    """
+    l = len(seq)
+    if skip_last:
+        l -= 3
+    num_codons = len(xrange(frame, l - l % 3, 3))
+    stops = np.flatnonzero(_is_stop_table[codon_indices(seq[frame:frame + 3 * num_codons])])
+    return frame + 3 * int(stops[0]) if len(stops) > 0 else None
 
 
 def read_codons(seq, offset=0, skip_last=True):
@@ -188,8 +233,11 @@ def read_codons_with_position(seq, offset=0, skip_last=True):
 def get_sequence_dict(file_path, upper=True):
     """
     Returns a dictionary of fasta records. If upper is true, all bases will be uppercased.
+    A .2bit path is read directly through a memory map; a fasta path must have been flattened by pyfasta.
     """
     assert os.path.exists(file_path), ('Error: FASTA file {} does not exist'.format(file_path))
+    if file_path.endswith('.2bit'):
+        return TwoBitFile(file_path, upper=upper)
     gdx_path = file_path + ".gdx"
     assert os.path.exists(gdx_path), ("Error: gdx does not exist for this fasta. We need the fasta files to be "
                                       "flattened in place prior to running the pipeline because of concurrency issues.")
@@ -2,6 +2,8 @@
 Operations on dictionaries and lists.
 """
 from collections import namedtuple
+import heapq
+import math
 import operator
 import itertools
 import pandas as pd
@@ -50,6 +52,36 @@ def grouper(iterable, size):
         chunk = tuple(itertools.islice(it, size))
 
 
+def cost_partition(iterable, cost_fn, target_cost, max_size=None):
+    """
+    Splits iterable into groups whose total cost is close to target_cost, using longest-processing-time-first bin
+    packing: the number of groups is fixed by the total cost, and each item, most expensive first, is added to the
+    group with the lowest total cost so far.
+    :param iterable: items to partition
+    :param cost_fn: function that estimates the cost of an item
+    :param target_cost: desired total cost of each group
+    :param max_size: if set, the maximum number of items in a group
+    :return: list of lists of items. Within a group, items keep their original order.
+    """
+    items = list(iterable)
+    if len(items) == 0:
+        return []
+    costs = [cost_fn(item) for item in items]
+    num_groups = int(math.ceil(sum(costs) / float(target_cost)))
+    if max_size is not None:
+        num_groups = max(num_groups, int(math.ceil(len(items) / float(max_size))))
+    num_groups = min(max(num_groups, 1), len(items))
+    heap = [(0, i) for i in xrange(num_groups)]
+    groups = [[] for _ in xrange(num_groups)]
+    for pos in sorted(xrange(len(items)), key=lambda x: -costs[x]):
+        load, i = heapq.heappop(heap)
+        groups[i].append(pos)
+        # a full group is not pushed back on to the heap
+        if max_size is None or len(groups[i]) < max_size:
+            heapq.heappush(heap, (load + costs[pos], i))
+    return [[items[pos] for pos in sorted(group)] for group in groups if len(group) > 0]
+
+
 def munge_nested_dicts_for_plotting(data_dict, norm=False, sort_column=None):
     """
     Munges nested dictionaries into a pandas DataFrame. If sort_column is not None, will order rows based on values
@@ -7,6 +7,7 @@ Modified: Ian Fiddes
 
 import os
 import errno
+import cPickle
 import socket
 import shutil
 import gzip
@@ -254,3 +255,39 @@ def hashfile(fspec, hasher=hashlib.sha256, blocksize=65536, num_characters=8):
         hasher.update(buf)
         buf = fh.read(blocksize)
     return hasher.hexdigest()[:num_characters]
+
+
+def load_cached_parse(file_path, parse_fn, tag, cache_dir=None):
+    """
+    Returns parse_fn(file_path). If cache_dir is set, the result is cached in a pickle in cache_dir so that unchanged
+    files are not re-parsed. The pickle is named after the absolute path of file_path and records its size and
+    modification time; it is rebuilt whenever those no longer match. Caching is meant for pipeline inputs that several
+    modules read, with cache_dir in the work directory. Temporary files should not be cached.
+    :param file_path: Path of the file to parse.
+    :param parse_fn: Function that takes file_path and returns a picklable object.
+    :param tag: Name of the parsed format. Used in the pickle file name and the cache key, so should be changed
+        whenever the output of parse_fn changes.
+    :param cache_dir: Directory to cache in. If None, file_path is parsed without caching.
+    :return: the output of parse_fn
+    """
+    if cache_dir is None:
+        return parse_fn(file_path)
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    key = (tag, file_path, stat.st_size, stat.st_mtime)
+    cache_path = os.path.join(cache_dir, '{}.{}.cache'.format(hashlib.sha1(file_path).hexdigest(), tag))
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as inf:
+                cached_key, data = cPickle.load(inf)
+            if cached_key == key:
+                return data
+        except (EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+            pass  # truncated or otherwise unreadable sidecar, rebuild it
+    data = parse_fn(file_path)
+    ensure_dir(cache_dir)
+    tmp_path = get_tmp_file(tmp_dir=cache_dir)
+    with open(tmp_path, 'wb') as outf:
+        cPickle.dump((key, data), outf, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, cache_path)
+    return data
@@ -1,10 +1,14 @@
 """
 Represent continuous genomic coordinates. Allows for coordinate arithmetic.
 """
+import numpy as np
 from bio import reverse_complement
 
 __author__ = 'Ian Fiddes'
 
+# sentinel value used by the batch coordinate translation functions to mark a position that does not map
+UNMAPPED = -1
+
 
 class ChromosomeInterval(object):
     """
@@ -266,3 +270,98 @@ def interval_not_within_wiggle_room_intervals(intervals, interval, wiggle_room=0
     except TypeError:
         return False
     return not any(x <= 2 * wiggle_room for x in separation)  # we allow wiggle on both sides
+
+
+class IntervalIndex(object):
+    """
+    Static overlap index over a collection of intervals on a single chromosome. Accepts ChromosomeInterval objects
+    or anything else with start, stop and strand attributes, such as Transcript objects.
+
+    Items are binned by the bit length of their size, and each bin keeps its starts sorted in a NumPy array. Every
+    item in a bin is shorter than 2 ** bin, so the items in that bin that can overlap a query form a contiguous slice
+    of the sorted starts found by bisection. An overlap query therefore costs O(B log N + K) for B bins and K
+    candidates instead of a scan over the whole collection.
+
+    Query results are always returned in the order the items were given to the constructor.
+    """
+    def __init__(self, items):
+        self.items = list(items)
+        self._starts = np.array([item.start for item in self.items], dtype=np.int64)
+        self._stops = np.array([item.stop for item in self.items], dtype=np.int64)
+        self._bins = []
+        bin_ids = np.array([int(size).bit_length() for size in self._stops - self._starts], dtype=np.int64)
+        for bin_id in np.unique(bin_ids):
+            members = np.flatnonzero(bin_ids == bin_id)
+            members = members[np.argsort(self._starts[members], kind='mergesort')]
+            self._bins.append((2 ** int(bin_id), self._starts[members], self._stops[members], members))
+        # global orderings are used for containment and nearest neighbour queries
+        self._start_order = np.argsort(self._starts, kind='mergesort')
+        self._sorted_starts = self._starts[self._start_order]
+        self._stop_order = np.argsort(self._stops, kind='mergesort')
+        self._sorted_stops = self._stops[self._stop_order]
+
+    def __len__(self):
+        return len(self.items)
+
+    def _keep(self, position, interval, stranded):
+        return stranded is False or self.items[position].strand == interval.strand
+
+    def _to_items(self, positions, interval, stranded):
+        """Convert item positions to a list of items in input order, optionally filtering by strand"""
+        return [self.items[i] for i in sorted(positions) if self._keep(i, interval, stranded)]
+
+    def _overlapping_positions(self, interval):
+        hits = []
+        for max_size, starts, stops, members in self._bins:
+            lo = np.searchsorted(starts, interval.start - max_size, side='right')
+            hi = np.searchsorted(starts, interval.stop, side='left')
+            if lo < hi:
+                hits.append(members[lo:hi][stops[lo:hi] > interval.start])
+        if len(hits) == 0:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(hits)
+
+    def overlapping(self, interval, stranded=False):
+        """
+        Find all items that overlap an interval, using the same rules as ChromosomeInterval.overlap().
+        :param interval: A ChromosomeInterval, or any object with start, stop and strand attributes.
+        :param stranded: Only report items on the same strand as interval?
+        :return: list of items
+        """
+        return self._to_items(self._overlapping_positions(interval), interval, stranded)
+
+    def contained(self, interval, stranded=False):
+        """
+        Find all items that lie entirely within an interval, using the same rules as ChromosomeInterval.subset().
+        :param interval: A ChromosomeInterval, or any object with start, stop and strand attributes.
+        :param stranded: Only report items on the same strand as interval?
+        :return: list of items
+        """
+        lo = np.searchsorted(self._sorted_starts, interval.start, side='left')
+        hi = np.searchsorted(self._sorted_starts, interval.stop, side='right')
+        candidates = self._start_order[lo:hi]
+        return self._to_items(candidates[self._stops[candidates] <= interval.stop], interval, stranded)
+
+    def nearest(self, interval, stranded=False):
+        """
+        Find the items closest to an interval, as measured by ChromosomeInterval.separation(). Overlapping items have
+        a separation of 0. Every item tied for the smallest separation is reported.
+        :param interval: A ChromosomeInterval, or any object with start, stop and strand attributes.
+        :param stranded: Only report items on the same strand as interval?
+        :return: list of items, empty if the index has no items (on this strand)
+        """
+        found = [(0, i) for i in self._overlapping_positions(interval) if self._keep(i, interval, stranded)]
+        best = 0 if found else None
+        # walk outwards on either side; separation only grows, so stop once it exceeds the best seen
+        left = np.searchsorted(self._sorted_stops, interval.start, side='right')
+        right = np.searchsorted(self._sorted_starts, interval.stop, side='left')
+        for positions, distance_fn in [[reversed(self._stop_order[:left]), lambda i: interval.start - self._stops[i]],
+                                       [self._start_order[right:], lambda i: self._starts[i] - interval.stop]]:
+            for i in positions:
+                distance = distance_fn(i)
+                if best is not None and distance > best:
+                    break
+                if self._keep(i, interval, stranded):
+                    best = distance if best is None else min(best, distance)
+                    found.append((distance, i))
+        return self._to_items({i for distance, i in found if distance == best}, interval, False)
@@ -4,6 +4,8 @@ Library mathematical operations
 import bisect
 import math
 
+import numpy as np
+
 
 def format_ratio(numerator, denominator, num_digits=None, resolve_nan=None):
     """
@@ -40,3 +42,19 @@ def find_closest(numeric_list, query_number):
         return after
     else:
         return before
+
+
+def find_closest_sorted(sorted_array, query_array):
+    """
+    Vectorized version of find_closest. For each number in query_array, find the number in sorted_array that is
+    numerically closest, resolving ties the same way as find_closest. sorted_array must be sorted and non-empty.
+    :return: numpy array the same length as query_array
+    """
+    sorted_array = np.asarray(sorted_array)
+    query_array = np.asarray(query_array)
+    pos = np.searchsorted(sorted_array, query_array, side='left')
+    before = sorted_array[np.clip(pos - 1, 0, len(sorted_array) - 1)]
+    after = sorted_array[np.clip(pos, 0, len(sorted_array) - 1)]
+    closest = np.where(after - query_array < query_array - before, after, before)
+    closest = np.where(pos == 0, sorted_array[0], closest)
+    return np.where(pos == len(sorted_array), sorted_array[-1], closest)
@@ -4,10 +4,14 @@ Convenience library for working with psl alignment files.
 Original Author: Dent Earl
 Modified by Ian Fiddes
 """
+import gc
 import math
 from collections import Counter
 
-from tools.fileOps import iter_lines
+import numpy as np
+
+from tools.fileOps import load_cached_parse, opengz
+from tools.intervals import UNMAPPED
 from tools.mathOps import format_ratio
 
 __author__ = 'Ian Fiddes'
@@ -96,6 +100,44 @@ class PslRow(object):
             return self.t_starts[i] + offset
         return None
 
+    def target_coordinates_to_query(self, positions):
+        """ Batch version of target_coordinate_to_query. Takes an array of positions in target coordinates
+        (positive) and converts them to query coordinates (positive). Positions that do not fall within an aligned
+        block are reported as UNMAPPED.
+        """
+        if self.strand not in ['+', '-', '++']:
+            raise NotImplementedError('PslRow does not support coordinate conversions for strand {}'.format(self.strand))
+        p = np.asarray(positions, dtype=np.int64)
+        t_starts = np.array(self.t_starts)
+        block_sizes = np.array(self.block_sizes)
+        i = np.searchsorted(t_starts, p, side='right') - 1
+        valid = (i >= 0) & (self.t_start <= p) & (p < self.t_end)
+        i = np.clip(i, 0, len(t_starts) - 1)
+        valid &= p < t_starts[i] + block_sizes[i]
+        q = np.array(self.q_starts)[i] + p - t_starts[i]
+        if self.strand == '-':
+            q = self.q_size - q - 1
+        return np.where(valid, q, UNMAPPED)
+
+    def query_coordinates_to_target(self, positions):
+        """ Batch version of query_coordinate_to_target. Takes an array of positions in query coordinates
+        (positive) and converts them to target coordinates (positive). Positions that do not fall within an aligned
+        block are reported as UNMAPPED.
+        """
+        if self.strand not in ['+', '-', '++']:
+            raise NotImplementedError('PslRow does not support coordinate conversions for strand {}'.format(self.strand))
+        p = np.asarray(positions, dtype=np.int64)
+        valid = (self.q_start <= p) & (p < self.q_end)
+        if self.strand == '-':
+            p = self.q_size - p - 1
+        q_starts = np.array(self.q_starts)
+        block_sizes = np.array(self.block_sizes)
+        i = np.searchsorted(q_starts, p, side='right') - 1
+        valid &= i >= 0
+        i = np.clip(i, 0, len(q_starts) - 1)
+        valid &= p < q_starts[i] + block_sizes[i]
+        return np.where(valid, np.array(self.t_starts)[i] + p - q_starts[i], UNMAPPED)
+
     @property
     def coverage(self):
         return format_ratio(self.matches + self.mismatches + self.repmatches, self.q_size,
@@ -144,23 +186,214 @@ class PslRow(object):
                          ','.join([str(b) for b in self.t_starts])])
 
 
-def psl_iterator(psl_file, make_unique=False):
+_PSL_INT_FIELDS = ('matches', 'mismatches', 'repmatches', 'n_count', 'q_num_insert', 'q_base_insert', 't_num_insert',
+                   't_base_insert', 'q_size', 'q_start', 'q_end', 't_size', 't_start', 't_end', 'block_count')
+_PSL_INT_COLUMNS = (0, 1, 2, 3, 4, 5, 6, 7, 10, 11, 12, 14, 15, 16, 17)
+_PSL_DTYPE = np.dtype([(field, np.int64) for field in _PSL_INT_FIELDS])
+
+
+class PslTable(object):
+    """
+    Columnar store of the rows of a PSL file. The integer fields are held in a structured NumPy array, records, whose
+    field names match the PslRow attributes. Blocks use CSR-style indexing: the blocks of row i are
+    block_sizes[block_ptr[i]:block_ptr[i + 1]], and the same slices of q_starts and t_starts.
+
+    Iterating over the table produces PslRow objects. These are materialized from bulk conversions of the arrays,
+    so no per-token parsing is done.
+    """
+    def __init__(self, records, strands, q_names, t_names, block_ptr, block_sizes, q_starts, t_starts):
+        self.records = records
+        self.strands = strands
+        self.q_names = q_names
+        self.t_names = t_names
+        self.block_ptr = block_ptr
+        self.block_sizes = block_sizes
+        self.q_starts = q_starts
+        self.t_starts = t_starts
+
+    @classmethod
+    def from_psl(cls, psl_file, cache_dir=None):
+        """
+        Loads a PSL file.
+        :param psl_file: A PSL file path.
+        :param cache_dir: If set, the file is read through the parse cache in this directory (see
+            tools.fileOps.load_cached_parse).
+        :return: PslTable
+        """
+        return cls(**load_cached_parse(psl_file, _parse_psl_columns, 'psl_table', cache_dir))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.get_rows())
+
+    def get_rows(self):
+        """
+        Materializes every row. The cyclic garbage collector is paused while doing so: none of the new objects can
+        form a cycle, and allocating this many containers otherwise triggers repeated full collections that cost
+        several times more than building the rows.
+        :return: list of PslRow objects
+        """
+        ptr = self.block_ptr.tolist()
+        block_sizes = self.block_sizes.tolist()
+        q_starts = self.q_starts.tolist()
+        t_starts = self.t_starts.tolist()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return [_make_psl_row(ints, self.strands[i], self.q_names[i], self.t_names[i],
+                                  block_sizes[ptr[i]:ptr[i + 1]], q_starts[ptr[i]:ptr[i + 1]],
+                                  t_starts[ptr[i]:ptr[i + 1]])
+                    for i, ints in enumerate(self.records.tolist())]
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def get_row(self, i):
+        """
+        Builds the PslRow for row i.
+        :param i: integer row index
+        :return: PslRow
+        """
+        lo, hi = self.block_ptr[i], self.block_ptr[i + 1]
+        return _make_psl_row(self.records[i].tolist(), self.strands[i], self.q_names[i], self.t_names[i],
+                             self.block_sizes[lo:hi].tolist(), self.q_starts[lo:hi].tolist(),
+                             self.t_starts[lo:hi].tolist())
+
+
+def _make_psl_row(ints, strand, q_name, t_name, block_sizes, q_starts, t_starts):
+    """
+    Builds a PslRow from already converted fields. ints holds the integer fields in the order of _PSL_INT_FIELDS.
+    """
+    psl = PslRow.__new__(PslRow)
+    (psl.matches, psl.mismatches, psl.repmatches, psl.n_count, psl.q_num_insert, psl.q_base_insert,
+     psl.t_num_insert, psl.t_base_insert, psl.q_size, psl.q_start, psl.q_end, psl.t_size, psl.t_start, psl.t_end,
+     psl.block_count) = ints
+    psl.strand = strand
+    psl.q_name = q_name
+    psl.t_name = t_name
+    psl.block_sizes = block_sizes
+    psl.q_starts = q_starts
+    psl.t_starts = t_starts
+    return psl
+
+
+def _parse_ints(strings, expected):
     """
-    Iterates over PSL file generating PslRow objects returning the name and the object itself
+    Converts a list of strings holding whitespace or comma separated integers in one numpy call.
+    :param strings: list of strings
+    :param expected: number of integers that must be found
+    :return: numpy array
+    """
+    values = np.fromstring(' '.join(strings).replace(',', ' ').strip(), dtype=np.int64, sep=' ')
+    if len(values) != expected:
+        raise RuntimeError('Expected {} integers in PSL columns, found {}. Is this a valid PSL?'.format(expected,
+                                                                                                      len(values)))
+    return values
+
+
+def _parse_block_list(strings, expected):
+    """
+    Converts a PSL block list column. Block lists written by the kent tools end with a comma, so simply concatenating
+    them gives a valid comma separated string. If that does not produce the expected number of integers, falls back
+    to _parse_ints, which handles any separators.
+    :param strings: list of strings
+    :param expected: number of integers that must be found
+    :return: numpy array
+    """
+    values = np.fromstring(''.join(strings), dtype=np.int64, sep=',')
+    if len(values) != expected:
+        values = _parse_ints(strings, expected)
+    return values
+
+
+def _check_block_counts(strings, block_counts, q_names, column):
+    """
+    Checks that every row of a block list column has block_count entries. The blocks of all rows are parsed together,
+    so a row with the wrong number of blocks would otherwise shift blocks into the rows that follow it. Block lists
+    written by the kent tools end with a comma, so commas are counted first, and only rows that do not match are
+    counted again the way PslRow does.
+    :param strings: list of block list strings, one per row
+    :param block_counts: numpy array of the blockCount of each row
+    :param q_names: list of query names, for the error message
+    :param column: name of the column, for the error message
+    """
+    lengths = np.array([s.count(',') + (len(s) > 0 and s[-1] != ',') for s in strings], dtype=np.int64)
+    for i in np.flatnonzero(lengths != block_counts):
+        found = len([x for x in strings[i].split(',') if x])
+        if found != block_counts[i]:
+            raise RuntimeError('PSL row {} ({}) has blockCount {} but {} {}. Is this a valid PSL?'.format(
+                i + 1, q_names[i], block_counts[i], found, column))
+
+
+def _parse_psl_columns(psl_file):
+    """
+    Parses a PSL file into the columns of a PslTable in a single pass. The whole file is split into one flat token
+    list and columns are taken by striding it. Each integer column and each block list column is then joined into
+    one string and converted by NumPy, instead of converting tokens one at a time.
+    :param psl_file: A PSL file path.
+    :return: dict of column name to list or numpy array
+    """
+    with opengz(psl_file) as inf:
+        text = inf.read()
+    if text.startswith('#') or '\n#' in text:
+        text = '\n'.join(l for l in text.splitlines() if not l.startswith('#'))
+    text = text.rstrip('\n')
+    num_rows = text.count('\n') + 1 if len(text) > 0 else 0
+    # PSL fields never contain whitespace, so a plain split() is enough unless there are empty fields
+    tokens = text.split()
+    if len(tokens) != 21 * num_rows:
+        tokens = text.replace('\n', '\t').split('\t') if len(text) > 0 else []
+    assert(len(tokens) == 21 * num_rows)
+    columns = [tokens[i::21] for i in xrange(21)]
+    ints = _parse_ints([' '.join(columns[i]) for i in _PSL_INT_COLUMNS], num_rows * len(_PSL_INT_FIELDS))
+    ints = ints.reshape(len(_PSL_INT_FIELDS), num_rows)
+    records = np.empty(num_rows, dtype=_PSL_DTYPE)
+    for field, values in zip(_PSL_INT_FIELDS, ints):
+        records[field] = values
+    for i, column in [[18, 'blockSizes'], [19, 'qStarts'], [20, 'tStarts']]:
+        _check_block_counts(columns[i], records['block_count'], columns[9], column)
+    block_ptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(records['block_count'], out=block_ptr[1:])
+    return {'records': records, 'strands': [intern(x) for x in columns[8]], 'q_names': columns[9],
+            't_names': [intern(x) for x in columns[13]], 'block_ptr': block_ptr,
+            'block_sizes': _parse_block_list(columns[18], block_ptr[-1]),
+            'q_starts': _parse_block_list(columns[19], block_ptr[-1]),
+            't_starts': _parse_block_list(columns[20], block_ptr[-1])}
+
+
+def psl_iterator(psl_file, make_unique=False, cache_dir=None):
+    """
+    Iterates over PSL file generating PslRow objects returning the name and the object itself. If cache_dir is set,
+    the file is read through the parse cache in that directory (see tools.fileOps.load_cached_parse).
     """
     counts = Counter()
-    with open(psl_file) as inf:
-        for tokens in iter_lines(inf):
-            psl = PslRow(tokens)
-            if make_unique is True:
-                counts[psl.q_name] += 1
-                numbered_aln_id = '-'.join([psl.q_name, str(counts[psl.q_name])])
-                psl.q_name = numbered_aln_id
-            yield psl
+    for psl in PslTable.from_psl(psl_file, cache_dir):
+        if make_unique is True:
+            counts[psl.q_name] += 1
+            numbered_aln_id = '-'.join([psl.q_name, str(counts[psl.q_name])])
+            psl.q_name = numbered_aln_id
+        yield psl
 
 
-def get_alignment_dict(psl_file, make_unique=False):
+def get_alignment_dict(psl_file, make_unique=False, cache_dir=None):
     """
     Convenience function for creating a dictionary of PslRow objects.
     """
-    return {psl.q_name: psl for psl in psl_iterator(psl_file, make_unique)}
+    return {psl.q_name: psl for psl in psl_iterator(psl_file, make_unique, cache_dir)}
+
+
+def identical_psl(q_name, q_seq, t_name, t_seq, translated=False):
+    """
+    Builds the single block PslRow for two sequences that are identical, ignoring case, without aligning them. N bases
+    are counted in nCount rather than matches, except in translated alignments.
+    :param translated: report the alignment as a translated alignment, as BLAT does in CDS mode
+    :return: PslRow
+    """
+    assert q_seq.upper() == t_seq.upper()
+    size = len(q_seq)
+    n_count = 0 if translated else q_seq.upper().count('N')
+    strand = '++' if translated else '+'
+    return PslRow([size - n_count, 0, 0, n_count, 0, 0, 0, 0, strand, q_name, size, 0, size, t_name, size, 0, size, 1,
+                   '{},'.format(size), '0,', '0,'])
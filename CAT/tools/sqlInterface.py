@@ -4,7 +4,7 @@ Functions to interface with the sqlite databases produced by various steps of th
 import collections
 
 import pandas as pd
-from sqlalchemy import Column, Integer, Text, Float, Boolean, func, create_engine
+from sqlalchemy import Column, Integer, Text, Float, Boolean, case, func, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -76,20 +76,37 @@ class CdsAugCgpEval(EvaluationColumns, Base):
 
 
 class MetricsColumns(object):
-    """Mixin class for all TranscriptMetrics module tables"""
+    """Mixin class for all TranscriptMetrics module tables. Has one row per alignment and one column per classifier"""
     GeneId = Column(Text, primary_key=True)
     TranscriptId = Column(Text, primary_key=True)
     AlignmentId = Column(Text, primary_key=True)
-    classifier = Column(Text, primary_key=True)
-    value = Column(Float)
+    AlnCoverage = Column(Float)
+    AlnIdentity = Column(Float)
+    PercentUnknownBases = Column(Float)
+    PercentOriginalIntrons = Column(Float)
+    PercentOriginalExons = Column(Float)
+    StartCodon = Column(Float)  # stored as 0 or 1, and null for non-coding transcripts
+    StopCodon = Column(Float)
 
 
-class TmEval(MetricsColumns, Base):
-    """Table for evaluations from TransMapEvaluation module"""
+class TmEval(Base):
+    """Table for evaluations from TransMapEvaluation module. Has one row per alignment and one column per classifier"""
     __tablename__ = 'TransMapEvaluation'
-
-
-class TmFilterEval(MetricsColumns, Base):
+    GeneId = Column(Text, primary_key=True)
+    TranscriptId = Column(Text, primary_key=True)
+    AlignmentId = Column(Text, primary_key=True)
+    Paralogy = Column(Integer)
+    Synteny = Column(Integer)
+    AlnExtendsOffContig = Column(Boolean)
+    AlnPartialMap = Column(Boolean)
+    AlnAbutsUnknownBases = Column(Boolean)
+    AlnContainsUnknownBases = Column(Boolean)
+    TransMapCoverage = Column(Float)
+    TransMapIdentity = Column(Float)
+    TransMapPercentOriginalIntrons = Column(Float)
+
+
+class TmFilterEval(Base):
     """Table for evaluations from FilterTransMap module. This table is stored in a stacked format for simplicity."""
     __tablename__ = 'TransMapFilterEvaluation'
     GeneId = Column(Text, primary_key=True)
@@ -204,6 +221,27 @@ tables = {'hgm': {'augCGP': AugCgpIntronSupport, 'augTM': AugTmIntronSupport,
                    'transMap': {'metrics': MrnaTmMetrics, 'evaluation': MrnaTmEval}}}
 
 
+# tables with one column per classifier. Each of these has a view named <table>_Long in the long format of
+# (GeneId, TranscriptId, AlignmentId, classifier, value) for compatibility with queries against older databases
+wide_tables = [TmEval, MrnaTmMetrics, MrnaAugTmMetrics, MrnaAugTmrMetrics,
+               CdsTmMetrics, CdsAugTmMetrics, CdsAugTmrMetrics, CdsAugCgpMetrics]
+
+
+def create_long_format_view(con, table):
+    """
+    Creates or replaces the long format view of a wide classifier table. Null values are left out of the view.
+    :param con: sqlite3 connection to the genome database
+    :param table: One of wide_tables
+    """
+    assert table in wide_tables
+    classifiers = [c.name for c in table.__table__.columns if not c.primary_key]
+    selects = ["SELECT GeneId, TranscriptId, AlignmentId, '{0}' AS classifier, {0} AS value FROM \"{1}\" "
+               "WHERE {0} IS NOT NULL".format(classifier, table.__tablename__) for classifier in classifiers]
+    view = '{}_Long'.format(table.__tablename__)
+    con.execute('DROP VIEW IF EXISTS "{}"'.format(view))
+    con.execute('CREATE VIEW "{}" AS {}'.format(view, ' UNION ALL '.join(selects)))
+
+
 ###
 # Attributes functions -- read data from the annotation table
 ###
@@ -320,8 +358,12 @@ def load_alignment_evaluation(db_path):
     """
     engine = create_engine('sqlite:///' + db_path)
     df = pd.read_sql_table(TmEval.__tablename__, engine)
-    df = pd.pivot_table(df, index=['TranscriptId', 'AlignmentId'], columns='classifier', values='value', fill_value=0)
-    return df.reset_index()
+    # single exon alignments have no introns to evaluate, which is scored as 0
+    df['TransMapPercentOriginalIntrons'] = df.TransMapPercentOriginalIntrons.fillna(0)
+    # resolve_paralogs() picks the first of tied alignments after an unstable sort, so the rows are put in a fixed order
+    df = df.sort_values(['TranscriptId', 'AlignmentId']).reset_index(drop=True)
+    # GeneId comes from the filter evaluation table when these are combined
+    return df.drop('GeneId', axis=1)
 
 
 def load_filter_evaluation(db_path):
@@ -353,30 +395,33 @@ def load_tm_fit(db_path, biotype='protein_coding'):
 
 def load_evaluation(table, session):
     """
-    load evaluation entries for this gene. Makes use of count() and group by to get the # of times the classifier failed
+    load evaluation entries for this gene. Makes use of sum() and group by to get the # of times each classifier failed,
+    with one column per classifier seen in this table.
     :param table: One of the evaluation tables
     :param session: Active sqlalchemy session.
     :return: DataFrame
     """
     assert any(table == cls for cls in (MrnaAugTmrEval, MrnaAugTmEval, MrnaTmEval,
                                         CdsAugCgpEval, CdsAugTmrEval, CdsAugTmEval, CdsTmEval))
-    query = session.query(table.GeneId, table.TranscriptId, table.AlignmentId, table.classifier,
-                          func.count(table.classifier).label('value')). \
-        group_by(table.AlignmentId, table.TranscriptId, table.classifier)
+    classifiers = sorted(x[0] for x in session.query(table.classifier).distinct())
+    counts = [func.sum(case([(table.classifier == classifier, 1)], else_=0)).label(classifier)
+              for classifier in classifiers]
+    query = session.query(table.GeneId, table.TranscriptId, table.AlignmentId, *counts). \
+        group_by(table.AlignmentId, table.TranscriptId)
     return pd.read_sql(query.statement, session.bind)
 
 
 def load_metrics(table, session):
     """
-    load metrics entries for this gene. Wrapper for generic_gene_query.
+    load metrics entries for this gene. The table is read with its stored types, so StartCodon and StopCodon are
+    floats that are NaN for non-coding transcripts.
     :param table: One of the metrics tables
     :param session: Active sqlalchemy session.
     :return: DataFrame
     """
     assert any(table == cls for cls in (MrnaAugTmrMetrics, MrnaAugTmMetrics, MrnaTmMetrics,
                                         CdsAugCgpMetrics, CdsAugTmrMetrics, CdsAugTmMetrics, CdsTmMetrics))
-    query = session.query(table)
-    return pd.read_sql(query.statement, session.bind)
+    return pd.read_sql_table(table.__tablename__, session.bind)
 
 
 def load_intron_vector(table, session):
@@ -8,6 +8,9 @@ chromosomal target.
 This process also uses a larger fuzz distance under the idea that more wiggle room is allowed here before we provide
 Augustus a chance at fixing the problem. We are more stringent when evaluating the results.
 """
+import numpy as np
+
+import tools.intervals
 import tools.procOps
 
 cmd = ['transMap2hints.pl', '--ep_cutoff=0', '--ep_margin=12', '--min_intron_len=50', '--start_stop_radius=5',
@@ -25,7 +28,7 @@ def tm_to_hints(tm_tx, tm_psl, ref_psl):
     :return: GFF formatted string.
     """
     ref_starts = fix_ref_q_starts(ref_psl)
-    intron_vector = ['1' if is_fuzzy_intron(i, tm_psl, ref_starts) else '0' for i in tm_tx.intron_intervals]
+    intron_vector = ['1' if x else '0' for x in find_fuzzy_introns(tm_tx.intron_intervals, tm_psl, ref_starts)]
     tm_gp = '\t'.join(tm_tx.get_gene_pred())
     tm_rec = ''.join([tm_gp, '\t', ','.join(intron_vector), '\n'])
     return tools.procOps.popen_catch(cmd, tm_rec)
@@ -45,18 +48,24 @@ def fix_ref_q_starts(ref_psl):
     return ref_starts
 
 
-def is_fuzzy_intron(intron, tm_psl, ref_starts, fuzz_distance=12):
+def find_fuzzy_introns(introns, tm_psl, ref_starts, fuzz_distance=12):
     """
-    Determines if a intron is within fuzz distance of its aligned partner.
-    :param intron: ChromosomeInterval for this intron
+    Determines which introns are within fuzz distance of their aligned partner.
+    :param introns: list of ChromosomeIntervals for the introns of tm_tx
     :param tm_psl: PslRow object for the relationship between tm_tx and ref_tx
     :param ref_starts: list of transcript coordinates that are intron boundaries in the reference transcript
     :param fuzz_distance: max distance allowed to be moved in transcript coordinate space
-    :return: boolean
+    :return: numpy boolean array, one value per intron
     """
-    q_gap_start = tm_psl.target_coordinate_to_query(intron.start - 1)
-    q_gap_stop = tm_psl.target_coordinate_to_query(intron.stop)
-    fuzzed_start = q_gap_start - fuzz_distance
-    fuzzed_stop = q_gap_stop + fuzz_distance
-    r = [fuzzed_start <= ref_gap <= fuzzed_stop for ref_gap in ref_starts]
-    return any(r)
+    intron_starts = np.array([i.start - 1 for i in introns], dtype=np.int64)
+    intron_stops = np.array([i.stop for i in introns], dtype=np.int64)
+    q_gap_starts = tm_psl.target_coordinates_to_query(intron_starts)
+    q_gap_stops = tm_psl.target_coordinates_to_query(intron_stops)
+    mapped = (q_gap_starts != tools.intervals.UNMAPPED) & (q_gap_stops != tools.intervals.UNMAPPED)
+    fuzzed_starts = q_gap_starts - fuzz_distance
+    fuzzed_stops = q_gap_stops + fuzz_distance
+    # count the reference intron boundaries that fall within [fuzzed_start, fuzzed_stop] for each intron
+    ref_starts = np.sort(np.array(ref_starts, dtype=np.int64))
+    num_within = (np.searchsorted(ref_starts, fuzzed_stops, side='right') -
+                  np.searchsorted(ref_starts, fuzzed_starts, side='left'))
+    return mapped & (num_within > 0)
@@ -1,40 +1,65 @@
 """
 Helper functions for toil-luigi interfacing
 """
+import gzip
+import shutil
 import bio
+from fileOps import get_tmp_toil_file
 
 ###
 # Helper functions for luigi-toil pipelines
 ###
 
 
-def load_fasta_from_filestore(job, fasta_file_ids, prefix='genome', upper=False):
+def load_two_bit_from_filestore(job, two_bit_file_id, prefix='genome', upper=False):
     """
-    Convenience function that will load a fasta from the fileStore and return the local path to it. This works with
-    the pyfasta module to load all of the required files.
+    Convenience function that will load a 2bit genome from the fileStore and return a sequence dictionary for it.
     :param job: current job.
-    :param fasta_file_ids: list of fileStore file ID for the fasta, gdx, and flat file.
+    :param two_bit_file_id: fileStore file ID for the 2bit file.
     :param prefix: local file path prefix
     :param upper: force all entries to upper case
-    :return: open pyfasta Fasta record pointing to the file.
+    :return: TwoBitFile mapping sequence names to records.
     """
-    fasta_local_path = '{}.fasta'.format(prefix)
-    fasta_file_id, gdx_file_id, flat_file_id = fasta_file_ids
-    job.fileStore.readGlobalFile(fasta_file_id, fasta_local_path)
-    job.fileStore.readGlobalFile(gdx_file_id, '{}.fasta.gdx'.format(prefix))
-    job.fileStore.readGlobalFile(flat_file_id, '{}.fasta.flat'.format(prefix))
-    return bio.get_sequence_dict(fasta_local_path, upper=upper)
+    two_bit_local_path = '{}.2bit'.format(prefix)
+    job.fileStore.readGlobalFile(two_bit_file_id, two_bit_local_path)
+    return bio.get_sequence_dict(two_bit_local_path, upper=upper)
 
 
-def write_fasta_to_filestore(toil, fasta_local_path):
+def write_two_bit_to_filestore(toil, two_bit_local_path):
     """
-    Convenience function that loads a fasta and its associated gdx/flat file into the fileStore.
-    Assumes that the paths are consistent with the requirements (i.e. $path.gdx and $path.flat)
+    Convenience function that loads a 2bit genome into the fileStore.
     :param toil: Toil context manager
-    :param fasta_local_path: Path to local fasta to load.
-    :return: List of fileStore IDs for fasta, fasta_gdx, fasta_flat
+    :param two_bit_local_path: Path to local 2bit to load.
+    :return: fileStore ID for the 2bit file
     """
-    fasta_file_id = toil.importFile('file:///' + fasta_local_path)
-    gdx_file_id = toil.importFile('file:///' + fasta_local_path + '.gdx')
-    flat_file_id = toil.importFile('file:///' + fasta_local_path + '.flat')
-    return fasta_file_id, gdx_file_id, flat_file_id
+    return toil.importFile('file:///' + two_bit_local_path)
+
+
+def write_lines_to_filestore(job, lines):
+    """
+    Writes lines of text to a gzipped file in the fileStore. Chunked pipelines use this to hand their results to the
+    merge step as a file instead of as a promised value, which would be pickled into the jobStore.
+    :param job: current job.
+    :param lines: iterable of strings, without newlines. None values are skipped.
+    :return: fileStore ID for the gzipped file
+    """
+    tmp_path = get_tmp_toil_file(suffix='gz')
+    with gzip.open(tmp_path, 'wb') as outf:
+        for line in lines:
+            if line is not None:
+                outf.write(line + '\n')
+    return job.fileStore.writeGlobalFile(tmp_path)
+
+
+def concatenate_from_filestore(job, file_ids, outf):
+    """
+    Streams the contents of the fileStore files written by write_lines_to_filestore() into outf, in order, then
+    deletes them from the fileStore.
+    :param job: current job.
+    :param file_ids: iterable of fileStore IDs
+    :param outf: open file handle
+    """
+    for file_id in file_ids:
+        with gzip.open(job.fileStore.readGlobalFile(file_id)) as inf:
+            shutil.copyfileobj(inf, outf)
+        job.fileStore.deleteGlobalFile(file_id)
@@ -2,11 +2,15 @@
 Represent either BED12 or genePred transcripts as objects. Allows for conversion of coordinates between
 chromosome, mRNA and CDS coordinate spaces. Can slice objects into subsets.
 """
-from itertools import izip
+import bisect
+import collections
+from itertools import chain, izip
+
+import numpy as np
 
 from bio import reverse_complement, translate_sequence
-from fileOps import iter_lines
-from intervals import ChromosomeInterval
+from fileOps import iter_lines, load_cached_parse
+from intervals import ChromosomeInterval, UNMAPPED
 
 __author__ = "Ian Fiddes"
 
@@ -15,9 +19,9 @@ class Transcript(object):
     """
     Represent a transcript record from a bed file.
     """
-    __slots__ = ('name', 'strand', 'score', 'thick_start', 'rgb', 'thick_stop', 'start', 'stop', 'intron_intervals',
-                 'exon_intervals', 'exons', 'block_sizes', 'block_starts', 'block_count', 'chromosome',
-                 'interval', 'coding_interval')
+    __slots__ = ('name', 'strand', 'score', 'thick_start', 'rgb', 'thick_stop', 'start', 'stop', '_intron_intervals',
+                 '_exon_intervals', 'exons', 'block_sizes', 'block_starts', 'block_count', 'chromosome',
+                 '_interval', '_coding_interval', '_exon_starts', '_exon_offsets', '_cds_bounds')
 
     def __init__(self, bed_tokens):
         self.chromosome = bed_tokens[0]
@@ -32,13 +36,25 @@ class Transcript(object):
         self.block_count = int(bed_tokens[9])
         self.block_sizes = [int(x) for x in bed_tokens[10].split(",") if x != ""]
         self.block_starts = [int(x) for x in bed_tokens[11].split(",") if x != ""]
-        self.exon_intervals = self._get_exon_intervals()
-        self.intron_intervals = self._get_intron_intervals()
-        self.interval = self._get_interval()
-        self.coding_interval = self._get_coding_interval()
+        self._init_intervals()
+
+    def _init_intervals(self):
+        """
+        Resets the derived attributes, which are built from the BED fields on first use. Must be called once all of
+        the BED fields are set.
+        """
+        # interval objects. See the exon_intervals, intron_intervals, interval and coding_interval properties
+        self._exon_intervals = None
+        self._intron_intervals = None
+        self._interval = None
+        self._coding_interval = None
+        # coordinate translation tables. See _get_exon_offsets() and _get_cds_bounds()
+        self._exon_starts = None
+        self._exon_offsets = None
+        self._cds_bounds = None
 
     def __len__(self):
-        return sum(len(x) for x in self.exon_intervals)
+        return self._get_exon_offsets()[-1]
 
     def __hash__(self):
         return (hash(self.chromosome) ^ hash(self.start) ^ hash(self.stop) ^ hash(self.strand) ^
@@ -47,24 +63,38 @@ class Transcript(object):
     def __repr__(self):
         return 'Transcript({})'.format(self.get_bed())
 
+    @property
+    def exon_intervals(self):
+        """List of ChromosomeInterval objects representing the exons of this transcript"""
+        if self._exon_intervals is None:
+            self._exon_intervals = self._get_exon_intervals()
+        return self._exon_intervals
+
+    @property
+    def intron_intervals(self):
+        """List of ChromosomeInterval objects representing the introns of this transcript"""
+        if self._intron_intervals is None:
+            self._intron_intervals = self._get_intron_intervals()
+        return self._intron_intervals
+
+    @property
+    def interval(self):
+        """ChromosomeInterval representing the full span of this transcript"""
+        if self._interval is None:
+            self._interval = self._get_interval()
+        return self._interval
+
+    @property
+    def coding_interval(self):
+        """ChromosomeInterval representing the coding span of this transcript"""
+        if self._coding_interval is None:
+            self._coding_interval = self._get_coding_interval()
+        return self._coding_interval
+
     @property
     def cds_size(self):
         """calculates the number of coding bases"""
-        l = 0
-        for e in self.exon_intervals:
-            if self.thick_start < e.start and e.stop < self.thick_stop:
-                # squarely in the CDS
-                l += e.stop - e.start
-            elif e.start <= self.thick_start < e.stop < self.thick_stop:
-                # thickStart marks the start of the CDS
-                l += e.stop - self.thick_start
-            elif e.start <= self.thick_start and self.thick_stop <= e.stop:
-                # thickStart and thickStop mark the whole CDS
-                l += self.thick_stop - self.thick_start
-            elif self.thick_start < e.start < self.thick_stop <= e.stop:
-                # thickStop marks the end of the CDS
-                l += self.thick_stop - e.start
-        return l
+        return self._get_cds_bounds()[1]
 
     @property
     def num_coding_introns(self):
@@ -112,6 +142,51 @@ class Transcript(object):
             intron_intervals.append(ChromosomeInterval(self.chromosome, start, stop, self.strand))
         return intron_intervals
 
+    def _get_exon_offsets(self):
+        """
+        Builds the lookup tables used for coordinate translation. _exon_starts holds the chromosome start of each exon
+        and _exon_offsets holds the cumulative exon length preceding each exon, both in chromosome order.
+        _exon_offsets has one extra trailing entry holding the total transcript length.
+        :return: list of integers
+        """
+        if self._exon_offsets is None:
+            self._exon_starts = [self.start + x for x in self.block_starts]
+            offsets = [0]
+            for block_size in self.block_sizes:
+                offsets.append(offsets[-1] + block_size)
+            self._exon_offsets = offsets
+        return self._exon_offsets
+
+    def _get_cds_bounds(self):
+        """
+        Calculates the mRNA coordinate of the first coding base and the number of coding bases. The start is None
+        if the CDS start does not fall within an exon.
+        :return: tuple (cds_start, cds_size)
+        """
+        if self._cds_bounds is None:
+            l = 0
+            for block_start, block_size in izip(self.block_starts, self.block_sizes):
+                start = self.start + block_start
+                stop = start + block_size
+                if self.thick_start < start and stop < self.thick_stop:
+                    # squarely in the CDS
+                    l += stop - start
+                elif start <= self.thick_start < stop < self.thick_stop:
+                    # thickStart marks the start of the CDS
+                    l += stop - self.thick_start
+                elif start <= self.thick_start and self.thick_stop <= stop:
+                    # thickStart and thickStop mark the whole CDS
+                    l += self.thick_stop - self.thick_start
+                elif self.thick_start < start < self.thick_stop <= stop:
+                    # thickStop marks the end of the CDS
+                    l += self.thick_stop - start
+            if self.strand == '+':
+                cds_start = self.chromosome_coordinate_to_mrna(self.thick_start)
+            else:
+                cds_start = self.chromosome_coordinate_to_mrna(self.thick_stop - 1)
+            self._cds_bounds = (cds_start, l)
+        return self._cds_bounds
+
     def get_bed(self, rgb=None, name=None, new_start=None, new_stop=None):
         """
         Returns BED tokens for this object. Can be sliced into sub regions.
@@ -204,19 +279,13 @@ class Transcript(object):
     def chromosome_coordinate_to_mrna(self, coord):
         if not (self.start <= coord < self.stop):
             return None
-        p = 0
-        i = ChromosomeInterval(self.chromosome, coord, coord + 1, self.strand)
-        if not any(i.overlap(x) for x in self.exon_intervals):
+        offsets = self._get_exon_offsets()
+        i = bisect.bisect_right(self._exon_starts, coord) - 1
+        if i < 0 or coord >= self._exon_starts[i] + self.block_sizes[i]:
             return None
-        exon_intervals = self.exon_intervals if self.strand == '+' else reversed(self.exon_intervals)
-        for e in exon_intervals:
-            if i.overlap(e):
-                if self.strand == '+':
-                    p += coord - e.start
-                else:
-                    p += e.stop - coord - 1
-                break
-            p += len(e)
+        p = offsets[i] + coord - self._exon_starts[i]
+        if self.strand == '-':
+            p = offsets[-1] - p - 1
         return p
 
     def chromosome_coordinate_to_cds(self, coord):
@@ -228,46 +297,118 @@ class Transcript(object):
         return self.mrna_coordinate_to_cds(p)
 
     def mrna_coordinate_to_chromosome(self, coord):
-        if not (0 <= coord < len(self)):
+        offsets = self._get_exon_offsets()
+        if not (0 <= coord < offsets[-1]):
             return None
-        p = 0
-        exon_intervals = self.exon_intervals if self.strand == '+' else reversed(self.exon_intervals)
-        for e in exon_intervals:
-            if p + len(e) > coord:
-                if self.strand == '+':
-                    return e.start + (coord - p)
-                else:
-                    return e.stop - (coord - p) - 1
-            p += len(e)
+        if self.strand == '-':
+            coord = offsets[-1] - coord - 1
+        # bisect_right skips over zero-length blocks, which never contain a position
+        i = bisect.bisect_right(offsets, coord) - 1
+        return self._exon_starts[i] + coord - offsets[i]
 
     def mrna_coordinate_to_cds(self, coord):
-        if self.strand == '+':
-            cds_start = self.chromosome_coordinate_to_mrna(self.thick_start)
-        else:
-            cds_start = self.chromosome_coordinate_to_mrna(self.thick_stop - 1)
+        cds_start, cds_size = self._get_cds_bounds()
+        if cds_start is None:
+            return None
         r = coord - cds_start
-        if not (0 <= r < self.cds_size):
+        if not (0 <= r < cds_size):
             return None
         return r
 
     def cds_coordinate_to_mrna(self, coord):
-        if not (0 <= coord < self.cds_size):
+        cds_start, cds_size = self._get_cds_bounds()
+        if cds_start is None or not (0 <= coord < cds_size):
             return None
-        if self.strand == '+':
-            cds_start = self.chromosome_coordinate_to_mrna(self.thick_start)
-        else:
-            cds_start = self.chromosome_coordinate_to_mrna(self.thick_stop - 1)
         return cds_start + coord
 
     def cds_coordinate_to_chromosome(self, coord):
-        if not (0 <= coord < self.cds_size):
+        cds_start, cds_size = self._get_cds_bounds()
+        if cds_start is None or not (0 <= coord < cds_size):
             return None
-        if self.strand == '+':
-            cds_start = self.chromosome_coordinate_to_mrna(self.thick_start)
-        else:
-            cds_start = self.chromosome_coordinate_to_mrna(self.thick_stop - 1)
-        c = self.mrna_coordinate_to_chromosome(cds_start + coord)
-        return c
+        return self.mrna_coordinate_to_chromosome(cds_start + coord)
+
+    def _get_exon_arrays(self):
+        """
+        Returns the coordinate translation tables as numpy arrays for the batch translation methods.
+        :return: tuple of arrays (exon_starts, exon_sizes, exon_offsets)
+        """
+        offsets = np.array(self._get_exon_offsets())
+        return np.array(self._exon_starts), np.array(self.block_sizes), offsets
+
+    def chromosome_coordinates_to_mrna(self, coords):
+        """
+        Batch version of chromosome_coordinate_to_mrna.
+        :param coords: array-like of chromosome positions
+        :return: numpy array of mRNA positions, with UNMAPPED for positions not within an exon
+        """
+        coords = np.asarray(coords, dtype=np.int64)
+        starts, sizes, offsets = self._get_exon_arrays()
+        i = np.searchsorted(starts, coords, side='right') - 1
+        valid = (i >= 0) & (self.start <= coords) & (coords < self.stop)
+        i = np.clip(i, 0, len(starts) - 1)
+        valid &= coords < starts[i] + sizes[i]
+        p = offsets[i] + coords - starts[i]
+        if self.strand == '-':
+            p = offsets[-1] - p - 1
+        return np.where(valid, p, UNMAPPED)
+
+    def chromosome_coordinates_to_cds(self, coords):
+        """
+        Batch version of chromosome_coordinate_to_cds.
+        :param coords: array-like of chromosome positions
+        :return: numpy array of CDS positions, with UNMAPPED for positions not within the CDS
+        """
+        coords = np.asarray(coords, dtype=np.int64)
+        p = self.chromosome_coordinates_to_mrna(coords)
+        valid = (p != UNMAPPED) & (self.thick_start <= coords) & (coords < self.thick_stop)
+        return np.where(valid, self.mrna_coordinates_to_cds(p), UNMAPPED)
+
+    def mrna_coordinates_to_chromosome(self, coords):
+        """
+        Batch version of mrna_coordinate_to_chromosome.
+        :param coords: array-like of mRNA positions
+        :return: numpy array of chromosome positions, with UNMAPPED for positions outside of the transcript
+        """
+        coords = np.asarray(coords, dtype=np.int64)
+        starts, sizes, offsets = self._get_exon_arrays()
+        valid = (0 <= coords) & (coords < offsets[-1])
+        if self.strand == '-':
+            coords = offsets[-1] - coords - 1
+        i = np.clip(np.searchsorted(offsets, coords, side='right') - 1, 0, len(starts) - 1)
+        return np.where(valid, starts[i] + coords - offsets[i], UNMAPPED)
+
+    def mrna_coordinates_to_cds(self, coords):
+        """
+        Batch version of mrna_coordinate_to_cds.
+        :param coords: array-like of mRNA positions
+        :return: numpy array of CDS positions, with UNMAPPED for positions not within the CDS
+        """
+        coords = np.asarray(coords, dtype=np.int64)
+        cds_start, cds_size = self._get_cds_bounds()
+        if cds_start is None:
+            return np.full(coords.shape, UNMAPPED, dtype=np.int64)
+        r = coords - cds_start
+        return np.where((coords != UNMAPPED) & (0 <= r) & (r < cds_size), r, UNMAPPED)
+
+    def cds_coordinates_to_mrna(self, coords):
+        """
+        Batch version of cds_coordinate_to_mrna.
+        :param coords: array-like of CDS positions
+        :return: numpy array of mRNA positions, with UNMAPPED for positions outside of the CDS
+        """
+        coords = np.asarray(coords, dtype=np.int64)
+        cds_start, cds_size = self._get_cds_bounds()
+        if cds_start is None:
+            return np.full(coords.shape, UNMAPPED, dtype=np.int64)
+        return np.where((0 <= coords) & (coords < cds_size), cds_start + coords, UNMAPPED)
+
+    def cds_coordinates_to_chromosome(self, coords):
+        """
+        Batch version of cds_coordinate_to_chromosome.
+        :param coords: array-like of CDS positions
+        :return: numpy array of chromosome positions, with UNMAPPED for positions outside of the CDS
+        """
+        return self.mrna_coordinates_to_chromosome(self.cds_coordinates_to_mrna(coords))
 
     def get_mrna(self, seq_dict):
         """
@@ -345,29 +486,38 @@ class GenePredTranscript(Transcript):
     __slots__ = ('cds_start_stat', 'cds_end_stat', 'exon_frames', 'name2', 'id')
 
     def __init__(self, gene_pred_tokens):
-        name = gene_pred_tokens[0]
-        chrom = gene_pred_tokens[1]
-        strand = gene_pred_tokens[2]
-        start = gene_pred_tokens[3]
-        stop = gene_pred_tokens[4]
-        thick_start = gene_pred_tokens[5]
-        thick_stop = gene_pred_tokens[6]
-        block_count = gene_pred_tokens[7]
-        exon_starts = gene_pred_tokens[8]
-        exon_ends = gene_pred_tokens[9]
-        self.id = gene_pred_tokens[10]
-        self.name2 = gene_pred_tokens[11]
-        self.cds_start_stat = gene_pred_tokens[12]
-        self.cds_end_stat = gene_pred_tokens[13]
-        self.exon_frames = [int(x) for x in gene_pred_tokens[14].split(',') if x != '']
-        # convert genePred format coordinates to BED-like coordinates to make intervals
-        block_starts = [int(x) for x in exon_starts.split(',') if x != '']
-        block_ends = [int(x) for x in exon_ends.split(',') if x != '']
-        block_sizes = ",".join(map(str, [e - s for e, s in izip(block_ends, block_starts)]))
-        block_starts = ",".join(map(str, [x - int(start) for x in block_starts]))
-        bed_tokens = [chrom, start, stop, name, '0', strand, thick_start, thick_stop, '0', block_count, block_sizes,
-                      block_starts]
-        super(GenePredTranscript, self).__init__(bed_tokens)
+        self._set_fields(gene_pred_tokens[0], gene_pred_tokens[1], gene_pred_tokens[2], int(gene_pred_tokens[3]),
+                         int(gene_pred_tokens[4]), int(gene_pred_tokens[5]), int(gene_pred_tokens[6]),
+                         int(gene_pred_tokens[7]),
+                         [int(x) for x in gene_pred_tokens[8].split(',') if x != ''],
+                         [int(x) for x in gene_pred_tokens[9].split(',') if x != ''],
+                         gene_pred_tokens[10], gene_pred_tokens[11], gene_pred_tokens[12], gene_pred_tokens[13],
+                         [int(x) for x in gene_pred_tokens[14].split(',') if x != ''])
+
+    def _set_fields(self, name, chrom, strand, start, stop, thick_start, thick_stop, block_count, exon_starts,
+                    exon_ends, uid, name2, cds_start_stat, cds_end_stat, exon_frames):
+        """
+        Populates this object from parsed genePred fields, converting genePred format coordinates to the BED-like
+        block representation of the parent class.
+        """
+        self.name = name
+        self.chromosome = chrom
+        self.strand = strand
+        self.start = start
+        self.stop = stop
+        self.score = 0
+        self.thick_start = thick_start
+        self.thick_stop = thick_stop
+        self.rgb = '0'
+        self.block_count = block_count
+        self.block_sizes = [e - s for e, s in izip(exon_ends, exon_starts)]
+        self.block_starts = [x - start for x in exon_starts]
+        self.id = uid
+        self.name2 = name2
+        self.cds_start_stat = cds_start_stat
+        self.cds_end_stat = cds_end_stat
+        self.exon_frames = exon_frames
+        self._init_intervals()
 
     def __repr__(self):
         return 'GenePredTranscript({})'.format(self.get_bed())
@@ -442,26 +592,251 @@ class GenePredTranscript(Transcript):
                          exon_frames])
 
 
-def get_gene_pred_dict(gp_file):
+class TranscriptTable(collections.Mapping):
+    """
+    Columnar store of genePred records. Coordinates live in flat NumPy arrays with CSR-style exon indexing: the exons
+    of row i are exon_starts[exon_ptr[i]:exon_ptr[i + 1]] (chromosome coordinates, in chromosome order), and the
+    same slice of exon_stops and exon_frames.
+
+    Acts as a read-only mapping of transcript name to GenePredTranscript. The GenePredTranscript objects are built on
+    demand from the arrays and are not retained, so holding a large annotation costs a few arrays instead of one
+    object per transcript, exon and intron. Whole-table properties are available as vectorized methods.
+    """
+    def __init__(self, names, chromosomes, strands, starts, stops, thick_starts, thick_stops, block_counts,
+                 exon_ptr, exon_starts, exon_stops, exon_frames, ids, name2s, cds_start_stats, cds_end_stats,
+                 unique_names=True):
+        self.names = names
+        self.chromosomes = chromosomes
+        self.strands = strands
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.thick_starts = np.asarray(thick_starts, dtype=np.int64)
+        self.thick_stops = np.asarray(thick_stops, dtype=np.int64)
+        self.block_counts = np.asarray(block_counts, dtype=np.int64)
+        self.exon_ptr = np.asarray(exon_ptr, dtype=np.int64)
+        self.exon_starts = np.asarray(exon_starts, dtype=np.int64)
+        self.exon_stops = np.asarray(exon_stops, dtype=np.int64)
+        self.exon_frames = np.asarray(exon_frames, dtype=np.int8)
+        self.ids = ids
+        self.name2s = name2s
+        self.cds_start_stats = cds_start_stats
+        self.cds_end_stats = cds_end_stats
+        # if names are not required to be unique, the last row with a given name is the one returned by name lookup
+        self._rows = {}
+        for i, name in enumerate(self.names):
+            if unique_names is True and name in self._rows:
+                raise RuntimeError('Attempted to add duplicate GenePredTranscript object with name {}'.format(name))
+            self._rows[name] = i
+
+    @classmethod
+    def from_gene_preds(cls, gp_files, unique_names=True, cache_dir=None):
+        """
+        Loads one or more genePred files into a single table.
+        :param gp_files: list of genePred file paths or handles.
+        :param unique_names: Raise a RuntimeError if a transcript name is seen more than once?
+        :param cache_dir: If set, files given by path are read through the parse cache in this directory (see
+            tools.fileOps.load_cached_parse).
+        :return: TranscriptTable
+        """
+        columns = [_load_gene_pred_columns(gp_file, cache_dir) for gp_file in gp_files]
+        merged = {k: list(chain.from_iterable(c[k] for c in columns)) for k in _GENE_PRED_LIST_COLUMNS}
+        for k in _GENE_PRED_ARRAY_COLUMNS:
+            merged[k] = np.concatenate([np.zeros(0, dtype=np.int64)] + [c[k] for c in columns])
+        exon_ptr = [np.zeros(1, dtype=np.int64)]
+        for c in columns:
+            exon_ptr.append(c['exon_ptr'][1:] + exon_ptr[-1][-1])
+        merged['exon_ptr'] = np.concatenate(exon_ptr)
+        return cls(unique_names=unique_names, **merged)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def __getitem__(self, name):
+        return self.get_transcript(self._rows[name])
+
+    def get_transcript(self, i):
+        """
+        Builds the GenePredTranscript for row i.
+        :param i: integer row index
+        :return: GenePredTranscript
+        """
+        lo, hi = self.exon_ptr[i], self.exon_ptr[i + 1]
+        t = GenePredTranscript.__new__(GenePredTranscript)
+        t._set_fields(self.names[i], self.chromosomes[i], self.strands[i], int(self.starts[i]), int(self.stops[i]),
+                      int(self.thick_starts[i]), int(self.thick_stops[i]), int(self.block_counts[i]),
+                      self.exon_starts[lo:hi].tolist(), self.exon_stops[lo:hi].tolist(), self.ids[i],
+                      self.name2s[i], self.cds_start_stats[i], self.cds_end_stats[i],
+                      self.exon_frames[lo:hi].tolist())
+        return t
+
+    def exon_rows(self):
+        """
+        :return: numpy array holding the row index of every exon
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.exon_ptr))
+
+    def get_intron_arrays(self):
+        """
+        Extracts the introns of every row.
+        :return: tuple of numpy arrays (rows, intron_starts, intron_stops)
+        """
+        rows = self.exon_rows()
+        has_next = rows[:-1] == rows[1:]
+        return rows[:-1][has_next], self.exon_stops[:-1][has_next], self.exon_starts[1:][has_next]
+
+    def cds_sizes(self):
+        """
+        Vectorized Transcript.cds_size.
+        :return: numpy array holding the number of coding bases of every row
+        """
+        rows = self.exon_rows()
+        overlap = (np.minimum(self.exon_stops, self.thick_stops[rows]) -
+                   np.maximum(self.exon_starts, self.thick_starts[rows]))
+        return np.bincount(rows, weights=np.maximum(overlap, 0), minlength=len(self)).astype(np.int64)
+
+    def num_coding_exons(self):
+        """
+        Vectorized Transcript.num_coding_exons, following ChromosomeInterval.overlap().
+        :return: numpy array holding the number of exons of every row that overlap the coding interval
+        """
+        rows = self.exon_rows()
+        thick_starts = self.thick_starts[rows]
+        thick_stops = self.thick_stops[rows]
+        # order each exon and coding interval pair as ChromosomeInterval.overlap() does
+        exon_first = ((self.exon_starts < thick_starts) |
+                      ((self.exon_starts == thick_starts) & (self.exon_stops <= thick_stops)))
+        overlaps = np.where(exon_first, self.exon_stops > thick_starts, thick_stops > self.exon_starts)
+        return np.bincount(rows[overlaps], minlength=len(self))
+
+    def num_coding_introns(self):
+        """
+        Vectorized Transcript.num_coding_introns.
+        :return: numpy array holding the number of introns of every row contained in the coding interval
+        """
+        rows, intron_starts, intron_stops = self.get_intron_arrays()
+        coding = (intron_starts >= self.thick_starts[rows]) & (intron_stops <= self.thick_stops[rows])
+        return np.bincount(rows[coding], minlength=len(self))
+
+
+_GENE_PRED_LIST_COLUMNS = ('names', 'chromosomes', 'strands', 'ids', 'name2s', 'cds_start_stats', 'cds_end_stats')
+_GENE_PRED_ARRAY_COLUMNS = ('starts', 'stops', 'thick_starts', 'thick_stops', 'block_counts', 'exon_starts',
+                            'exon_stops', 'exon_frames')
+
+
+class TranscriptSequenceCache(object):
+    """
+    Bounded least recently used cache of transcript sequences extracted from one genome, keyed by transcript name and
+    sequence type. Used when the same transcript sequence is requested many times, such as a reference transcript
+    with many paralogous or multi-mode alignments.
+    """
+    def __init__(self, seq_dict, max_size=10 ** 4):
+        self.seq_dict = seq_dict
+        self.max_size = max_size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_mrna(self, tx):
+        """Cached tx.get_mrna()"""
+        return self._get(tx, 'mRNA', lambda: tx.get_mrna(self.seq_dict))
+
+    def get_cds(self, tx, in_frame=False):
+        """Cached tx.get_cds(). in_frame is only valid for GenePredTranscript objects"""
+        if in_frame is True:
+            return self._get(tx, 'in_frame_CDS', lambda: tx.get_cds(self.seq_dict, in_frame=True))
+        return self._get(tx, 'CDS', lambda: tx.get_cds(self.seq_dict))
+
+    def _get(self, tx, mode, extract_fn):
+        key = (tx.name, mode)
+        if key in self.cache:
+            self.hits += 1
+            seq = self.cache.pop(key)
+        else:
+            self.misses += 1
+            seq = extract_fn()
+            if len(self.cache) >= self.max_size:
+                self.cache.popitem(last=False)
+        self.cache[key] = seq
+        return seq
+
+
+def _parse_gene_pred_columns(gp_file):
+    """
+    Parses a genePred file into the columns of a TranscriptTable.
+    :param gp_file: A genePred file path or handle.
+    :return: dict of column name to list or numpy array
+    """
+    columns = {k: [] for k in _GENE_PRED_LIST_COLUMNS + _GENE_PRED_ARRAY_COLUMNS}
+    exon_ptr = [0]
+    for tokens in iter_lines(gp_file):
+        if len(tokens) != 15:
+            raise RuntimeError('GenePred line had {} tokens, not 15. Record: {}'.format(len(tokens), tokens))
+        exon_starts = [int(x) for x in tokens[8].split(',') if x != '']
+        exon_stops = [int(x) for x in tokens[9].split(',') if x != '']
+        exon_frames = [int(x) for x in tokens[14].split(',') if x != '']
+        if not len(exon_starts) == len(exon_stops) == len(exon_frames):
+            raise RuntimeError('GenePred line has inconsistent exon fields. Record: {}'.format(tokens))
+        columns['names'].append(tokens[0])
+        columns['chromosomes'].append(intern(tokens[1]))
+        columns['strands'].append(intern(tokens[2]))
+        columns['starts'].append(int(tokens[3]))
+        columns['stops'].append(int(tokens[4]))
+        columns['thick_starts'].append(int(tokens[5]))
+        columns['thick_stops'].append(int(tokens[6]))
+        columns['block_counts'].append(int(tokens[7]))
+        columns['exon_starts'].extend(exon_starts)
+        columns['exon_stops'].extend(exon_stops)
+        columns['exon_frames'].extend(exon_frames)
+        exon_ptr.append(len(columns['exon_starts']))
+        columns['ids'].append(tokens[10])
+        columns['name2s'].append(tokens[11])
+        columns['cds_start_stats'].append(intern(tokens[12]))
+        columns['cds_end_stats'].append(intern(tokens[13]))
+    for k in _GENE_PRED_ARRAY_COLUMNS:
+        columns[k] = np.array(columns[k], dtype=np.int8 if k == 'exon_frames' else np.int64)
+    columns['exon_ptr'] = np.array(exon_ptr, dtype=np.int64)
+    return columns
+
+
+def _load_gene_pred_columns(gp_file, cache_dir=None):
+    """
+    Loads the TranscriptTable columns of a genePred file, going through the parse cache for file paths if cache_dir is
+    set.
+    :param gp_file: A genePred file path or handle.
+    :param cache_dir: parse cache directory, or None
+    :return: dict of column name to list or numpy array
+    """
+    if isinstance(gp_file, str):
+        return load_cached_parse(gp_file, _parse_gene_pred_columns, 'gp_columns', cache_dir)
+    return _parse_gene_pred_columns(gp_file)
+
+
+def get_gene_pred_dict(gp_file, cache_dir=None):
     """
     Produces a dictionary of GenePredTranscripts from a genePred file
     :param gp_file: A genePred file path or handle.
+    :param cache_dir: parse cache directory, or None (see tools.fileOps.load_cached_parse)
     :return: A dictionary of name:transcript pairs
     """
-    return {t.name: t for t in gene_pred_iterator(gp_file)}
+    return {t.name: t for t in gene_pred_iterator(gp_file, cache_dir)}
 
 
-def gene_pred_iterator(gp_file):
+def gene_pred_iterator(gp_file, cache_dir=None):
     """
     Iterator for GenePred file or handle, producing tuples of (name, GenePredTranscript)
     :param gp_file: A genePred file path or handle.
+    :param cache_dir: parse cache directory, or None (see tools.fileOps.load_cached_parse)
     :return: tuples of (name, GenePredTranscript)
     """
-    for tokens in iter_lines(gp_file):
-        if len(tokens) != 15:
-            raise RuntimeError('GenePred line had {} tokens, not 15. Record: {}'.format(len(tokens), tokens))
-        t = GenePredTranscript(tokens)
-        yield t
+    table = TranscriptTable.from_gene_preds([gp_file], unique_names=False, cache_dir=cache_dir)
+    for i in xrange(len(table)):
+        yield table.get_transcript(i)
 
 
 def get_transcript_dict(bed_file):
@@ -487,15 +862,9 @@ def transcript_iterator(bed_file):
             yield t
 
 
-def load_gps(gp_list):
-    """helper function that loads a list of genePreds into one mega-dict"""
-    r = {}
-    for gp in gp_list:
-        for t in gene_pred_iterator(gp):
-            if t.name in r:
-                raise RuntimeError('Attempted to add duplicate GenePredTranscript object with name {}'.format(t.name))
-            r[t.name] = t
-    return r
+def load_gps(gp_list, cache_dir=None):
+    """helper function that loads a list of genePreds into one mega-table, which can be used like a dict"""
+    return TranscriptTable.from_gene_preds(gp_list, cache_dir=cache_dir)
 
 
 def get_start_interval(tx):
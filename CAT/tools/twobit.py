@@ -0,0 +1,143 @@
+"""
+Random access reader for UCSC .2bit files.
+
+The 2bit file produced by faToTwoBit is memory mapped, so looking up a region only touches the pages that hold it.
+Records expose the same len() and slicing interface as the pyfasta records used previously.
+http://genome.ucsc.edu/FAQ/FAQformat.html#format7
+"""
+import collections
+import numpy as np
+
+__author__ = 'Ian Fiddes'
+
+TWO_BIT_SIGNATURE = 0x1A412743
+
+# each packed byte holds 4 bases, most significant bits first, with T=0, C=1, A=2, G=3
+_BASES = np.array([ord(x) for x in 'TCAG'], dtype=np.uint8)
+_PACKED_TO_ASCII = _BASES[(np.arange(256, dtype=np.uint8)[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3]
+
+
+class TwoBitFile(collections.Mapping):
+    """
+    Maps sequence names in a 2bit file to TwoBitRecord objects. If upper is True, soft-masked regions are returned
+    upper case.
+    """
+    def __init__(self, two_bit_path, upper=False):
+        self.two_bit_path = two_bit_path
+        self.upper = upper
+        # a plain ndarray view of the map avoids the memmap subclass overhead on every slice
+        self._data = np.asarray(np.memmap(two_bit_path, dtype=np.uint8, mode='r'))
+        if len(self._data) < 16:
+            raise RuntimeError('{} is too short to be a 2bit file.'.format(two_bit_path))
+        for dtype in ['<u4', '>u4']:
+            if np.frombuffer(self._data[:4], dtype=dtype)[0] == TWO_BIT_SIGNATURE:
+                self._dtype = np.dtype(dtype)
+                break
+        else:
+            raise RuntimeError('{} does not have a 2bit signature.'.format(two_bit_path))
+        version, seq_count = np.frombuffer(self._data[4:12], dtype=self._dtype)
+        if version not in (0, 1):
+            raise NotImplementedError('2bit version {} is not supported.'.format(version))
+        offset_dtype = self._dtype.str[0] + 'u8' if version == 1 else self._dtype
+        offset_size = np.dtype(offset_dtype).itemsize
+        self._offsets = collections.OrderedDict()
+        pos = 16
+        for _ in xrange(seq_count):
+            name_size = int(self._data[pos])
+            name = self._data[pos + 1:pos + 1 + name_size].tostring()
+            pos += 1 + name_size
+            self._offsets[name] = int(np.frombuffer(self._data[pos:pos + offset_size], dtype=offset_dtype)[0])
+            pos += offset_size
+        self._records = {}
+
+    def __getitem__(self, name):
+        if name not in self._records:
+            self._records[name] = TwoBitRecord(self._data, self._offsets[name], self._dtype, self.upper)
+        return self._records[name]
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, name):
+        return name in self._offsets
+
+
+class TwoBitRecord(object):
+    """
+    A single sequence in a 2bit file. Slicing returns a string with N-blocks applied and, unless upper is set,
+    soft-masked blocks in lower case.
+    """
+    def __init__(self, data, offset, dtype, upper=False):
+        self._data = data
+        self.upper = upper
+        dna_size, n_block_count = np.frombuffer(data[offset:offset + 8], dtype=dtype)
+        self.size = int(dna_size)
+        pos = offset + 8
+        self._n_starts, self._n_stops, pos = self._read_blocks(data, pos, int(n_block_count), dtype)
+        mask_block_count = int(np.frombuffer(data[pos:pos + 4], dtype=dtype)[0])
+        self._mask_starts, self._mask_stops, pos = self._read_blocks(data, pos + 4, mask_block_count, dtype)
+        # skip the reserved word
+        self._dna_offset = pos + 4
+
+    @staticmethod
+    def _read_blocks(data, pos, count, dtype):
+        """
+        Reads a block list (all starts followed by all sizes) into start and stop arrays.
+        :return: starts, stops, position after the block list
+        """
+        blocks = np.frombuffer(data[pos:pos + 8 * count], dtype=dtype).astype(np.int64)
+        starts = blocks[:count]
+        return starts, starts + blocks[count:], pos + 8 * count
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, islice):
+        if isinstance(islice, slice):
+            start, stop, step = islice.indices(self.size)
+            if step == 1:
+                return self.get_sequence(start, stop)
+            positions = xrange(start, stop, step)
+            if len(positions) == 0:
+                return ''
+            lo = min(positions[0], positions[-1])
+            hi = max(positions[0], positions[-1]) + 1
+            return self.get_sequence(lo, hi)[positions[0] - lo::step]
+        i = islice + self.size if islice < 0 else islice
+        if not 0 <= i < self.size:
+            raise IndexError('2bit sequence index out of range')
+        return self.get_sequence(i, i + 1)
+
+    def __str__(self):
+        return self.get_sequence(0, self.size)
+
+    def get_sequence(self, start, stop):
+        """
+        Decodes the half-open range [start, stop) of this sequence.
+        :return: string
+        """
+        if stop <= start:
+            return ''
+        packed = self._data[self._dna_offset + start // 4:self._dna_offset + (stop + 3) // 4]
+        offset = start % 4
+        seq = _PACKED_TO_ASCII[packed].ravel()[offset:offset + stop - start]
+        for block_start, block_stop in self._overlapping_blocks(self._n_starts, self._n_stops, start, stop):
+            seq[block_start:block_stop] = ord('N')
+        if not self.upper:
+            for block_start, block_stop in self._overlapping_blocks(self._mask_starts, self._mask_stops, start, stop):
+                seq[block_start:block_stop] |= 0x20
+        return seq.tostring()
+
+    @staticmethod
+    def _overlapping_blocks(starts, stops, start, stop):
+        """
+        Yields the blocks overlapping [start, stop) relative to start. Blocks in a 2bit file are sorted and do not
+        overlap, so both the starts and the stops are sorted.
+        """
+        first = np.searchsorted(stops, start, side='right')
+        last = np.searchsorted(starts, stop, side='left')
+        for block_start, block_stop in zip(starts[first:last].tolist(), stops[first:last].tolist()):
+            yield max(block_start, start) - start, min(block_stop, stop) - start
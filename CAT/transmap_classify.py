@@ -1,5 +1,6 @@
 """
-Classify transMap transcripts producing the TransMapEvaluation table for each genome's database
+Classify transMap transcripts producing the TransMapEvaluation table for each genome's database. This table has one
+row per alignment and one column per classifier:
 
 1. Paralogy: The # of times this transcript was aligned
 2. AlnExtendsOffConfig: Does this alignment run off the end of a contig?
@@ -34,10 +35,10 @@ def transmap_classify(tm_eval_args):
     :return: DataFrame
     """
     psl_dict = tools.psl.get_alignment_dict(tm_eval_args.tm_psl)
-    ref_psl_dict = tools.psl.get_alignment_dict(tm_eval_args.ref_psl)
+    ref_psl_dict = tools.psl.get_alignment_dict(tm_eval_args.ref_psl, cache_dir=tm_eval_args.parse_cache_dir)
     gp_dict = tools.transcripts.get_gene_pred_dict(tm_eval_args.tm_gp)
-    ref_gp_dict = tools.transcripts.get_gene_pred_dict(tm_eval_args.annotation_gp)
-    fasta = tools.bio.get_sequence_dict(tm_eval_args.fasta)
+    ref_gp_dict = tools.transcripts.get_gene_pred_dict(tm_eval_args.annotation_gp, tm_eval_args.parse_cache_dir)
+    fasta = tools.bio.get_sequence_dict(tm_eval_args.two_bit)
 
     paralog_count, paralog_names = paralogy(psl_dict)  # we have to count paralogs globally
 
@@ -49,18 +50,15 @@ def transmap_classify(tm_eval_args):
         tx_id = tools.nameConversions.strip_alignment_numbers(aln_id)
         ref_aln = ref_psl_dict[tx_id]
         gene_id = ref_gp_dict[tx_id].name2
-        r.append([aln_id, tx_id, gene_id, 'Paralogy', paralog_count[tools.nameConversions.strip_alignment_numbers(aln_id)]])
-        r.append([aln_id, tx_id, gene_id, 'Synteny', synteny_scores[aln_id]])
-        r.append([aln_id, tx_id, gene_id, 'AlnExtendsOffContig', aln_extends_off_contig(aln)])
-        r.append([aln_id, tx_id, gene_id, 'AlnPartialMap', alignment_partial_map(aln)])
-        r.append([aln_id, tx_id, gene_id, 'AlnAbutsUnknownBases', aln_abuts_unknown_bases(tx, fasta)])
-        r.append([aln_id, tx_id, gene_id, 'AlnContainsUnknownBases', aln_contains_unknown_bases(tx, fasta)])
-        r.append([aln_id, tx_id, gene_id, 'TransMapCoverage', aln.coverage])
-        r.append([aln_id, tx_id, gene_id, 'TransMapIdentity', aln.identity])
-        r.append([aln_id, tx_id, gene_id, 'TransMapPercentOriginalIntrons', percent_original_introns(aln, tx, ref_aln)])
-    df = pd.DataFrame(r, columns=['AlignmentId', 'TranscriptId', 'GeneId', 'classifier', 'value'])
-    df.value = pd.to_numeric(df.value)
-    return df.set_index(['AlignmentId', 'TranscriptId', 'GeneId', 'classifier'])
+        r.append([aln_id, tx_id, gene_id, paralog_count[tx_id], synteny_scores[aln_id],
+                  aln_extends_off_contig(aln), alignment_partial_map(aln), aln_abuts_unknown_bases(tx, fasta),
+                  aln_contains_unknown_bases(tx, fasta), aln.coverage, aln.identity,
+                  percent_original_introns(aln, tx, ref_aln)])
+    columns = ['AlignmentId', 'TranscriptId', 'GeneId', 'Paralogy', 'Synteny', 'AlnExtendsOffContig', 'AlnPartialMap',
+               'AlnAbutsUnknownBases', 'AlnContainsUnknownBases', 'TransMapCoverage', 'TransMapIdentity',
+               'TransMapPercentOriginalIntrons']
+    df = pd.DataFrame(r, columns=columns)
+    return df.set_index(['AlignmentId', 'TranscriptId', 'GeneId'])
 
 
 ###
@@ -119,7 +117,7 @@ def aln_abuts_unknown_bases(tx, fasta):
     Do any exons in this alignment immediately touch Ns?
 
     :param tx: a GenePredTranscript object
-    :param fasta: pyfasta Fasta object for genome
+    :param fasta: TwoBitFile sequence dictionary for genome
     :return: boolean
     """
     chrom = tx.chromosome
@@ -142,7 +140,7 @@ def aln_contains_unknown_bases(tx, fasta):
     Does this alignment contain unknown bases (Ns)?
 
     :param tx: a GenePredTranscript object
-    :param fasta: pyfasta Fasta object for genome
+    :param fasta: TwoBitFile sequence dictionary for genome
     :return: boolean
     """
     return 'N' in tx.get_mrna(fasta)
@@ -228,8 +226,5 @@ def percent_original_introns(aln, tx, ref_aln):
     :return: float between 0 and 1
     """
     ref_starts = tools.tm2hints.fix_ref_q_starts(ref_aln)
-    c = 0
-    for i in tx.intron_intervals:
-        if tools.tm2hints.is_fuzzy_intron(i, aln, ref_starts, fuzz_distance=7):
-            c += 1
+    c = tools.tm2hints.find_fuzzy_introns(tx.intron_intervals, aln, ref_starts, fuzz_distance=7).sum()
     return tools.mathOps.format_ratio(c, len(tx.intron_intervals), resolve_nan=None)